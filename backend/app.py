@@ -1,16 +1,30 @@
-import os
-
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, jsonify, request, session, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient, errors
+from pymongo import errors
 from models.battle import Battle
-from models.tournament import Tournament, Tournament_Data
+from models.tournament import CheckpointHeld, Tournament, Tournament_Data
 from models.user import Operator, User, Administrator
 from models.logger import Logger
-from models.dbservice import DbService
+from models.adminlog import DEFAULT_PAGE, AdminLevel, admin_logs, parse_time
+from models.dbservice import (
+    POKEMON_BATCH_SIZE,
+    POKEMON_PAGE_SIZE,
+    DbService,
+    PokemonNotFound,
+)
 from models.pokemon import Pokemon
 from models.skill import AttackSkill, DefenseSkill
 from models.battlemanager import BattleManager
+from models.matchups import MATCHUP_PAGE_ROWS, matchup_matrix
+from models.batch import BatchRunner
+from models.jobs import JobQueue, JobQueueFull, TournamentJob
+from models.events import EventRenderer, Verbosity
+from models.replay import ReplayError
+from models.database import db
+from models.stream import sse_message
+from models.stats import LEADERBOARD_PAGE, leaderboard
+from models.ratings import MAX_RATINGS_PAGE, RATINGS_PAGE, rating_engine
+from typing import Iterator
 
 app = Flask(__name__)
 CORS(
@@ -30,15 +44,6 @@ battle_id = 0  # Global battle ID counter
 # TODO: address PR comments (https://github.gatech.edu/jsh6/flask-pokemon-tournament/pull/7/files#diff-a29ff322ddbacd468fea10dfb6857e1026da13b23b9ae94e4c4d0e7d2c794dad) and fix db insert stuff
 # TODO: display stop message to user when stop is input
 
-# Set up MongoDB connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client.pokemon_database
-# collection = db.pokemon
-pokemon_collection = db.pokemon
-battle_collection = db.battle
-tournament_collection = db.tournament
-user_collection = db.user
-
 db_service = DbService()
 # previously was referencing the module, not initializing an object
 logger = Logger()
@@ -46,6 +51,10 @@ logger = Logger()
 operator = Operator("operator", "password2")
 # Authoritative source for battle and tournament creation
 battlemanager = BattleManager()
+# Runs many battles in one request and stores them with one write
+batch_runner = BatchRunner()
+# Background workers for POST /tournament?async=1
+job_queue = JobQueue()
 
 
 def create_unique_index(collection: str, field: str) -> None:
@@ -69,9 +78,37 @@ def initialize() -> None:
     create_unique_index("tournament", "tournament id")
     create_unique_index("user", "username")
 
+    try:
+        db.tournament_round.create_index(
+            [("tournament id", 1), ("round", 1), ("page", 1)], unique=True
+        )
+    except Exception as e:
+        print(f"Error creating index: {e}")
+
+    create_unique_index("tournament_checkpoint", "tournament id")
+
+    try:
+        admin_logs.ensure_indexes()
+        leaderboard.ensure_indexes()
+        rating_engine.ensure_indexes()
+    except Exception as e:
+        print(f"Error creating index: {e}")
+
+    try:
+        matchup_matrix.ensure_indexes()
+    except Exception as e:
+        print(f"Error creating index: {e}")
+
+    try:
+        job_queue.ensure_indexes()
+    except Exception as e:
+        print(f"Error creating index: {e}")
+
 
 # Create uniqueness constraints on tables
 initialize()
+# Background tournaments: heartbeat, and taking over jobs a stopped process left
+job_queue.start()
 
 
 @app.route("/pokemon", methods=["POST"])
@@ -106,6 +143,18 @@ def add_pokemon():
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+# Serializes documents as a JSON array, POKEMON_BATCH_SIZE entries per chunk
+def json_array(documents) -> Iterator[str]:
+    chunk = []
+    yield "["
+    for count, document in enumerate(documents):
+        chunk.append(("," if count else "") + app.json.dumps(document))
+        if len(chunk) == POKEMON_BATCH_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk) + "]"
+
+
 # Get all Pokemon
 @app.route("/pokemon", methods=["GET"])
 def list_pokemon():
@@ -132,12 +181,31 @@ def list_pokemon():
             }
             return jsonify(pokemon_data), 200
         else:
-            # TODO: ideally we would move this logic to dbservice for same reason but whatever
-            pokemon_list = list(pokemon_collection.find({}))
-            for p in pokemon_list:
-                p["_id"] = str(p["_id"])
-            return jsonify(pokemon_list), 200
+            # fields=name,image picks what each entry carries
+            fields = [
+                field.strip()
+                for field in request.args.get("fields", "").split(",")
+                if field.strip()
+            ]
+            after = request.args.get("after")
+            limit = request.args.get("limit")
+
+            # A page at a time, ordered by name; next is the after= for the next
+            if limit is not None or after is not None:
+                pokemon_list, next_after = db_service.get_pokemon_page(
+                    fields, after, int(limit) if limit else POKEMON_PAGE_SIZE
+                )
+                return jsonify({"pokemon": pokemon_list, "next": next_after}), 200
+
+            # Whole roster as one JSON array, streamed while the cursor is read
+            db_service.pokemon_projection(fields)  # bad fields fail before we start
+            return Response(
+                stream_with_context(json_array(db_service.iter_pokemon(fields))),
+                mimetype="application/json",
+            )
 
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
@@ -161,51 +229,29 @@ def start_battle():
         pokemon1_name = data["pokemon1"]
         pokemon2_name = data["pokemon2"]
         seed = data.get("seed")  # Optional seed for deterministic behavior
+        # none, summary or full -- bulk callers can skip turn-level events
+        verbosity = Verbosity.parse(data.get("verbosity"))
 
-        # Fetch Pokémon objects from the database
-        pokemon1 = db.pokemon.find_one({"name": pokemon1_name})
-        pokemon2 = db.pokemon.find_one({"name": pokemon2_name})
+        # Fetch Pokémon from the roster cache, fresh objects for this battle
+        documents = db_service.get_pokemon_documents([pokemon1_name, pokemon2_name])
 
-        if not pokemon1 or not pokemon2:
+        if pokemon1_name not in documents or pokemon2_name not in documents:
             return (
                 jsonify({"error": "One or both Pokémon not found in the database"}),
                 404,
             )
 
         # Create Pokémon objects
-        poke1 = Pokemon(
-            name=pokemon1["name"],
-            max_hp=pokemon1["max hp"],
-            image=pokemon1["image"],
-            attack_skills=[
-                AttackSkill(name, damage)
-                for name, damage in pokemon1["attack skills"].items()
-            ],
-            defense_skills=[
-                DefenseSkill(name, damage)
-                for name, damage in pokemon1["defense skills"].items()
-            ],
-        )
-
-        poke2 = Pokemon(
-            name=pokemon2["name"],
-            max_hp=pokemon2["max hp"],
-            image=pokemon2["image"],
-            attack_skills=[
-                AttackSkill(name, damage)
-                for name, damage in pokemon2["attack skills"].items()
-            ],
-            defense_skills=[
-                DefenseSkill(name, damage)
-                for name, damage in pokemon2["defense skills"].items()
-            ],
-        )
+        poke1 = db_service.pokemon_from_document(documents[pokemon1_name])
+        poke2 = db_service.pokemon_from_document(documents[pokemon2_name])
 
         if seed:
             battlemanager.set_seed(seed)
 
         # Initialize the battle -- battlemanager handles seed tracking and incrementing battle_id
-        battle = battlemanager.create_battle(pokemon1=poke1, pokemon2=poke2)
+        battle = battlemanager.create_battle(
+            pokemon1=poke1, pokemon2=poke2, verbosity=verbosity
+        )
 
         # Get the unique battle ID
         battle_id = battle.get_id()
@@ -220,6 +266,12 @@ def start_battle():
                 200,
             )
         else:
+            # Log lines as before events were stored structured, unless ?format=raw
+            events = battle.get_events()
+            if request.args.get("format") != "raw":
+                events = EventRenderer.from_pokemon(battle.get_pokemon()).render_all(
+                    events
+                )
             return (
                 jsonify(
                     {
@@ -227,7 +279,7 @@ def start_battle():
                         "battle_id": battle_id,
                         "winner": outcome[0].get_name(),
                         "loser": outcome[1].get_name(),
-                        "events": battle.get_events(),
+                        "events": events,
                     }
                 ),
                 200,
@@ -239,12 +291,136 @@ def start_battle():
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+# Run many battles at once, results come back in job order
+@app.route("/battles/batch", methods=["POST"])
+def start_battle_batch():
+    try:
+        data = request.json
+
+        if "jobs" not in data:
+            return jsonify({"error": "Missing required field: jobs"}), 400
+
+        verbosity = Verbosity.parse(data.get("verbosity"))
+        # Log lines like POST /battle, unless ?format=raw
+        results = batch_runner.run(
+            data["jobs"], verbosity, raw=request.args.get("format") == "raw"
+        )
+
+        return (
+            jsonify({"message": "Batch completed", "results": results}),
+            200,
+        )
+
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
+# Stream parameters come from the JSON body, or the query string for GET so
+# browsers can use EventSource (participants may repeat or be comma separated)
+def stream_arguments() -> dict:
+    if request.method == "POST":
+        return request.json or {}
+    data = request.args.to_dict()
+    participants = [
+        name
+        for value in request.args.getlist("participants")
+        for name in value.split(",")
+        if name
+    ]
+    if participants:
+        data["participants"] = participants
+    if "seed" in data:
+        data["seed"] = int(data["seed"])
+    return data
+
+
+def event_stream(messages) -> Response:
+    return Response(
+        stream_with_context(messages),
+        mimetype="text/event-stream",
+        # keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Start battle and stream its turns as Server-Sent Events
+@app.route("/battle/stream", methods=["GET", "POST"])
+def stream_battle():
+    try:
+        data = stream_arguments()
+
+        for field in ["pokemon1", "pokemon2"]:
+            if field not in data:
+                return jsonify({"error": f"Missing required field: {field}"}), 400
+
+        verbosity = Verbosity.parse(data.get("verbosity"))
+        pokemon1 = db_service.get_pokemon(data["pokemon1"])
+        pokemon2 = db_service.get_pokemon(data["pokemon2"])
+
+        if not pokemon1 or not pokemon2:
+            return (
+                jsonify({"error": "One or both Pokémon not found in the database"}),
+                404,
+            )
+
+        seed = data.get("seed")
+        if seed:
+            battlemanager.set_seed(seed)
+
+        battle = battlemanager.create_battle(
+            pokemon1=pokemon1, pokemon2=pokemon2, verbosity=verbosity
+        )
+
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    def messages():
+        battle_id = battle.get_id()
+        renderer = EventRenderer.from_pokemon(battle.get_pokemon())
+        yield sse_message("battle", {"battle_id": battle_id})
+        try:
+            turns = battlemanager.stream_battle(battle)
+            while True:
+                try:
+                    event = next(turns)
+                except StopIteration as stop:
+                    outcome = stop.value
+                    break
+                yield sse_message(
+                    "event", {"event": event, "text": renderer.render(event)}
+                )
+            yield sse_message(
+                "result",
+                {
+                    "battle_id": battle_id,
+                    "winner": outcome[0].get_name(),
+                    "loser": outcome[1].get_name(),
+                },
+            )
+        except Exception as e:
+            yield sse_message("error", {"error": f"An error occurred: {str(e)}"})
+
+    return event_stream(messages())
+
+
 # Get battle
 @app.route("/battle/<battle_id>", methods=["GET"])
 def get_battle_logs(battle_id):
-    # Use dbservice to reduce code redundancy and allow for one-stop function fixes
-    battle = db_service.get_battle(int(battle_id))
-    if not battle:
+    # Events are stored structured; render them as text unless ?format=raw
+    try:
+        if request.args.get("format") == "raw":
+            events = db_service.get_battle_events(int(battle_id))
+        else:
+            events = db_service.get_rendered_battle_events(int(battle_id))
+    except ReplayError as re:
+        # Stored by seed and can't be regenerated; an empty log would pass as
+        # a battle with no turns
+        return jsonify({"error": str(re)}), 500
+    if events is None:
         return jsonify({"error": "Battle not found"}), 404
 
     # JSONify the entire battle result, but you can use whatever you want from it
@@ -253,7 +429,7 @@ def get_battle_logs(battle_id):
             {
                 "message": "Battle Found",
                 "battle_id": battle_id,
-                "events": battle.get_events(),
+                "events": events,
             }
         ),
         200,
@@ -274,26 +450,45 @@ def start_tournament():
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
 
-    participants = []
+    try:
+        verbosity = Verbosity.parse(data.get("verbosity"))
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
 
-    # Fetch all participating pokemon by name from request
-    for pokemon_name in data["participants"]:
-        pokemon = db_service.get_pokemon(pokemon_name)
-        if not pokemon:
-            return (
-                jsonify({"error": f"Pokémon {pokemon_name} not found in the database"}),
-                404,
-            )
-        else:
-            participants.append(pokemon)
+    # Fetch all participating pokemon by name from request, in one query
+    try:
+        participants = db_service.get_pokemon_many(data["participants"])
+    except PokemonNotFound as e:
+        return jsonify({"error": str(e), "missing": e.get_names()}), 404
 
     seed = data.get("seed")  # Optional seed for deterministic behavior
 
     if seed:
         battlemanager.set_seed(seed)
 
+    # Large brackets can run in the background, poll GET /jobs/<id> for progress
+    if request.args.get("async") in ("1", "true"):
+        job = TournamentJob(participants, battlemanager.get_seed(), verbosity)
+        try:
+            job_queue.submit(job)
+        except JobQueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+
+        status_url = f"/jobs/{job.get_job_id()}"
+        return (
+            jsonify(
+                {
+                    "message": "Tournament queued",
+                    "job_id": job.get_job_id(),
+                    "status_url": status_url,
+                }
+            ),
+            202,
+            {"Location": status_url},
+        )
+
     # battlemanager will handle id tracking and seed passing
-    tournament = battlemanager.create_tournament(participants)
+    tournament = battlemanager.create_tournament(participants, verbosity)
     result = battlemanager.start_tournament(tournament)
 
     # Tournament will save itself so no need to worry about that
@@ -317,17 +512,114 @@ def start_tournament():
     )
 
 
+# Start tournament and stream round progress as Server-Sent Events
+@app.route("/tournament/stream", methods=["GET", "POST"])
+def stream_tournament():
+    try:
+        data = stream_arguments()
+
+        if "participants" not in data:
+            return jsonify({"error": "Missing required field: participants"}), 400
+
+        verbosity = Verbosity.parse(data.get("verbosity"))
+
+        try:
+            participants = db_service.get_pokemon_many(data["participants"])
+        except PokemonNotFound as e:
+            return jsonify({"error": str(e), "missing": e.get_names()}), 404
+
+        seed = data.get("seed")
+        if seed:
+            battlemanager.set_seed(seed)
+
+        tournament = battlemanager.create_tournament(participants, verbosity)
+
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    def messages():
+        tournament_id = tournament.get_tournament_id()
+        yield sse_message("tournament", {"tournament_id": tournament_id})
+        try:
+            progress = battlemanager.stream_tournament(tournament)
+            while True:
+                try:
+                    kind, value = next(progress)
+                except StopIteration as stop:
+                    winner = stop.value
+                    break
+                if kind == "round":
+                    yield sse_message("round", {"round": value})
+                elif kind == "battle":
+                    yield sse_message("battle", value)
+                else:
+                    yield sse_message("victors", {"victors": value})
+
+            if winner is None:
+                yield sse_message(
+                    "result",
+                    {
+                        "message": "Tournament terminated early",
+                        "tournament_id": tournament_id,
+                    },
+                )
+            else:
+                yield sse_message(
+                    "result",
+                    {"tournament_id": tournament_id, "winner": winner.get_name()},
+                )
+        except Exception as e:
+            yield sse_message("error", {"error": f"An error occurred: {str(e)}"})
+
+    return event_stream(messages())
+
+
+# Finish a tournament that was interrupted, from its last completed round
+@app.route("/tournament/<tournament_id>/resume", methods=["POST"])
+def resume_tournament(tournament_id):
+    try:
+        tournament = battlemanager.resume_tournament(int(tournament_id))
+    except ValueError as ve:
+        return jsonify({"error": f"Cannot resume tournament: {str(ve)}"}), 409
+    except CheckpointHeld as ch:
+        return jsonify({"error": f"Cannot resume tournament: {str(ch)}"}), 409
+
+    if tournament is None:
+        return jsonify({"error": "No interrupted tournament with this id"}), 404
+
+    result = battlemanager.start_tournament(tournament)
+    if not result:
+        return (
+            jsonify(
+                {
+                    "message": "Tournament terminated early",
+                    "tournament_id": tournament.get_tournament_id(),
+                }
+            ),
+            200,
+        )
+    return jsonify(
+        {
+            "message": "Tournament resumed",
+            "tournament_id": tournament.get_tournament_id(),
+            "winner": result.get_name(),
+        }
+    )
+
+
 # Get tournament
 @app.route("/tournament/<tournament_id>", methods=["GET"])
 def get_tournament(tournament_id):
     # Fetch the tournament data directly from the database
-    retrieved_tourney = db.tournament.find_one({"tournament id": int(tournament_id)})
+    retrieved_tourney = db_service.get_tournament_document(int(tournament_id))
 
     if not retrieved_tourney:
         return jsonify({"error": "Tournament not found"}), 404
 
     # Extract relevant data from the retrieved tournament
-    events = retrieved_tourney["events"]
+    events = db_service.get_tournament_events(int(tournament_id), retrieved_tourney)
     winner = retrieved_tourney.get("winner", "")
 
     # Prepare the response with the tournament details
@@ -337,9 +629,70 @@ def get_tournament(tournament_id):
         "winner": winner,
     }
 
+    # ?expand=battles adds every battle's log, fetched with one query
+    if "battles" in request.args.get("expand", "").split(","):
+        battle_ids = [
+            battle["battle_id"]
+            for tournament_round in events
+            for battle in tournament_round["events"]
+        ]
+        try:
+            battles = db_service.get_battles_events(
+                battle_ids, raw=request.args.get("format") == "raw"
+            )
+        except ReplayError as re:
+            return jsonify({"error": str(re)}), 500
+        response["battles"] = [
+            battles[battle_id] for battle_id in battle_ids if battle_id in battles
+        ]
+
     return jsonify(response), 200
 
 
+# Job Routes
+
+
+# Get status and round progress of a background tournament
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get_status_data(job_id)
+
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job), 200
+
+
+# Matchup Routes
+
+
+# Get one pokemon's row of win rates with ?pokemon=<name>, or a page of rows
+# by name with ?after=<name>&limit=<rows>; next is the after= for the next
+@app.route("/matchups", methods=["GET"])
+def get_matchups():
+    try:
+        pokemon_name = request.args.get("pokemon")
+        if pokemon_name:
+            matrix = matchup_matrix.get_matrix(pokemon_name)
+            if not matrix:
+                return (
+                    jsonify({"error": f"No matchups found for '{pokemon_name}'"}),
+                    404,
+                )
+            return jsonify({"matchups": matrix}), 200
+
+        limit = request.args.get("limit")
+        matrix, next_after = matchup_matrix.get_page(
+            request.args.get("after"), int(limit) if limit else MATCHUP_PAGE_ROWS
+        )
+        return jsonify({"matchups": matrix, "next": next_after}), 200
+
+    except ValueError as ve:
+        return jsonify({"error": f"Validation error: {str(ve)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+
 # Users Routes
 
 
@@ -383,19 +736,86 @@ def login():
         return jsonify({"message": f"{username} logged in successfully."}), 200
 
     except Exception as e:
-        logger.admin_log(f"Login error: {str(e)}")
+        logger.admin_log(f"Login error: {str(e)}", AdminLevel.ERROR)
         return jsonify({"error": f"An error occurred during login: {str(e)}"}), 500
 
 
+# Pokemon ranked by battle win rate, then battles fought; limit is the top K
+# and next continues after them
+@app.route("/leaderboard", methods=["GET"])
+def get_leaderboard():
+    try:
+        entries, next_cursor = leaderboard.get_page(
+            int(request.args.get("limit", LEADERBOARD_PAGE)),
+            request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"leaderboard": entries, "next": next_cursor}), 200
+
+
+# Elo ratings: ?pokemon=<name> gives its rating and rank, otherwise
+# ?start=&end= the ratings ranked start to end (1 is the best)
+@app.route("/ratings", methods=["GET"])
+def get_ratings():
+    name = request.args.get("pokemon")
+    if name is not None:
+        rating = rating_engine.get_rating(name)
+        if rating is None:
+            return jsonify({"error": f"{name} has no rating yet"}), 404
+        return jsonify(rating), 200
+
+    try:
+        start = int(request.args.get("start", 1))
+        end = int(request.args.get("end", start + RATINGS_PAGE - 1))
+    except ValueError:
+        return jsonify({"error": "start and end must be integers"}), 400
+    if start < 1 or end < start or end - start >= MAX_RATINGS_PAGE:
+        return (
+            jsonify(
+                {"error": f"Need 1 <= start <= end, at most {MAX_RATINGS_PAGE} ranks"}
+            ),
+            400,
+        )
+
+    return (
+        jsonify(
+            {
+                "ratings": rating_engine.get_range(start, end),
+                "total": rating_engine.size(),
+            }
+        ),
+        200,
+    )
+
+
 #Get the Admin Logs from the database
 @app.route("/adminLogs", methods=["GET"])
 def getAdminLogs():
-    # Fetch the tournament data directly from the database
-    retrieved_logs = db_service.get_admin_logs()
+    # Newest first; since/until bound the time range, cursor continues from
+    # the "next" of the previous page
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        level = request.args.get("level")
+        battle_id = request.args.get("battle_id")
+        tournament_id = request.args.get("tournament_id")
+        events, next_cursor = db_service.get_admin_logs(
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            cursor=request.args.get("cursor"),
+            limit=int(request.args.get("limit", DEFAULT_PAGE)),
+            level=AdminLevel(level) if level else None,
+            battle_id=int(battle_id) if battle_id else None,
+            tournament_id=int(tournament_id) if tournament_id else None,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Prepare the response with the tournament details
     response = {
-        "events": retrieved_logs,
+        "events": events,
+        "next": next_cursor,
     }
 
     return jsonify(response), 200
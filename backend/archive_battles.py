@@ -0,0 +1,15 @@
+import sys
+
+from models.archive import ARCHIVE_AFTER_DAYS, battle_archive
+
+# Moves battles stored more than BATTLE_ARCHIVE_AFTER_DAYS days ago (or the
+# days given) out of the battle collection into sealed segment files. Safe to
+# run while the app serves requests, e.g. daily from cron: GET /battle/<id>
+# finds a battle in the collection or the archive throughout.
+if __name__ == "__main__":
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else ARCHIVE_AFTER_DAYS
+    moved = battle_archive.archive_older_than(days)
+    print(
+        f"Archived {moved} battles older than {days:g} days, "
+        f"{battle_archive.size()} in {battle_archive.get_directory()}."
+    )
@@ -0,0 +1,86 @@
+# Battle lookups by id from the battle collection against the same battles
+# moved to archive segments, on local storage
+# Run from backend/: STORAGE_BACKEND=sqlite python -m benchmarks.bench_archive [battles]
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Before any model touches the database
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault(
+    "SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_archive.sqlite3")
+)
+
+import bson
+
+from benchmarks.bench_rounds import make_participants
+from models.archive import BattleArchive
+from models.battle import Battle, Battle_Data, StorageMode
+from models.database import db
+from models.dbservice import DbService
+
+
+def store_battles(count: int) -> None:
+    participants = make_participants(64)
+    pick = random.Random(2024)
+    batch = []
+    for battle_id in range(1, count + 1):
+        pokemon1, pokemon2 = pick.sample(participants, 2)
+        battle = Battle(pokemon1, pokemon2, battle_id, battle_id)
+        battle.play()
+        batch.append(Battle_Data(battle, StorageMode.FULL).get_battle_data())
+        if len(batch) == 1000:
+            db.battle.insert_many(batch)
+            batch = []
+    if batch:
+        db.battle.insert_many(batch)
+
+
+def lookups(battle_ids) -> float:
+    service = DbService()
+    start = time.perf_counter()
+    for battle_id in battle_ids:
+        if service.find_battle_document(battle_id) is None:
+            raise SystemExit(f"battle {battle_id} not found")
+    return (time.perf_counter() - start) / len(battle_ids)
+
+
+if __name__ == "__main__":
+    import models.dbservice
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    backend = os.environ["STORAGE_BACKEND"]
+    db.battle.create_index([("battle id", 1)], unique=True)
+    archive = BattleArchive(tempfile.mkdtemp())
+    models.dbservice.battle_archive = archive
+
+    store_battles(count)
+    battle_ids = random.Random(7).sample(range(1, count + 1), min(count, 2000))
+    # Compared as BSON: the memory backend hands back the tuples it was given
+    expected = [bson.encode(DbService().find_battle_document(i)) for i in battle_ids]
+    hot = lookups(battle_ids)
+
+    start = time.perf_counter()
+    moved = archive.archive(datetime.now(timezone.utc) + timedelta(minutes=1))
+    archive_time = time.perf_counter() - start
+    archived = lookups(battle_ids)
+
+    if [
+        bson.encode(DbService().find_battle_document(i)) for i in battle_ids
+    ] != expected:
+        raise SystemExit("archived battles differ from the stored ones")
+    size = sum(
+        os.path.getsize(os.path.join(archive.get_directory(), name))
+        for name in os.listdir(archive.get_directory())
+    )
+    print(
+        f"  archived {moved:,} battles in {archive_time:,.2f}s, {size / moved:,.0f} bytes each"
+    )
+    print(f"  battle collection left: {db.battle.count_documents({})}")
+    print(f"  {backend + ' lookup:':<17} {hot * 1e6:>8,.1f} us per battle")
+    print(
+        f"  archive lookup:   {archived * 1e6:>8,.1f} us per battle (miss, then segment)"
+    )
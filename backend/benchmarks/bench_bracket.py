@@ -0,0 +1,45 @@
+# Bracket engine time and memory from 4 to 131,072 participants
+# Run from backend/: python -m benchmarks.bench_bracket [largest]
+import sys
+import time
+import tracemalloc
+
+import models.battle
+import models.tournament
+from benchmarks.bench_rounds import NullLogger, make_participants
+from models.events import Verbosity
+from models.ratings import RatingEngine
+from models.tournament import Tournament
+
+
+# Seconds and peak bytes the bracket allocates on top of its participants
+def run(count: int):
+    participants = make_participants(count)
+    tracemalloc.start()
+    start = time.perf_counter()
+    tournament = Tournament(participants, 1, 1, 2024, Verbosity.NONE, workers=1)
+    tournament.run_tournament()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if len(participants) != count:
+        raise SystemExit("the participant list was changed")
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 131_072
+
+    models.battle.logger = NullLogger()
+    models.tournament.logger = NullLogger()
+    # Rate in memory only, nothing to load
+    models.battle.rating_engine = models.tournament.rating_engine = RatingEngine([])
+
+    sizes = [4, 5, 16, 64, 256, 1024, 1025, 4096, 16_384, 65_536, 100_001, 131_072]
+    print(f"  {'participants':>12} {'seconds':>9} {'battles/s':>10} {'peak KiB':>9}")
+    for count in [size for size in sizes if size <= largest]:
+        elapsed, peak = run(count)
+        print(
+            f"  {count:>12,} {elapsed:>9.2f} {(count - 1) / elapsed:>10,.0f}"
+            f" {peak / 1024:>9,.0f}"
+        )
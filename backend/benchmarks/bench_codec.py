@@ -0,0 +1,116 @@
+# Stored size and codec time of battle and tournament documents, with and
+# without packed events
+# Run from backend/: python -m benchmarks.bench_codec [battles]
+import os
+import random
+import sys
+import time
+
+# Before any model touches the database; the dictionary is trained from it
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import bson
+
+from benchmarks.bench_rounds import make_participants
+from models import codec
+from models.battle import Battle, Battle_Data, StorageMode
+from models.database import db
+from models.events import EventRenderer
+from models.tournament import Tournament, Tournament_Data
+
+
+def battle_documents(count: int, compression: str, first_seed: int = 0):
+    codec.EVENT_COMPRESSION = compression
+    participants = make_participants(64)
+    pick = random.Random(2024 + first_seed)
+    documents = []
+    for battle_id in range(first_seed, first_seed + count):
+        pokemon1, pokemon2 = pick.sample(participants, 2)
+        battle = Battle(pokemon1, pokemon2, battle_id, battle_id)
+        battle.play()
+        documents.append(Battle_Data(battle, StorageMode.FULL).get_battle_data())
+    return documents
+
+
+# Events as rendered log lines, the way battles used to be stored
+def text_documents(documents):
+    return [
+        dict(
+            document,
+            events=EventRenderer.from_document(document).render_all(document["events"]),
+        )
+        for document in documents
+    ]
+
+
+def tournament_document(compression: str) -> dict:
+    codec.EVENT_COMPRESSION = compression
+    tournament = Tournament(make_participants(1024), 1, 1, 2024)
+    tournament.run_tournament()
+    return Tournament_Data(tournament).get_tournament_data()
+
+
+def stored_bytes(documents) -> int:
+    return sum(len(bson.encode(document)) for document in documents)
+
+
+# A dictionary trained on other battles than the ones measured
+def train_dictionary(count: int) -> None:
+    db.battle.insert_many(battle_documents(count, "off", first_seed=10**6))
+    codec.train_dictionary(count)
+    db.battle.delete_many({})
+
+
+if __name__ == "__main__":
+    import models.tournament
+    from benchmarks.bench_rounds import NullLogger
+    from models.ratings import RatingEngine
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    models.battle.logger = NullLogger()
+    models.tournament.logger = NullLogger()
+    models.battle.rating_engine = models.tournament.rating_engine = RatingEngine([])
+
+    full = battle_documents(count, "off")
+    as_stored = [bson.decode(bson.encode(document)) for document in full]
+    tuples = stored_bytes(full)
+    text = stored_bytes(text_documents(full))
+
+    runs = [("zlib", "zlib")]
+    if codec.zstandard is None:
+        print("  zstandard not installed, zstd runs skipped")
+    else:
+        runs += [("zstd", "zstd"), ("zstd, dictionary", "zstd")]
+
+    print(f"  {count} battles, bytes per battle document as written")
+    print(f"  text events:         {text / count:>6,.0f}")
+    print(f"  event tuples:        {tuples / count:>6,.0f}")
+    for label, compression in runs:
+        if label == "zstd, dictionary":
+            train_dictionary(count)
+        packed = battle_documents(count, compression)
+        start = time.perf_counter()
+        unpacked = [codec.unpack_battle(document) for document in packed]
+        unpack_time = time.perf_counter() - start
+        if unpacked != as_stored:
+            raise SystemExit(f"{label}: unpacked battles differ from the originals")
+        start = time.perf_counter()
+        for document in full:
+            codec.pack_battle(document)
+        pack_time = time.perf_counter() - start
+
+        compressed = stored_bytes(packed)
+        blob = sum(len(document[codec.PACKED_EVENTS]) for document in packed)
+        print(
+            f"  {label + ':':<20} {compressed / count:>6,.0f}  "
+            f"{tuples / compressed:4.1f}x tuples, {text / compressed:4.1f}x text; "
+            f"blob {blob / count:,.0f}; pack {pack_time / count * 1e6:,.1f} us, "
+            f"unpack {unpack_time / count * 1e6:,.1f} us"
+        )
+
+    rounds = stored_bytes([tournament_document("off")])
+    packed_rounds = stored_bytes([tournament_document("zlib")])
+    print(
+        f"  1024-player tournament: {rounds:,} bytes, packed {packed_rounds:,} "
+        f"({rounds / packed_rounds:.1f}x)"
+    )
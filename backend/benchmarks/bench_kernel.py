@@ -0,0 +1,81 @@
+# Turns per second of the original object turn loop against the slot kernel
+# Run from backend/: python -m benchmarks.bench_kernel [battles]
+import sys
+import time
+
+from models.battle import Battle
+from models.kernel import compile_fighters, run_turns
+from models.pokemon import Pokemon
+from models.skill import AttackSkill, DefenseSkill
+
+
+def make_pair(seed: int):
+    pokemon = []
+    for name, max_hp, attacks in (
+        ("Pikachu", 25, [1, 2, 3, 6]),
+        ("Lapras", 25, [1, 2, 3, 6]),
+    ):
+        pokemon.append(
+            Pokemon(
+                name=name,
+                max_hp=max_hp,
+                image="",
+                attack_skills=[
+                    AttackSkill(f"{name} {i}", d) for i, d in enumerate(attacks)
+                ],
+                defense_skills=[
+                    DefenseSkill("Endure", 1),
+                    DefenseSkill("Block", 2),
+                    DefenseSkill("Protect", 3),
+                ],
+            )
+        )
+    battle = Battle(pokemon[0], pokemon[1], seed, seed)
+    return battle, pokemon
+
+
+# The loop start_battle used to run, driven through the public Battle methods
+def object_loop(battle: Battle, pokemon) -> int:
+    turns = 0
+    actor, waiting = pokemon
+    while not battle.is_battle_over():
+        target = battle.get_action_from_pokemon(actor)
+        battle.execute_skill(actor, target)
+        actor, waiting = waiting, actor
+        turns += 1
+    return turns
+
+
+def kernel_loop(battle: Battle, pokemon) -> int:
+    first, second = compile_fighters(*pokemon)
+    turns = run_turns(first, second, battle.get_events())
+    first.store()
+    second.store()
+    return turns
+
+
+def measure(loop, count: int):
+    logs = []
+    turns = 0
+    elapsed = 0.0
+    for seed in range(count):
+        battle, pokemon = make_pair(seed)
+        start = time.perf_counter()
+        turns += loop(battle, pokemon)
+        elapsed += time.perf_counter() - start
+        logs.append((battle.get_events(), [p.get_current_hp() for p in pokemon]))
+    return turns / elapsed, logs
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+
+    before, before_logs = measure(object_loop, count)
+    after, after_logs = measure(kernel_loop, count)
+
+    if before_logs != after_logs:
+        raise SystemExit("kernel output differs from the object loop")
+
+    print(f"  object loop: {before:,.0f} turns/s")
+    print(f"  slot kernel: {after:,.0f} turns/s")
+    print(f"  speedup:     {after / before:,.2f}x (identical logs for {count} seeds)")
@@ -0,0 +1,64 @@
+# Compare looping Battle.start_battle against the batched MonteCarloEngine
+# Run from backend/: python -m benchmarks.bench_montecarlo [battles]
+import os
+import sys
+import time
+
+# start_battle stores every battle as the app does, in the in-memory backend
+# so no mongod is needed; set STORAGE_BACKEND to time another one
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from benchmarks.bench_storage import create_indexes
+from models.battle import Battle
+from models.montecarlo import MonteCarloEngine
+from models.pokemon import Pokemon
+from models.skill import AttackSkill, DefenseSkill
+
+
+def make_pokemon(name: str, max_hp: int, attacks: list) -> Pokemon:
+    return Pokemon(
+        name=name,
+        max_hp=max_hp,
+        image="",
+        attack_skills=[AttackSkill(f"{name} {i}", d) for i, d in enumerate(attacks)],
+        defense_skills=[
+            DefenseSkill("Endure", 1),
+            DefenseSkill("Block", 2),
+            DefenseSkill("Protect", 3),
+        ],
+    )
+
+
+def loop_battles(seeds) -> float:
+    start = time.perf_counter()
+    for seed in seeds:
+        pikachu = make_pokemon("Pikachu", 25, [1, 2, 3, 6])
+        snorlax = make_pokemon("Snorlax", 40, [0, 6])
+        Battle(pikachu, snorlax, seed, seed).start_battle()
+    return time.perf_counter() - start
+
+
+def batch_battles(seeds) -> float:
+    engine = MonteCarloEngine()
+    pikachu = make_pokemon("Pikachu", 25, [1, 2, 3, 6])
+    snorlax = make_pokemon("Snorlax", 40, [0, 6])
+    start = time.perf_counter()
+    outcome = engine.simulate(pikachu, snorlax, seeds)
+    elapsed = time.perf_counter() - start
+    print(f"  batch win rate for Pikachu: {outcome.get_win_rate():.3f}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    create_indexes()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    seeds = list(range(count))
+
+    # The loop is slow, so time a slice of it and scale up
+    loop_count = min(count, 5_000)
+    loop_time = loop_battles(seeds[:loop_count]) * count / loop_count
+    batch_time = batch_battles(seeds)
+
+    print(f"  looped start_battle: {count / loop_time:,.0f} battles/s")
+    print(f"  MonteCarloEngine:    {count / batch_time:,.0f} battles/s")
+    print(f"  speedup:             {loop_time / batch_time:,.1f}x")
@@ -0,0 +1,96 @@
+# Serial against process-pool round execution for one seeded bracket
+# Run from backend/: python -m benchmarks.bench_rounds [participants] [workers]
+import os
+import sys
+import time
+
+from pymongo.results import UpdateResult
+
+import models.battle
+import models.tournament
+from models.pokemon import Pokemon
+from models.ratings import RatingEngine
+from models.skill import AttackSkill, DefenseSkill
+from models.tournament import Tournament
+
+
+# Tournaments persist every battle; we only want to time the bracket
+class NullLogger:
+    def log(self, data, dbcollection):
+        return None
+
+    def insert_many(self, select, documents):
+        return None
+
+    def remove(self, select, filter_query):
+        return None
+
+    # Checkpoint writes after the first are fenced; ours always land
+    def update(self, select, filter_query, data):
+        return UpdateResult({"n": 1, "nModified": 1}, True)
+
+    def admin_log(self, message, level=None, battle_id=None, tournament_id=None):
+        return 0
+
+    def bulk_write(self, select, operations):
+        return None
+
+    def get_report(self):
+        return {"upserted": 0, "modified": 0, "errors": []}
+
+    # Stands in for its own BulkLogger
+    def bulk(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+def make_participants(count: int):
+    return [
+        Pokemon(
+            name=f"Pokemon {i}",
+            max_hp=20 + i % 17,
+            image="",
+            attack_skills=[
+                AttackSkill("Tackle", 1 + i % 3),
+                AttackSkill("Strike", 2 + i % 5),
+                AttackSkill("Blast", 3 + i % 7),
+            ],
+            defense_skills=[DefenseSkill("Endure", 1), DefenseSkill("Protect", 3)],
+        )
+        for i in range(count)
+    ]
+
+
+def run(count: int, workers: int):
+    tournament = Tournament(make_participants(count), 1, 1, 2024, workers=workers)
+    start = time.perf_counter()
+    winner = tournament.run_tournament()
+    elapsed = time.perf_counter() - start
+    return elapsed, (winner.get_name(), tournament.get_events())
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    models.battle.logger = NullLogger()
+    models.tournament.logger = NullLogger()
+    # Rate in memory only, nothing to load
+    models.battle.rating_engine = models.tournament.rating_engine = RatingEngine([])
+
+    serial, serial_result = run(count, 1)
+    parallel, parallel_result = run(count, workers)
+
+    if serial_result != parallel_result:
+        raise SystemExit("parallel rounds differ from serial rounds")
+
+    print(f"  serial:         {serial:,.2f}s")
+    print(f"  {workers} workers:{'':<{6 - len(str(workers))}} {parallel:,.2f}s")
+    print(
+        f"  speedup:        {serial / parallel:,.2f}x ({count} participants, identical brackets)"
+    )
@@ -0,0 +1,62 @@
+# Tournament time with every write persisted against the bracket alone, on
+# local storage so no mongod (or network) is involved
+# Run from backend/: STORAGE_BACKEND=sqlite python -m benchmarks.bench_storage [participants]
+import os
+import sys
+import tempfile
+import time
+
+# Before any model touches the database
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault(
+    "SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "bench_storage.sqlite3")
+)
+
+import models.battle
+import models.tournament
+from benchmarks.bench_rounds import NullLogger, make_participants
+from models.database import db
+from models.ratings import RatingEngine
+from models.stats import leaderboard
+from models.tournament import Tournament
+
+
+# The indexes app.initialize() makes for what battles and tournaments write
+def create_indexes() -> None:
+    db.battle.create_index([("battle id", 1)], unique=True)
+    db.pokemon.create_index([("name", 1)], unique=True)
+    db.tournament_round.create_index(
+        [("tournament id", 1), ("round", 1), ("page", 1)], unique=True
+    )
+    leaderboard.ensure_indexes()
+    RatingEngine().ensure_indexes()
+
+
+def run(count: int):
+    tournament = Tournament(make_participants(count), 1, 1, 2024)
+    start = time.perf_counter()
+    winner = tournament.run_tournament()
+    elapsed = time.perf_counter() - start
+    return elapsed, (winner.get_name(), tournament.get_events())
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    backend = os.environ["STORAGE_BACKEND"]
+
+    create_indexes()
+    models.battle.rating_engine = models.tournament.rating_engine = RatingEngine([])
+    stored, stored_result = run(count)
+    battles = db.battle.count_documents({})
+
+    models.battle.logger = NullLogger()
+    models.tournament.logger = NullLogger()
+    models.battle.rating_engine = models.tournament.rating_engine = RatingEngine([])
+    bracket, bracket_result = run(count)
+
+    if stored_result != bracket_result:
+        raise SystemExit("stored tournament differs from the bracket alone")
+
+    print(f"  bracket only:   {bracket:,.2f}s")
+    print(f"  {backend + ':':<15} {stored:,.2f}s ({battles} battles stored)")
+    print(f"  storage share:  {(stored - bracket) / stored:.0%}")
@@ -0,0 +1,225 @@
+import atexit
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from threading import Lock, Thread
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from models.database import db
+
+# Entries held back and written with one insert_many, whichever comes first
+ADMIN_LOG_BATCH = int(os.getenv("ADMIN_LOG_BATCH", "100"))
+ADMIN_LOG_FLUSH_SECONDS = float(os.getenv("ADMIN_LOG_FLUSH_SECONDS", "1"))
+
+# Page size for GET /adminLogs
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class AdminLevel(Enum):
+    INFO = "info"
+    WARNING = "warning"
+    ERROR = "error"
+
+
+class AdminLog:
+    """
+    Admin messages, one document per entry in the admin_log collection:
+    {"time", "level", "message"} plus "battle id" / "tournament id" when the
+    entry is about one. Entries are never updated, only appended, and are
+    buffered so a burst of messages costs one insert_many. A timer thread
+    writes what is held once it is flush_seconds old, even if nothing else is
+    logged; reads flush first, so a process always sees its own messages.
+
+    Pages are newest first, ordered by (time, _id); the cursor of the last
+    entry on a page picks up exactly where it ended however many entries are
+    written meanwhile.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = ADMIN_LOG_BATCH,
+        flush_seconds: float = ADMIN_LOG_FLUSH_SECONDS,
+    ) -> None:
+        self.__batch_size = batch_size
+        self.__flush_seconds = flush_seconds
+        self.__pending: List[dict] = []
+        self.__last_flush = time.monotonic()
+        self.__lock = Lock()
+        self.__timer: Optional[Thread] = None
+
+    def ensure_indexes(self) -> None:
+        db.admin_log.create_index([("time", DESCENDING), ("_id", DESCENDING)])
+        db.admin_log.create_index(
+            [("level", ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)]
+        )
+        for field in ("battle id", "tournament id"):
+            db.admin_log.create_index(
+                [(field, ASCENDING), ("time", DESCENDING), ("_id", DESCENDING)],
+                sparse=True,
+            )
+
+    def write(
+        self,
+        message: str,
+        level: AdminLevel = AdminLevel.INFO,
+        battle_id: Optional[int] = None,
+        tournament_id: Optional[int] = None,
+    ) -> None:
+        # Mongo keeps milliseconds, cursors must match what is stored
+        now = datetime.now(timezone.utc)
+        entry = {
+            "time": now.replace(microsecond=now.microsecond // 1000 * 1000),
+            "level": level.value,
+            "message": message,
+        }
+        if battle_id is not None:
+            entry["battle id"] = battle_id
+        if tournament_id is not None:
+            entry["tournament id"] = tournament_id
+
+        with self.__lock:
+            self.__pending.append(entry)
+            if self.__timer is None:
+                self.__timer = Thread(
+                    target=self.flush_periodically, name="admin-log-flush", daemon=True
+                )
+                self.__timer.start()
+            due = (
+                len(self.__pending) >= self.__batch_size
+                or time.monotonic() - self.__last_flush >= self.__flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.__lock:
+            pending, self.__pending = self.__pending, []
+            self.__last_flush = time.monotonic()
+        if pending:
+            db.admin_log.insert_many(pending, ordered=True)
+        return len(pending)
+
+    # Runs on the timer thread, started by the first write of each process
+    def flush_periodically(self) -> None:
+        while True:
+            time.sleep(self.__flush_seconds)
+            with self.__lock:
+                due = (
+                    self.__pending
+                    and time.monotonic() - self.__last_flush >= self.__flush_seconds
+                )
+            if not due:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Admin log flush failed: {str(e)}")
+
+    # A forked child starts with its own, empty buffer and no timer thread
+    def reset(self) -> None:
+        self.__pending = []
+        self.__last_flush = time.monotonic()
+        self.__lock = Lock()
+        self.__timer = None
+
+    def get_page(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = DEFAULT_PAGE,
+        level: Optional[AdminLevel] = None,
+        battle_id: Optional[int] = None,
+        tournament_id: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        self.flush()
+
+        conditions: List[Dict] = []
+        if since is not None:
+            conditions.append({"time": {"$gte": since}})
+        if until is not None:
+            conditions.append({"time": {"$lt": until}})
+        if level is not None:
+            conditions.append({"level": level.value})
+        if battle_id is not None:
+            conditions.append({"battle id": battle_id})
+        if tournament_id is not None:
+            conditions.append({"tournament id": tournament_id})
+        if cursor is not None:
+            after_time, after_id = decode_cursor(cursor)
+            conditions.append(
+                {
+                    "$or": [
+                        {"time": {"$lt": after_time}},
+                        {"time": after_time, "_id": {"$lt": after_id}},
+                    ]
+                }
+            )
+
+        query = {"$and": conditions} if conditions else {}
+        limit = max(1, min(limit, MAX_PAGE))
+        # One extra tells us whether there is another page
+        documents = list(
+            db.admin_log.find(query)
+            .sort([("time", DESCENDING), ("_id", DESCENDING)])
+            .limit(limit + 1)
+        )
+        next_cursor = (
+            encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        )
+        return [entry_data(document) for document in documents[:limit]], next_cursor
+
+
+# ISO 8601 ("2024-05-01T12:00:00Z") or seconds since the epoch, naive
+# times are UTC
+def parse_time(value: str) -> datetime:
+    try:
+        if value.replace(".", "", 1).isdigit():
+            return EPOCH + timedelta(seconds=float(value))
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+# "<milliseconds since epoch>-<object id>" of the last entry of a page
+def encode_cursor(document: dict) -> str:
+    elapsed = document["time"].replace(tzinfo=timezone.utc) - EPOCH
+    return f"{elapsed // timedelta(milliseconds=1)}-{document['_id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        millis, object_id = cursor.split("-", 1)
+        return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(object_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# An entry as the API returns it
+def entry_data(document: dict) -> dict:
+    data = {
+        "time": document["time"].replace(tzinfo=timezone.utc).isoformat(),
+        "level": document["level"],
+        "message": document["message"],
+    }
+    for field, key in (("battle id", "battle_id"), ("tournament id", "tournament_id")):
+        if field in document:
+            data[key] = document[field]
+    return data
+
+
+admin_logs = AdminLog()
+atexit.register(admin_logs.flush)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=admin_logs.reset)
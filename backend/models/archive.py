@@ -0,0 +1,277 @@
+import fcntl
+import heapq
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from pymongo import DeleteOne
+
+from models.database import db
+
+# Where sealed segments live, one .seg and one .idx file each
+ARCHIVE_DIR = os.getenv("BATTLE_ARCHIVE_DIR", "battle_archive")
+# Battles stored longer ago than this are moved to the archive
+ARCHIVE_AFTER_DAYS = float(os.getenv("BATTLE_ARCHIVE_AFTER_DAYS", "7"))
+# Most battles in one segment, and battles deleted from the battle collection
+# per bulk write once their segment is sealed
+SEGMENT_BATTLES = 100_000
+DELETE_BATCH = 1000
+
+INDEX_MAGIC = b"PKBI"
+INDEX_FORMAT = 1
+INDEX_HEADER = struct.Struct("<4sII")  # magic, format, entries
+INDEX_ENTRY = struct.Struct("<qQI")  # battle id, offset in the .seg, length
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def segment_paths(directory: str, number: int) -> Tuple[str, str]:
+    base = os.path.join(directory, f"{number:08d}")
+    return base + ".seg", base + ".idx"
+
+
+class Segment:
+    """
+    One sealed segment. The .seg file holds battle documents as BSON, back
+    to back; the .idx file a header and a fixed-width (battle id, offset,
+    length) entry per battle, sorted by id. The index is memory-mapped and
+    searched by bisection, and only the one record found is read from the
+    .seg file.
+    """
+
+    def __init__(self, directory: str, number: int) -> None:
+        self.__number = number
+        data_path, index_path = segment_paths(directory, number)
+        with open(index_path, "rb") as index_file:
+            self.__index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = INDEX_HEADER.unpack_from(self.__index, 0)
+        if magic != INDEX_MAGIC or version != INDEX_FORMAT:
+            self.__index.close()
+            raise ArchiveError(f"{index_path} is not a battle archive index")
+        self.__count = count
+        self.__data = os.open(data_path, os.O_RDONLY)
+        self.__first_id = self.entry(0)[0]
+        self.__last_id = self.entry(count - 1)[0]
+
+    def get_number(self) -> int:
+        return self.__number
+
+    def get_first_id(self) -> int:
+        return self.__first_id
+
+    def get_last_id(self) -> int:
+        return self.__last_id
+
+    def size(self) -> int:
+        return self.__count
+
+    # (battle id, offset, length) of the position-th battle in id order
+    def entry(self, position: int) -> Tuple[int, int, int]:
+        return INDEX_ENTRY.unpack_from(
+            self.__index, INDEX_HEADER.size + position * INDEX_ENTRY.size
+        )
+
+    # Position of the battle in the index, None if the segment lacks it
+    def position(self, battle_id: int) -> Optional[int]:
+        if not self.__first_id <= battle_id <= self.__last_id:
+            return None
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < battle_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.__count and self.entry(low)[0] == battle_id:
+            return low
+        return None
+
+    def read(self, position: int) -> dict:
+        _, offset, length = self.entry(position)
+        return bson.decode(os.pread(self.__data, length, offset))
+
+    def find(self, battle_id: int) -> Optional[dict]:
+        position = self.position(battle_id)
+        return None if position is None else self.read(position)
+
+    def iter_documents(self) -> Iterator[dict]:
+        for position in range(self.__count):
+            yield self.read(position)
+
+    def close(self) -> None:
+        self.__index.close()
+        os.close(self.__data)
+
+
+# Appends the documents, already in battle id order, to a new segment and
+# seals it by renaming its index into place; returns the ids written
+def write_segment(directory: str, number: int, documents: Iterable[dict]) -> List[int]:
+    data_path, index_path = segment_paths(directory, number)
+    entries: List[Tuple[int, int, int]] = []
+    offset = 0
+    with open(data_path, "wb") as data_file:
+        for document in documents:
+            record = bson.encode(document)
+            data_file.write(record)
+            entries.append((document["battle id"], offset, len(record)))
+            offset += len(record)
+        data_file.flush()
+        os.fsync(data_file.fileno())
+    if not entries:
+        os.remove(data_path)
+        return []
+
+    entries.sort()
+    partial_path = index_path + ".partial"
+    with open(partial_path, "wb") as index_file:
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT, len(entries)))
+        for entry in entries:
+            index_file.write(INDEX_ENTRY.pack(*entry))
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    os.replace(partial_path, index_path)
+    return [entry[0] for entry in entries]
+
+
+class BattleArchive:
+    """
+    Battles moved out of the battle collection once they are old, into
+    append-only segment files that are never changed after they are sealed.
+    A battle is read from the collection first and from the archive when the
+    collection no longer has it. Segments written by another process (the
+    archive job) are picked up when the directory changes.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.__directory = directory if directory else ARCHIVE_DIR
+        self.__segments: Dict[int, Segment] = {}
+        self.__scanned: Optional[int] = None  # Directory mtime at the last scan
+        self.__lock = Lock()
+
+    def get_directory(self) -> str:
+        return self.__directory
+
+    # Sealed segments, oldest first
+    def get_segments(self) -> List[Segment]:
+        try:
+            modified = os.stat(self.__directory).st_mtime_ns
+        except FileNotFoundError:
+            modified = None
+        with self.__lock:
+            if modified != self.__scanned:
+                self.scan()
+                self.__scanned = modified
+            return [self.__segments[number] for number in sorted(self.__segments)]
+
+    # Opens new segments and closes removed ones, caller holds the lock
+    def scan(self) -> None:
+        numbers = set()
+        if os.path.isdir(self.__directory):
+            for name in os.listdir(self.__directory):
+                stem, extension = os.path.splitext(name)
+                if extension == ".idx" and stem.isdigit():
+                    numbers.add(int(stem))
+        for number in set(self.__segments) - numbers:
+            self.__segments.pop(number).close()
+        for number in sorted(numbers - set(self.__segments)):
+            self.__segments[number] = Segment(self.__directory, number)
+
+    def size(self) -> int:
+        return sum(segment.size() for segment in self.get_segments())
+
+    # Newest segment first, in case a battle was archived twice
+    def find_battle(self, battle_id: int) -> Optional[dict]:
+        for segment in reversed(self.get_segments()):
+            document = segment.find(battle_id)
+            if document is not None:
+                return document
+        return None
+
+    def find_battles(self, battle_ids: Iterable[int]) -> List[dict]:
+        segments = self.get_segments()[::-1]
+        found = []
+        for battle_id in battle_ids:
+            for segment in segments:
+                document = segment.find(battle_id)
+                if document is not None:
+                    found.append(document)
+                    break
+        return found
+
+    # Every archived battle in id order, one record read at a time
+    def iter_battles(self) -> Iterator[dict]:
+        return heapq.merge(
+            *(segment.iter_documents() for segment in self.get_segments()),
+            key=lambda document: document["battle id"],
+        )
+
+    """ Moves battles stored before older_than into new segments, then deletes
+    them from the battle collection. A lock file keeps archive runs apart; a
+    battle already sealed by a run that stopped before deleting it is only
+    deleted. Returns how many battles left the collection """
+
+    def archive(self, older_than: datetime) -> int:
+        # An ObjectId starts with the time its document was stored
+        stored_before = {"_id": {"$lt": ObjectId.from_datetime(older_than)}}
+        os.makedirs(self.__directory, exist_ok=True)
+        moved = 0
+        with open(os.path.join(self.__directory, "archive.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            while True:
+                segments = self.get_segments()
+                number = segments[-1].get_number() + 1 if segments else 1
+                sealed: List[int] = []
+
+                def unarchived(documents: Iterable[dict]) -> Iterator[dict]:
+                    for document in documents:
+                        battle_id = document["battle id"]
+                        if any(
+                            segment.position(battle_id) is not None
+                            for segment in segments
+                        ):
+                            sealed.append(battle_id)
+                        else:
+                            yield document
+
+                documents = (
+                    db.battle.find(stored_before, {"_id": 0})
+                    .sort("battle id", 1)
+                    .limit(SEGMENT_BATTLES)
+                )
+                written = write_segment(self.__directory, number, unarchived(documents))
+                done = written + sealed
+                if not done:
+                    break
+                for start in range(0, len(done), DELETE_BATCH):
+                    db.battle.bulk_write(
+                        [
+                            DeleteOne(dict(stored_before, **{"battle id": battle_id}))
+                            for battle_id in done[start : start + DELETE_BATCH]
+                        ],
+                        ordered=False,
+                    )
+                moved += len(done)
+        return moved
+
+    def archive_older_than(self, days: float = ARCHIVE_AFTER_DAYS) -> int:
+        return self.archive(datetime.now(timezone.utc) - timedelta(days=days))
+
+    # Removes every segment, for seed.py
+    def clear(self) -> None:
+        if not os.path.isdir(self.__directory):
+            return
+        for name in os.listdir(self.__directory):
+            if os.path.splitext(name)[1] in (".seg", ".idx", ".partial"):
+                os.remove(os.path.join(self.__directory, name))
+        with self.__lock:
+            self.scan()
+
+
+battle_archive = BattleArchive()
@@ -0,0 +1,160 @@
+from models.battle import Battle, Battle_Data
+from models.dbservice import DbService
+from models.events import EventRenderer, Verbosity
+from models.logger import Logger
+from models.ratings import RatingTally, rating_engine
+from models.stats import StatsTally
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import List, Optional, Tuple
+
+logger = Logger()
+
+# Below this many battles a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+POOL_CHUNK_SIZE = 16
+MAX_BATCH_SIZE = 10_000
+
+# (battle id, pokemon1 document, pokemon2 document, seed, verbosity value,
+# raw events)
+BatchJob = Tuple[int, dict, dict, Optional[int], str, bool]
+
+
+# Top level so the process pool can pickle it. Workers only play the battle
+# and build its document; all writes happen once, in the parent. Events are
+# rendered as log lines unless raw, like POST /battle
+def run_batch_job(job: BatchJob) -> dict:
+    battle_id, document1, document2, seed, verbosity, raw = job
+    battle = Battle(
+        DbService.pokemon_from_document(document1),
+        DbService.pokemon_from_document(document2),
+        battle_id,
+        seed,
+        Verbosity(verbosity),
+    )
+    outcome = battle.play()
+    events = battle.get_events()
+    if not raw:
+        events = EventRenderer.from_pokemon(battle.get_pokemon()).render_all(events)
+    return {
+        "battle_id": battle_id,
+        "winner": outcome[0].get_name(),
+        "loser": outcome[1].get_name(),
+        "turns": battle.get_turns(),
+        "events": events,
+        "data": Battle_Data(battle).get_battle_data(),
+    }
+
+
+class BatchRunner:
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.__max_workers = max_workers
+        self.__db_service = DbService()
+        self.__pool: Optional[ProcessPoolExecutor] = None
+        self.__pool_pid: Optional[int] = None
+        self.__lock = Lock()
+
+    # Checks the request body and returns (pokemon1, pokemon2, seed) per job
+    def parse_jobs(self, jobs) -> List[Tuple[str, str, Optional[int]]]:
+        if not isinstance(jobs, list) or not jobs:
+            raise ValueError("jobs must be a non-empty list")
+        if len(jobs) > MAX_BATCH_SIZE:
+            raise ValueError(f"A batch holds at most {MAX_BATCH_SIZE} jobs")
+
+        parsed = []
+        for index, job in enumerate(jobs):
+            if not isinstance(job, dict):
+                raise ValueError(f"Job {index} must be an object")
+            for field in ["pokemon1", "pokemon2"]:
+                if field not in job:
+                    raise ValueError(f"Job {index} is missing field: {field}")
+            seed = job.get("seed")
+            if seed is not None and (
+                isinstance(seed, bool) or not isinstance(seed, int)
+            ):
+                raise ValueError(f"Job {index} seed must be an integer")
+            parsed.append((job["pokemon1"], job["pokemon2"], seed))
+        return parsed
+
+    def play(self, work: List[BatchJob]) -> List[dict]:
+        if len(work) < PARALLEL_THRESHOLD:
+            return [run_batch_job(job) for job in work]
+        return list(self.get_pool().map(run_batch_job, work, chunksize=POOL_CHUNK_SIZE))
+
+    # Made on first use and kept for later batches; a forked child must not
+    # use its parent's pool
+    def get_pool(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__pool is None or self.__pool_pid != os.getpid():
+                self.__pool = ProcessPoolExecutor(max_workers=self.__max_workers)
+                self.__pool_pid = os.getpid()
+            return self.__pool
+
+    """ Runs every job and returns one result per job, in request order. Jobs
+    naming an unknown pokemon get an error entry and no battle id; the rest
+    get consecutive ids and are stored with a single insert_many """
+
+    def run(
+        self, jobs, verbosity: Verbosity = Verbosity.FULL, raw: bool = False
+    ) -> List[dict]:
+        parsed = self.parse_jobs(jobs)
+
+        # One query for every pokemon the batch needs
+        names = {
+            name for pokemon1, pokemon2, _ in parsed for name in (pokemon1, pokemon2)
+        }
+        documents = self.__db_service.get_pokemon_documents(names)
+
+        results: List[Optional[dict]] = [None] * len(parsed)
+        positions: List[int] = []
+        for position, (pokemon1, pokemon2, _) in enumerate(parsed):
+            missing = [name for name in (pokemon1, pokemon2) if name not in documents]
+            if missing:
+                results[position] = {
+                    "error": f"Pokémon {', '.join(missing)} not found in the database"
+                }
+                continue
+            positions.append(position)
+
+        # One block of consecutive ids for every battle that will be played
+        first_id = (
+            self.__db_service.reserve_battle_ids(len(positions)) if positions else 0
+        )
+        work: List[BatchJob] = []
+        for offset, position in enumerate(positions):
+            pokemon1, pokemon2, seed = parsed[position]
+            work.append(
+                (
+                    first_id + offset,
+                    documents[pokemon1],
+                    documents[pokemon2],
+                    seed,
+                    verbosity.value,
+                    raw,
+                )
+            )
+
+        played = self.play(work)
+        if played:
+            battles = [result.pop("data") for result in played]
+            logger.insert_many("battle", battles)
+            logger.admin_log(
+                f"Battle batch logged: {played[0]['battle_id']}-{played[-1]['battle_id']}"
+            )
+
+            # One stats update per pokemon for the whole batch
+            stats = StatsTally()
+            ratings = RatingTally()
+            for result in played:
+                stats.record_battle(result["winner"], result["loser"])
+                ratings.record_battle(result["winner"], result["loser"])
+            stats.flush(logger)
+            ratings.flush(logger, rating_engine)
+
+        for position, result in zip(positions, played):
+            if verbosity == Verbosity.NONE:
+                del result["events"]
+            results[position] = result
+        return results
@@ -1,11 +1,29 @@
+import os
 import random
-from typing import List, Optional, Tuple
+from itertools import islice
+from typing import Generator, List, Optional, Tuple, Union
 from enum import Enum
 
 from models.pokemon import Pokemon
 from models.skill import Skill, AttackSkill, DefenseSkill
 from models.target import Target
-from models.logger import Logger, DbCollection
+from models.kernel import Fighter, compile_fighters, run_turns
+from models import codec
+from models.events import (
+    ATTACK,
+    DAMAGE,
+    DEFEND,
+    REDUCE,
+    START_EVENT,
+    Event,
+    Verbosity,
+    outcome_events,
+)
+from models.adminlog import AdminLevel
+from models.logger import BulkLogger, Logger, DbCollection
+from models.definitions import definition_of_pokemon, hash_definition
+from models.ratings import RatingTally, rating_engine
+from models.stats import StatsTally
 
 
 class turn(Enum):
@@ -13,9 +31,42 @@ class turn(Enum):
     POKE_TWO = True
 
 
+class StorageMode(Enum):
+    FULL = "full"  # store every event
+    REPLAY = "replay"  # seeded battles store definitions + seed, replayed on read
+
+
+# Unseeded battles cannot be replayed and are always stored in full
+STORAGE_MODE = StorageMode(os.getenv("BATTLE_STORAGE_MODE", "full"))
+NO_GUARD = -1
+# Turns played between yields when a battle is streamed
+STREAM_CHUNK_TURNS = 16
+
+
 logger = Logger()
 
 
+# [hp, active defense index] -- what a pokemon carries between battles
+def pokemon_state(pokemon: Pokemon) -> List[int]:
+    active_defense = pokemon.get_active_defense()
+    return [
+        pokemon.get_current_hp(),
+        (
+            pokemon.get_defense_skills().index(active_defense)
+            if active_defense is not None
+            else NO_GUARD
+        ),
+    ]
+
+
+def restore_state(pokemon: Pokemon, state: List[int]) -> None:
+    hp, guard = state
+    pokemon.set_current_hp(hp)
+    pokemon.set_active_defense(
+        pokemon.get_defense_skills()[guard] if guard != NO_GUARD else None
+    )
+
+
 class Battle:
     def __init__(
         self,
@@ -23,6 +74,7 @@ class Battle:
         pokemon2: Pokemon,
         battle_id: int = 1,
         seed: Optional[int] = None,
+        verbosity: Verbosity = Verbosity.FULL,
     ):
         self.__pokemon1 = pokemon1
         self.__pokemon2 = pokemon2
@@ -30,7 +82,16 @@ class Battle:
         self.__battle_random = random.Random()
         self.__battle_seed = seed
         self.__turn = turn.POKE_ONE
-        self.__events: List[str] = []
+        self.__verbosity = verbosity
+        # (hp, active defense index) per side when the battle began, and the
+        # result -- enough to replay a seeded battle later
+        self.__start_state: List[List[int]] = []
+        self.__turns = 0
+        self.__winner: Optional[int] = None
+        self.__fighters: Tuple[Fighter, Fighter] = ()
+        # Structured (code, actor, skill, damage, hp) tuples, see models.events.
+        # Battles loaded from before that change may still hold plain strings
+        self.__events: List[Union[Event, str]] = []
 
         # random.seed accepts None and just acts as normal random
         self.set_seed(seed)
@@ -41,15 +102,32 @@ class Battle:
     def get_id(self) -> int:
         return self.__battle_id
 
-    def get_events(self) -> List[str]:
+    def get_events(self) -> List[Union[Event, str]]:
         return self.__events
 
     def get_seed(self) -> int:
         return self.__battle_seed
 
-    def append_event(self, event: str) -> None:
+    def get_verbosity(self) -> Verbosity:
+        return self.__verbosity
+
+    def get_start_state(self) -> List[List[int]]:
+        return self.__start_state
+
+    def get_turns(self) -> int:
+        return self.__turns
+
+    # 0 if pokemon1 won, 1 if pokemon2 won, None before the battle ran
+    def get_winner(self) -> Optional[int]:
+        return self.__winner
+
+    def append_event(self, event: Union[Event, str]) -> None:
         self.__events.append(event)
 
+    # Index of a pokemon in this battle, as used by structured events
+    def get_side(self, pokemon: Pokemon) -> int:
+        return 0 if pokemon is self.__pokemon1 else 1
+
     # Track seed and pass on to pokemon
     def set_seed(self, value: int = None) -> None:
         self.__battle_random.seed(value)
@@ -104,64 +182,157 @@ class Battle:
         # Execute the chosen skill on the target Pokémon.
         target_pokemon = target.get_pokemon()
         skill = target.get_skill()
+        record = self.__verbosity == Verbosity.FULL
 
         if isinstance(skill, AttackSkill):
             # Apply attack damage to the target Pokémon
             damage = skill.get_damage()
-            self.append_event(
-                f"{user.get_name()} is attacking with {skill.get_name()} "
-                f"for {damage} damage to {target_pokemon.get_name()}"
-            )
+            if record:
+                self.append_event(
+                    (
+                        ATTACK,
+                        self.get_side(user),
+                        user.get_attack_skills().index(skill),
+                        damage,
+                        0,
+                    )
+                )
 
             # take_damage handles damage reduction
             # if pokemon is defending and returns [damage taken, damage reduced]
-            """I know it's ugly but I gots a project to complete atp"""
             active_defense = target_pokemon.get_active_defense()
-            if active_defense:
-                active_defense_name = active_defense.get_name()
             damage_taken_and_reduced = target_pokemon.take_damage(damage)
             damage_taken = damage_taken_and_reduced[0]
             damage_reduced = damage_taken_and_reduced[1]
+            target_side = self.get_side(target_pokemon)
 
-            if damage_reduced > 0:
+            if record and damage_reduced > 0:
                 self.append_event(
-                    f"{target_pokemon.get_name()} successfully reduced "
-                    f"{user.get_name()}'s damage by {damage_reduced} "
-                    f"with {active_defense_name}"
+                    (
+                        REDUCE,
+                        target_side,
+                        target_pokemon.get_defense_skills().index(active_defense),
+                        damage_reduced,
+                        0,
+                    )
                 )
 
-            self.append_event(
-                f"{target_pokemon.get_name()} has received {damage_taken} damage, "
-                f"remaining hp is {target_pokemon.get_current_hp()}"
-            )
+            if record:
+                self.append_event(
+                    (
+                        DAMAGE,
+                        target_side,
+                        0,
+                        damage_taken,
+                        target_pokemon.get_current_hp(),
+                    )
+                )
 
         elif isinstance(skill, DefenseSkill):
             user.defend(skill)
-            self.append_event(
-                f"{user.get_name()} is attempting to defend with {skill.get_name()}"
-            )
+            if record:
+                self.append_event(
+                    (
+                        DEFEND,
+                        self.get_side(user),
+                        user.get_defense_skills().index(skill),
+                        0,
+                        0,
+                    )
+                )
 
         return
 
     # Start the battle between two teams of Pokémon.
     def start_battle(self) -> Optional[List[Pokemon]]:
-        logger.admin_log(f"battle started: {self.__battle_id}")
-        self.append_event("Welcome to the thunderdome!")
+        outcome = self.play()
+        # The battle and both admin messages go out in two round trips
+        with logger.bulk() as bulk:
+            bulk.admin_log(
+                f"battle started: {self.__battle_id}", battle_id=self.__battle_id
+            )
+            battle_data = Battle_Data(self)
+            battle_data.save(bulk)
+        self.save_stats(outcome)
+        return outcome
 
-        # loop until pokemon faints
+    """ Same as start_battle, but yields each event as soon as its turn is
+    played, STREAM_CHUNK_TURNS turns at a time. The generator's return value
+    is the outcome, so callers can `outcome = yield from battle.stream_battle()` """
+
+    def stream_battle(
+        self, chunk_turns: int = STREAM_CHUNK_TURNS
+    ) -> Generator[Union[Event, str], None, List[Pokemon]]:
+        logger.admin_log(
+            f"battle started: {self.__battle_id}", battle_id=self.__battle_id
+        )
+        yield from self.begin()
         while not self.is_battle_over():
-            # Determine which Pokémon's turn it is
-            if self.__turn == turn.POKE_ONE:
-                pokemon = self.__pokemon1
-            else:
-                pokemon = self.__pokemon2
+            played = len(self.__events)
+            self.play_turns(chunk_turns)
+            yield from islice(self.__events, played, None)
+        outcome = self.finish()
+        yield from outcome_events(self.__winner) if self.__recording() else ()
+        battle_data = Battle_Data(self)
+        battle_data.save()
+        self.save_stats(outcome)
+        return outcome
 
-            # Execute action
-            target: Target = self.get_action_from_pokemon(pokemon)
-            self.execute_skill(pokemon, target)
-            # Change turn for next round
+    # Winner and loser counters in the pokemon collection and leaderboard,
+    # and both ratings
+    def save_stats(self, outcome: List[Pokemon]) -> None:
+        tally = StatsTally()
+        tally.record_battle(outcome[0].get_name(), outcome[1].get_name())
+        tally.flush(logger)
+        ratings = RatingTally()
+        ratings.record_battle(outcome[0].get_name(), outcome[1].get_name())
+        ratings.flush(logger, rating_engine)
+
+    # Run the battle without persisting it, also used to replay stored battles
+    def play(self) -> List[Pokemon]:
+        self.begin()
+        self.play_turns()
+        return self.finish()
+
+    def __recording(self) -> bool:
+        return self.__verbosity != Verbosity.NONE
+
+    # Capture the start state and compile both pokemon for the turn loop,
+    # returns the events added
+    def begin(self) -> List[Event]:
+        self.__start_state = [
+            pokemon_state(pokemon) for pokemon in (self.__pokemon1, self.__pokemon2)
+        ]
+        self.__turns = 0
+        # Compile both pokemon into flat slot records once, the turn loop
+        # runs on those and copies the end state back
+        self.__fighters = compile_fighters(self.__pokemon1, self.__pokemon2)
+        if not self.__recording():
+            return []
+        self.append_event(START_EVENT)
+        return [START_EVENT]
+
+    # Play up to max_turns turns (all of them by default)
+    def play_turns(self, max_turns: Optional[int] = None) -> int:
+        first, second = self.__fighters
+        if self.__turn == turn.POKE_TWO:
+            first, second = second, first
+        try:
+            turns_taken = run_turns(
+                first,
+                second,
+                self.__events if self.__verbosity == Verbosity.FULL else None,
+                max_turns,
+            )
+        finally:
+            first.store()
+            second.store()
+        if turns_taken % 2 == 1:
             self.change_turn()
+        self.__turns += turns_taken
+        return turns_taken
 
+    def finish(self) -> List[Pokemon]:
         # Determine the outcome
         outcome = (
             [self.__pokemon1, self.__pokemon2]
@@ -169,11 +340,10 @@ class Battle:
             else [self.__pokemon2, self.__pokemon1]
         )
 
-        # Announce outcome and log
-        self.append_event(f"{outcome[1].get_name()} has lost")
-        self.append_event(f"{outcome[0].get_name()} has won the battle")
-        battle_data = Battle_Data(self)
-        battle_data.save()
+        # Announce outcome
+        self.__winner = self.get_side(outcome[0])
+        if self.__recording():
+            self.__events.extend(outcome_events(self.__winner))
         return outcome
 
     # Check if the battle is over
@@ -186,28 +356,45 @@ class Battle:
 
 
 class Battle_Data:
-    def __init__(self, battle: Battle) -> None:
+    def __init__(self, battle: Battle, storage_mode: StorageMode = None) -> None:
         # automatically generate loggable data
         self.__data = {}
-        self.build_data(battle)
+        self.__storage_mode = storage_mode if storage_mode else STORAGE_MODE
+        if self.__storage_mode == StorageMode.REPLAY and battle.get_seed() is not None:
+            self.build_replay_data(battle)
+        else:
+            self.build_data(battle)
 
     def get_battle_data(self) -> dict:
         return self.__data
 
-    def save(self) -> None:
-        logger.log(self.__data, DbCollection.BATTLE)
-        logger.admin_log(f"Battle {self.__data['battle id']} logged")
+    # Writes through the shared logger unless given a BulkLogger to collect it
+    def save(self, writer: Union[Logger, BulkLogger, None] = None) -> None:
+        writer = writer if writer is not None else logger
+        writer.log(self.__data, DbCollection.BATTLE)
+        battle_id = self.__data["battle id"]
+        writer.admin_log(f"Battle {battle_id} logged", battle_id=battle_id)
 
     def deconstruct_battle(
         self, battle: Battle
-    ) -> Tuple[int, List[str], str, str, int]:
+    ) -> Tuple[int, List[Event], str, str, int, List[List[str]], List[List[str]]]:
+        pokemon = battle.get_pokemon()
         return tuple(
             [
                 battle.get_id(),
                 battle.get_events(),
-                battle.get_pokemon()[0].get_name(),
-                battle.get_pokemon()[1].get_name(),
+                pokemon[0].get_name(),
+                pokemon[1].get_name(),
                 battle.get_seed(),
+                # skill names let events be rendered without the pokemon
+                [
+                    [skill.get_name() for skill in p.get_attack_skills()]
+                    for p in pokemon
+                ],
+                [
+                    [skill.get_name() for skill in p.get_defense_skills()]
+                    for p in pokemon
+                ],
             ]
         )
 
@@ -219,5 +406,29 @@ class Battle_Data:
             "pokemon1": deconstructed[2],
             "pokemon2": deconstructed[3],
             "seed": deconstructed[4],
+            "attack skills": deconstructed[5],
+            "defense skills": deconstructed[6],
+            "storage": StorageMode.FULL.value,
+            "winner": battle.get_winner(),
+            "turns": battle.get_turns(),
+        }
+        if codec.enabled():
+            self.__data = codec.pack_battle(self.__data)
+        return
+
+    # No events: the seed, start state and definition hashes regenerate them
+    def build_replay_data(self, battle: Battle) -> None:
+        pokemon = battle.get_pokemon()
+        self.__data = {
+            "battle id": battle.get_id(),
+            "pokemon1": pokemon[0].get_name(),
+            "pokemon2": pokemon[1].get_name(),
+            "seed": battle.get_seed(),
+            "storage": StorageMode.REPLAY.value,
+            "definitions": [hash_definition(definition_of_pokemon(p)) for p in pokemon],
+            "start": battle.get_start_state(),
+            "verbosity": battle.get_verbosity().value,
+            "winner": battle.get_winner(),
+            "turns": battle.get_turns(),
         }
         return
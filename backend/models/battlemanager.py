@@ -1,9 +1,10 @@
 from models.pokemon import Pokemon
 from models.battle import Battle
-from models.tournament import Tournament
+from models.tournament import CheckpointHeld, Tournament, roster_hash
 from models.dbservice import DbService
+from models.events import Verbosity
 
-from typing import List, Optional
+from typing import Generator, List, Optional
 
 
 class BattleManager:
@@ -18,6 +19,9 @@ class BattleManager:
     def set_seed(self, seed: int = None) -> None:
         self.__seed = seed
 
+    def get_seed(self) -> Optional[int]:
+        return self.__seed
+
     """ Same idea, whenever you create a new tournament or battle with the
     now None seed, it will propogate down to all random decisions """
 
@@ -38,24 +42,46 @@ class BattleManager:
         dbfetch = DbService()
         return dbfetch.get_next_tournament_id()
 
-    def create_battle(self, pokemon1: Pokemon, pokemon2: Pokemon) -> Battle:
+    """ A contiguous block with an id for every battle a tournament of this
+    many participants can play, so its battles never share ids with others"""
+
+    def reserve_battle_ids(self, participants: int) -> int:
+        dbfetch = DbService()
+        return dbfetch.reserve_battle_ids(max(participants - 1, 0))
+
+    def create_battle(
+        self,
+        pokemon1: Pokemon,
+        pokemon2: Pokemon,
+        verbosity: Verbosity = Verbosity.FULL,
+    ) -> Battle:
         next_id = self.get_next_battle_id()
-        battle = Battle(pokemon1, pokemon2, next_id, self.__seed)
+        battle = Battle(pokemon1, pokemon2, next_id, self.__seed, verbosity)
         return battle
 
     def start_battle(self, battle: Battle) -> Optional[List[Pokemon]]:
         outcome = battle.start_battle()
         return outcome
 
+    # Yields the battle's events as they are played, returns the outcome
+    def stream_battle(self, battle: Battle) -> Generator:
+        outcome = yield from battle.stream_battle()
+        return outcome
+
     # Just initializes a tournament object
     def create_tournament(
         self,
         participants: List[Pokemon],
+        verbosity: Verbosity = Verbosity.FULL,
     ) -> Tournament:
-        self.__battle_id = self.get_next_battle_id()
+        self.__battle_id = self.reserve_battle_ids(len(participants))
         self.__tournament_id = self.get_next_tournament_id()
         return Tournament(
-            participants, self.__tournament_id, self.__battle_id, self.__seed
+            participants,
+            self.__tournament_id,
+            self.__battle_id,
+            self.__seed,
+            verbosity,
         )
 
     # If none was returned, then the tournament was created with invalid participant length or entries
@@ -66,3 +92,60 @@ class BattleManager:
             return None
         self.__battle_id = tournament.get_battle_id()
         return result
+
+    # Yields round progress while the tournament runs, returns the winner
+    def stream_tournament(self, tournament: Tournament) -> Generator:
+        result = yield from tournament.stream_tournament()
+        if not result:
+            return None
+        self.__battle_id = tournament.get_battle_id()
+        return result
+
+    """ Rebuilds a tournament that stopped mid-bracket (a restart, a crash)
+    from its last round checkpoint; pass it to start_tournament to finish it.
+    Seeded tournaments then end exactly as an uninterrupted run would.
+    The rebuilt tournament holds the checkpoint until it finishes or stops;
+    raises CheckpointHeld while another run holds it. None if there is
+    nothing to resume """
+
+    def resume_tournament(self, tournament_id: int) -> Optional[Tournament]:
+        dbfetch = DbService()
+        checkpoint = dbfetch.get_tournament_checkpoint(tournament_id)
+        if checkpoint is None:
+            return None
+
+        documents = dbfetch.get_pokemon_documents(set(checkpoint["participants"]))
+        if any(name not in documents for name in checkpoint["participants"]):
+            raise ValueError("A participant of this tournament no longer exists")
+        participants = [
+            dbfetch.pokemon_from_document(documents[name])
+            for name in checkpoint["participants"]
+        ]
+        if roster_hash(participants) != checkpoint["roster hash"]:
+            raise ValueError("Participants changed since the tournament started")
+
+        tournament = Tournament(
+            participants,
+            tournament_id,
+            checkpoint["battle id"],
+            checkpoint["seed"],
+            Verbosity(checkpoint["verbosity"]),
+        )
+        checkpoint = dbfetch.claim_tournament_checkpoint(
+            tournament_id, tournament.get_owner()
+        )
+        if checkpoint is None:
+            raise CheckpointHeld(f"Tournament {tournament_id} is run elsewhere")
+        # Everyone is still in until the first round completes
+        entrants = checkpoint["entrants"]
+        entrant_count = len(participants) if entrants is None else len(entrants)
+        dbfetch.discard_unfinished_round(
+            tournament_id,
+            checkpoint["round"],
+            checkpoint["battle id"],
+            entrant_count // 2,
+        )
+        tournament.restore_checkpoint(
+            checkpoint, dbfetch.get_tournament_rounds(tournament_id)
+        )
+        return tournament
@@ -0,0 +1,58 @@
+from array import array
+from random import Random
+from typing import Iterable, Iterator, Optional, Tuple
+
+NO_BYE = -1
+
+
+class Bracket:
+    """
+    The entrants still in a tournament, held as indexes into its participant
+    list so a round costs 8 bytes per entrant whatever they are. With an odd
+    count one entrant sits the round out; instead of removing them from the
+    list, pairs are read around the bye's slot, pairing the same entrants
+    list.remove would have left next to each other.
+    """
+
+    def __init__(self, entrants: Iterable[int]) -> None:
+        self.__entrants = array("q", entrants)
+        self.__bye = NO_BYE
+
+    def get_entrants(self) -> array:
+        return self.__entrants
+
+    def get_bye(self) -> Optional[int]:
+        return self.__entrants[self.__bye] if self.__bye != NO_BYE else None
+
+    def size(self) -> int:
+        return len(self.__entrants)
+
+    def battle_count(self) -> int:
+        return len(self.__entrants) // 2
+
+    # Same draw as random.choice over the entrants, so seeded byes don't change
+    def draw_bye(self, rng: Random) -> Optional[int]:
+        self.__bye = (
+            rng.randrange(len(self.__entrants)) if len(self.__entrants) % 2 else NO_BYE
+        )
+        return self.get_bye()
+
+    # Entrant at slot, skipping over the bye
+    def entrant(self, slot: int) -> int:
+        if self.__bye != NO_BYE and slot >= self.__bye:
+            slot += 1
+        return self.__entrants[slot]
+
+    # (bracket position, entrant, entrant) for every battle of the round
+    def pairs(self) -> Iterator[Tuple[int, int, int]]:
+        for position in range(self.battle_count()):
+            yield position, self.entrant(2 * position), self.entrant(2 * position + 1)
+
+    # The bye goes through first, then the winners in bracket order
+    def advance(self, winners: Iterable[int]) -> None:
+        next_round = array("q")
+        if self.__bye != NO_BYE:
+            next_round.append(self.__entrants[self.__bye])
+        next_round.extend(winners)
+        self.__entrants = next_round
+        self.__bye = NO_BYE
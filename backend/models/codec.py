@@ -0,0 +1,477 @@
+import os
+import zlib
+from enum import IntEnum
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from models.database import db
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib always works
+    zstandard = None
+
+""" Compact storage for battle events and tournament round results. Both are
+written as columns of small integers (zigzag varints) behind a table of the
+names they use, then compressed. A battle's table holds its pokemon and
+skill names (plus any text lines), each once, and the blob also carries the
+battle's seed, winner and turns, so only the battle id stays outside it;
+round results refer to pokemon names in theirs.
+
+    EVENT_COMPRESSION   off, zlib or zstd (off). zstd needs the zstandard
+                        package and falls back to zlib without it
+
+A blob starts with its format and compressor, so readers never need to know
+how the writer was configured. zstd blobs compressed with a trained
+dictionary also name it; dictionaries live in the codec_dictionary
+collection and are trained by train_dictionary. A payload that would not
+shrink is stored as it is.
+
+Format 1 blobs, written before battles kept their names and numbers in the
+blob, are still read.
+"""
+
+FORMAT = 2
+READ_FORMATS = (1, 2)
+
+EVENT_COMPRESSION = os.getenv("EVENT_COMPRESSION", "off").lower()
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+
+# Results a round page or tournament keeps, the only keys packed
+RESULT_KEYS = {"battle_id", "winner", "loser"}
+
+# Where the packed form lives in a document, next to "storage"
+PACKED_EVENTS = "packed events"
+
+# Trained dictionaries are at most this big and sampled from this many battles
+DICTIONARY_SIZE = 16 * 1024
+DICTIONARY_SAMPLES = 2000
+
+
+class Compressor(IntEnum):
+    NONE = 0
+    ZLIB = 1  # Format 1 only, with zlib's header and checksum
+    ZSTD = 2
+    ZSTD_DICTIONARY = 3
+    DEFLATE = 4  # What EVENT_COMPRESSION=zlib writes: raw deflate, no header
+
+
+class CodecError(Exception):
+    pass
+
+
+def enabled() -> bool:
+    return EVENT_COMPRESSION != "off"
+
+
+# Varints
+
+
+def write_varint(out: bytearray, value: int) -> None:
+    # zigzag so small negative numbers stay small
+    value = (value << 1) ^ (value >> 63)
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), position
+
+
+def write_strings(out: bytearray, strings: Sequence[str]) -> None:
+    write_varint(out, len(strings))
+    for string in strings:
+        encoded = string.encode("utf-8")
+        write_varint(out, len(encoded))
+        out.extend(encoded)
+
+
+def read_strings(data: bytes, position: int) -> Tuple[List[str], int]:
+    count, position = read_varint(data, position)
+    strings = []
+    for _ in range(count):
+        length, position = read_varint(data, position)
+        strings.append(data[position : position + length].decode("utf-8"))
+        position += length
+    return strings, position
+
+
+def write_columns(out: bytearray, rows: Sequence[Sequence[int]], width: int) -> None:
+    write_varint(out, len(rows))
+    for column in range(width):
+        for row in rows:
+            write_varint(out, row[column])
+
+
+def read_columns(data: bytes, position: int, width: int) -> Tuple[List[list], int]:
+    count, position = read_varint(data, position)
+    columns = []
+    for _ in range(width):
+        column = []
+        for _ in range(count):
+            value, position = read_varint(data, position)
+            column.append(value)
+        columns.append(column)
+    return [list(row) for row in zip(*columns)] if count else [], position
+
+
+# Compression
+
+
+class DictionaryStore:
+    """Trained zstd dictionaries by id, the newest used for writing"""
+
+    def __init__(self) -> None:
+        self.__dictionaries: Dict[int, object] = {}
+        self.__latest: Optional[int] = None
+        self.__loaded = False
+        self.__lock = Lock()
+
+    # (id, dictionary) to compress with, None until one was trained
+    def get_latest(self) -> Optional[Tuple[int, object]]:
+        with self.__lock:
+            if not self.__loaded:
+                document = db.codec_dictionary.find_one({}, sort=[("_id", -1)])
+                if document is not None:
+                    self.__latest = document["_id"]
+                    self.__dictionaries[document["_id"]] = self.make(document)
+                self.__loaded = True
+            if self.__latest is None:
+                return None
+            return self.__latest, self.__dictionaries[self.__latest]
+
+    def get(self, dictionary_id: int):
+        with self.__lock:
+            if dictionary_id not in self.__dictionaries:
+                document = db.codec_dictionary.find_one({"_id": dictionary_id})
+                if document is None:
+                    raise CodecError(f"Codec dictionary {dictionary_id} is missing")
+                self.__dictionaries[dictionary_id] = self.make(document)
+            return self.__dictionaries[dictionary_id]
+
+    # Prepared once for compression, not again for every blob
+    def make(self, document: dict):
+        dictionary = zstandard.ZstdCompressionDict(bytes(document["data"]))
+        dictionary.precompute_compress(level=ZSTD_LEVEL)
+        return dictionary
+
+    def add(self, data: bytes) -> int:
+        latest = db.codec_dictionary.find_one({}, sort=[("_id", -1)])
+        dictionary_id = latest["_id"] + 1 if latest else 1
+        db.codec_dictionary.insert_one({"_id": dictionary_id, "data": data})
+        with self.__lock:
+            self.__loaded = False
+        return dictionary_id
+
+
+dictionaries = DictionaryStore()
+
+
+def compressor() -> Compressor:
+    if EVENT_COMPRESSION == "zstd" and zstandard is not None:
+        return Compressor.ZSTD
+    return Compressor.DEFLATE
+
+
+# Format, compressor and, with a dictionary, its id as a varint; zstd frames
+# leave out the dictionary id and checksum the header already covers
+def compress(payload: bytes) -> bytes:
+    kind = compressor()
+    header = bytearray([FORMAT, kind])
+    if kind == Compressor.DEFLATE:
+        deflate = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = deflate.compress(payload) + deflate.flush()
+    else:
+        latest = dictionaries.get_latest()
+        if latest is None:
+            body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(payload)
+        else:
+            dictionary_id, dictionary = latest
+            header[1] = Compressor.ZSTD_DICTIONARY
+            write_varint(header, dictionary_id)
+            body = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL, dict_data=dictionary, write_dict_id=False
+            ).compress(payload)
+    if len(header) + len(body) >= 2 + len(payload):
+        return bytes([FORMAT, Compressor.NONE]) + payload
+    return bytes(header) + body
+
+
+def blob_format(blob: bytes) -> int:
+    return blob[0]
+
+
+def decompress(blob: bytes) -> bytes:
+    blob = bytes(blob)
+    if len(blob) < 2 or blob[0] not in READ_FORMATS:
+        raise CodecError("Unknown packed events format")
+    kind = blob[1]
+    if kind == Compressor.NONE:
+        return blob[2:]
+    if kind == Compressor.ZLIB:
+        return zlib.decompress(blob[2:])
+    if kind == Compressor.DEFLATE:
+        return zlib.decompress(blob[2:], -zlib.MAX_WBITS)
+    if kind not in (Compressor.ZSTD, Compressor.ZSTD_DICTIONARY):
+        raise CodecError(f"Unknown packed events compressor {kind}")
+    if zstandard is None:
+        raise CodecError("Packed events need the zstandard package")
+    if kind == Compressor.ZSTD:
+        return zstandard.ZstdDecompressor().decompress(blob[2:])
+    if blob[0] == 1:
+        dictionary_id, position = int.from_bytes(blob[2:6], "little"), 6
+    else:
+        dictionary_id, position = read_varint(blob, 2)
+    dictionary = dictionaries.get(dictionary_id)
+    return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(blob[position:])
+
+
+# Battle events
+
+# Fields of a battle document kept next to its events in the blob: names go
+# to its string table, numbers are stored as they are (or as None)
+NAME_FIELDS = ("pokemon1", "pokemon2", "storage")
+NUMBER_FIELDS = ("seed", "winner", "turns")
+SKILL_FIELDS = ("attack skills", "defense skills")
+PACKED_FIELDS = ("events",) + SKILL_FIELDS + NAME_FIELDS + NUMBER_FIELDS
+HEADER_FIELDS = NAME_FIELDS + NUMBER_FIELDS
+
+Events = List[Union[Sequence[int], str]]
+SkillNames = Sequence[Sequence[str]]
+
+
+# The string table; then a mask of the header fields present (and, above
+# them, of the numbers that are None), each present one as a varint; the
+# skills of both sides as positions in the table; then columns of (code,
+# actor, skill, damage, remaining hp), a text line stored as code -1 with its
+# position in the table
+def battle_payload(document: dict) -> bytes:
+    strings: Dict[str, int] = {}
+    body = bytearray()
+
+    mask = 0
+    values = []
+    for bit, field in enumerate(HEADER_FIELDS):
+        if field not in document:
+            continue
+        mask |= 1 << bit
+        value = document[field]
+        if field in NAME_FIELDS:
+            values.append(strings.setdefault(value, len(strings)))
+        elif value is None:
+            mask |= 1 << (bit + len(HEADER_FIELDS))
+        else:
+            values.append(value)
+    write_varint(body, mask)
+    for value in values:
+        write_varint(body, value)
+
+    for field in SKILL_FIELDS:
+        sides = document.get(field, [])
+        write_varint(body, len(sides))
+        for names in sides:
+            write_varint(body, len(names))
+            for name in names:
+                write_varint(body, strings.setdefault(name, len(strings)))
+
+    rows = []
+    for event in document.get("events", []):
+        if isinstance(event, str):
+            rows.append((-1, strings.setdefault(event, len(strings)), 0, 0, 0))
+        else:
+            rows.append(event)
+    write_columns(body, rows, 5)
+
+    out = bytearray()
+    write_strings(out, list(strings))
+    return bytes(out + body)
+
+
+# The packed fields of a battle, as a dict to update its document with
+def read_battle_payload(data: bytes) -> dict:
+    strings, position = read_strings(data, 0)
+    mask, position = read_varint(data, position)
+    fields = {}
+    for bit, field in enumerate(HEADER_FIELDS):
+        if not mask & (1 << bit):
+            continue
+        if mask & (1 << (bit + len(HEADER_FIELDS))):
+            fields[field] = None
+            continue
+        value, position = read_varint(data, position)
+        fields[field] = strings[value] if field in NAME_FIELDS else value
+
+    for field in SKILL_FIELDS:
+        sides, position = read_varint(data, position)
+        skill_lists = []
+        for _ in range(sides):
+            count, position = read_varint(data, position)
+            names = []
+            for _ in range(count):
+                index, position = read_varint(data, position)
+                names.append(strings[index])
+            skill_lists.append(names)
+        fields[field] = skill_lists
+
+    rows, _ = read_columns(data, position, 5)
+    fields["events"] = [strings[row[1]] if row[0] == -1 else row for row in rows]
+    return fields
+
+
+# Format 1 payloads: skill names of both sides, then columns of events, a
+# text line as code -1 with its position among the text lines
+def read_events_payload(data: bytes) -> dict:
+    position = 0
+    skill_lists = []
+    for _ in range(2):
+        sides, position = read_varint(data, position)
+        names = []
+        for _ in range(sides):
+            side, position = read_strings(data, position)
+            names.append(side)
+        skill_lists.append(names)
+    lines, position = read_strings(data, position)
+    rows, _ = read_columns(data, position, 5)
+    return {
+        "events": [lines[row[1]] if row[0] == -1 else row for row in rows],
+        "attack skills": skill_lists[0],
+        "defense skills": skill_lists[1],
+    }
+
+
+# The document as it is stored: the battle id and one blob
+def pack_battle(document: dict) -> dict:
+    packed = {k: v for k, v in document.items() if k not in PACKED_FIELDS}
+    packed[PACKED_EVENTS] = compress(battle_payload(document))
+    return packed
+
+
+# The document as it is read: packed fields restored, the blob dropped
+def unpack_battle(document: dict) -> dict:
+    if PACKED_EVENTS not in document:
+        return document
+    unpacked = dict(document)
+    blob = unpacked.pop(PACKED_EVENTS)
+    payload = decompress(blob)
+    if blob_format(blob) == 1:
+        unpacked.update(read_events_payload(payload))
+    else:
+        unpacked.update(read_battle_payload(payload))
+    return unpacked
+
+
+# Tournament results
+
+
+def can_pack_results(results: Iterable[dict]) -> bool:
+    return all(set(result) == RESULT_KEYS for result in results)
+
+
+# Names, the participants as positions among them, then columns of (round,
+# battle id step, winner, loser); rounds is None when there are none to keep
+def results_payload(
+    rounds: Optional[List[dict]], participants: Sequence[str] = ()
+) -> bytes:
+    names: Dict[str, int] = {}
+    entrants = [names.setdefault(name, len(names)) for name in participants]
+    rows = []
+    previous = 0
+    for tournament_round in rounds or []:
+        for result in tournament_round["events"]:
+            winner = names.setdefault(result["winner"], len(names))
+            loser = names.setdefault(result["loser"], len(names))
+            step = result["battle_id"] - previous
+            previous = result["battle_id"]
+            rows.append((tournament_round["round"], step, winner, loser))
+
+    out = bytearray()
+    write_strings(out, list(names))
+    write_columns(out, [(entrant,) for entrant in entrants], 1)
+    write_varint(out, -1 if rounds is None else len(rounds))
+    for tournament_round in rounds or []:
+        write_varint(out, tournament_round["round"])
+    write_columns(out, rows, 4)
+    return bytes(out)
+
+
+def read_results_payload(data: bytes) -> Tuple[List[str], Optional[List[dict]]]:
+    names, position = read_strings(data, 0)
+    entrants, position = read_columns(data, position, 1)
+    count, position = read_varint(data, position)
+    if count < 0:
+        return [names[entrant] for entrant, in entrants], None
+
+    rounds = []
+    by_number: Dict[int, dict] = {}
+    for _ in range(count):
+        number, position = read_varint(data, position)
+        by_number[number] = {"round": number, "events": []}
+        rounds.append(by_number[number])
+    rows, _ = read_columns(data, position, 4)
+    battle_id = 0
+    for number, step, winner, loser in rows:
+        battle_id += step
+        by_number[number]["events"].append(
+            {"battle_id": battle_id, "winner": names[winner], "loser": names[loser]}
+        )
+    return [names[entrant] for entrant, in entrants], rounds
+
+
+def pack_rounds(rounds: List[dict]) -> bytes:
+    return compress(results_payload(rounds))
+
+
+def unpack_rounds(blob: bytes) -> List[dict]:
+    return read_results_payload(decompress(blob))[1]
+
+
+# The tournament document as it is stored: participants and, when it keeps
+# them, its round results in one blob
+def pack_tournament(document: dict) -> dict:
+    packed = {k: v for k, v in document.items() if k not in ("participants", "events")}
+    packed[PACKED_EVENTS] = compress(
+        results_payload(document.get("events"), document["participants"])
+    )
+    return packed
+
+
+def unpack_tournament(document: dict) -> dict:
+    if PACKED_EVENTS not in document:
+        return document
+    unpacked = dict(document)
+    participants, rounds = read_results_payload(decompress(unpacked.pop(PACKED_EVENTS)))
+    unpacked["participants"] = participants
+    if rounds is not None:
+        unpacked["events"] = rounds
+    return unpacked
+
+
+# Samples are the uncompressed payloads of recent full battles; returns the
+# new dictionary's id, used for every blob written after it
+def train_dictionary(samples: int = DICTIONARY_SAMPLES) -> int:
+    if zstandard is None:
+        raise CodecError("Training a dictionary needs the zstandard package")
+    payloads = []
+    projection = {field: 1 for field in PACKED_FIELDS + (PACKED_EVENTS,)}
+    for document in (
+        db.battle.find({}, dict(projection, _id=0)).sort("battle id", -1).limit(samples)
+    ):
+        document = unpack_battle(document)
+        if document.get("events"):
+            payloads.append(battle_payload(document))
+    if not payloads:
+        raise CodecError("No stored battles with events to train on")
+    trained = zstandard.train_dictionary(DICTIONARY_SIZE, payloads)
+    return dictionaries.add(trained.as_bytes())
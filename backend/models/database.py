@@ -0,0 +1,191 @@
+import os
+from threading import Lock
+from typing import Optional, Union
+
+from pymongo import MongoClient, ReadPreference
+from pymongo.database import Database as MongoDatabase
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+from models.storage import LocalDatabase, MemoryDatabase, SqliteDatabase
+
+""" The one MongoClient every module shares. It is created on first use, not
+on import, and again in a forked child: pymongo clients are not fork-safe,
+so pre-fork servers (gunicorn and friends) give each worker its own pool.
+Settings come from the environment:
+
+    MONGO_URI                           connection string
+    MONGO_DATABASE                      database name (pokemon_database)
+    MONGO_MAX_POOL_SIZE                 sockets per process (20)
+    MONGO_MIN_POOL_SIZE                 sockets kept open when idle (0)
+    MONGO_MAX_IDLE_TIME_MS              close sockets idle this long (60000)
+    MONGO_CONNECT_TIMEOUT_MS            (5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS   (5000)
+    MONGO_SOCKET_TIMEOUT_MS             (30000)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         wait for a free socket (10000)
+    MONGO_WRITE_CONCERN                 w, e.g. 1 or majority (server default)
+    MONGO_JOURNAL                       true to wait for the journal
+    MONGO_READ_CONCERN                  e.g. local or majority (server default)
+    MONGO_READ_PREFERENCE               e.g. primaryPreferred (primary)
+
+STORAGE_BACKEND=memory or sqlite swaps MongoDB for the local storage in
+models/storage.py, for benchmarks and tests without a mongod:
+
+    STORAGE_BACKEND                     mongo, memory or sqlite (mongo)
+    SQLITE_PATH                         database file (pokemon.sqlite3)
+"""
+
+DEFAULT_DATABASE = "pokemon_database"
+DEFAULT_SQLITE_PATH = "pokemon.sqlite3"
+BACKENDS = ("mongo", "memory", "sqlite")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class Database:
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        name: Optional[str] = None,
+        backend: Optional[str] = None,
+    ):
+        self.__uri = uri
+        self.__name = name
+        self.__backend = backend
+        self.__client: Optional[MongoClient] = None
+        self.__database: Optional[MongoDatabase] = None
+        # Kept across forks: a child shares the memory backend's data as it
+        # was, SQLite opens its own connections
+        self.__local: Optional[LocalDatabase] = None
+        # Process the client belongs to, a child makes its own
+        self.__pid: Optional[int] = None
+        self.__lock = Lock()
+
+    def get_uri(self) -> Optional[str]:
+        return self.__uri if self.__uri is not None else os.getenv("MONGO_URI")
+
+    def get_name(self) -> str:
+        if self.__name is not None:
+            return self.__name
+        return os.getenv("MONGO_DATABASE", DEFAULT_DATABASE)
+
+    def get_backend(self) -> str:
+        backend = self.__backend or os.getenv("STORAGE_BACKEND", "mongo")
+        if backend.lower() not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+        return backend.lower()
+
+    def get_client(self) -> MongoClient:
+        if self.__client is None or self.__pid != os.getpid():
+            self.connect()
+        return self.__client
+
+    def get_database(self) -> Union[MongoDatabase, LocalDatabase]:
+        if self.get_backend() != "mongo":
+            return self.get_local_database()
+        if self.__database is None or self.__pid != os.getpid():
+            self.connect()
+        return self.__database
+
+    def connect(self) -> None:
+        with self.__lock:
+            if self.__client is not None and self.__pid == os.getpid():
+                return
+            # connect=False: sockets open on the first operation, not here
+            client = MongoClient(
+                self.get_uri(),
+                connect=False,
+                maxPoolSize=env_int("MONGO_MAX_POOL_SIZE", 20),
+                minPoolSize=env_int("MONGO_MIN_POOL_SIZE", 0),
+                maxIdleTimeMS=env_int("MONGO_MAX_IDLE_TIME_MS", 60_000),
+                connectTimeoutMS=env_int("MONGO_CONNECT_TIMEOUT_MS", 5_000),
+                serverSelectionTimeoutMS=env_int(
+                    "MONGO_SERVER_SELECTION_TIMEOUT_MS", 5_000
+                ),
+                socketTimeoutMS=env_int("MONGO_SOCKET_TIMEOUT_MS", 30_000),
+                waitQueueTimeoutMS=env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10_000),
+            )
+            self.__database = client.get_database(
+                self.get_name(),
+                write_concern=self.write_concern(),
+                read_concern=self.read_concern(),
+                read_preference=self.read_preference(),
+            )
+            self.__client = client
+            self.__pid = os.getpid()
+
+    def get_local_database(self) -> LocalDatabase:
+        with self.__lock:
+            if self.__local is None:
+                if self.get_backend() == "memory":
+                    self.__local = MemoryDatabase(self.get_name())
+                else:
+                    self.__local = SqliteDatabase(
+                        self.get_name(), os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH)
+                    )
+            return self.__local
+
+    def write_concern(self) -> Optional[WriteConcern]:
+        w = os.getenv("MONGO_WRITE_CONCERN")
+        journal = os.getenv("MONGO_JOURNAL")
+        if not w and not journal:
+            return None
+        return WriteConcern(
+            w=(int(w) if w.isdigit() else w) if w else None,
+            j=journal.lower() in ("1", "true") if journal else None,
+        )
+
+    def read_concern(self) -> Optional[ReadConcern]:
+        level = os.getenv("MONGO_READ_CONCERN")
+        return ReadConcern(level) if level else None
+
+    def read_preference(self):
+        mode = os.getenv("MONGO_READ_PREFERENCE")
+        if not mode:
+            return None
+        # primaryPreferred -> PRIMARY_PREFERRED
+        name = "".join("_" + c if c.isupper() else c.upper() for c in mode)
+        return getattr(ReadPreference, name)
+
+    # Forget the client without closing it, for a freshly forked child whose
+    # copy still shares sockets with the parent
+    def reset(self) -> None:
+        self.__client = None
+        self.__database = None
+        self.__pid = None
+        self.__lock = Lock()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__client is not None and self.__pid == os.getpid():
+                self.__client.close()
+            self.__client = None
+            self.__database = None
+            self.__pid = None
+
+
+class LazyDatabase:
+    """
+    Stands in for a pymongo Database at module level, so modules keep writing
+    db.battle.find_one(...) while the client is only made when first used,
+    and whichever storage backend is configured answers
+    """
+
+    def __init__(self, database: Database) -> None:
+        self.__database = database
+
+    def __getattr__(self, name: str):
+        return getattr(self.__database.get_database(), name)
+
+    def __getitem__(self, name: str):
+        return self.__database.get_database()[name]
+
+
+database = Database()
+db = LazyDatabase(database)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=database.reset)
@@ -3,18 +3,15 @@ from models.pokemon import Pokemon
 from models.battle import Battle
 from models.tournament import Tournament
 from models.skill import AttackSkill, DefenseSkill
+from models.adminlog import AdminLevel
 from models.logger import Logger
+from models.database import db
 
 import os
 from typing import List, Optional
 
-from pymongo import MongoClient
 from cryptography.fernet import Fernet  # Using Fernet for password encryption
 
-
-# Set up MongoDB connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client.pokemon_database
 # collection = db.pokemon
 
 
@@ -31,7 +28,7 @@ class DbFetch:
 
         retrieved_user = db.user.find_one({"username": username})
         if retrieved_user is None:
-            self.__logger.admin_log(f"No such user: {username}")
+            self.__logger.admin_log(f"No such user: {username}", AdminLevel.WARNING)
             return None
         encrypted_password = retrieved_user["password"]
 
@@ -48,7 +45,9 @@ class DbFetch:
             return User(retrieved_user["username"], password, auth)
         else:
             # Password didn't match
-            self.__logger.admin_log(f"Incorrect password for {username}")
+            self.__logger.admin_log(
+                f"Incorrect password for {username}", AdminLevel.WARNING
+            )
             return None
 
     def get_pokemon(self, name: str) -> Optional[Pokemon]:
@@ -1,18 +1,67 @@
 # from models.user import User, Authorization
 from models.pokemon import Pokemon
 from models.battle import Battle
-from models.tournament import Tournament
+from models.tournament import Tournament, lease_until
 from models.skill import AttackSkill, DefenseSkill
-from pymongo import MongoClient
-from typing import List, Optional
+from models import codec
+from models.archive import battle_archive
+from models.events import EventRenderer
+from models.replay import ReplayStore
+from models.database import db
+from models.ids import id_allocator
+from models.roster import roster_cache
+from models.adminlog import AdminLevel, admin_logs
+from datetime import datetime, timezone
+import heapq
+from typing import Dict, Iterator, List, Optional, Tuple
+from pymongo import ReturnDocument
 from cryptography.fernet import Fernet  # Using Fernet for password encryption
 import os
 from enum import Enum
 
-# Set up MongoDB connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client.pokemon_database
-collection = db.pokemon
+# Regenerates events for battles stored in replay mode, with an LRU cache
+replay_store = ReplayStore()
+
+# Everything needed to return (or replay) a battle's log, and nothing else
+BATTLE_LOG_PROJECTION = {
+    "_id": 0,
+    "battle id": 1,
+    "pokemon1": 1,
+    "pokemon2": 1,
+    "events": 1,
+    codec.PACKED_EVENTS: 1,
+    "attack skills": 1,
+    "defense skills": 1,
+    "storage": 1,
+    "seed": 1,
+    "definitions": 1,
+    "start": 1,
+    "verbosity": 1,
+    "winner": 1,
+    "turns": 1,
+}
+
+
+# Fields GET /pokemon can be asked for with fields=
+POKEMON_FIELDS = (
+    "_id",
+    "name",
+    "max hp",
+    "image",
+    "battle wins",
+    "battle losses",
+    "tournament wins",
+    "tournament losses",
+    "battle W/L",
+    "tournament W/L",
+    "attack skills",
+    "defense skills",
+)
+# Documents the listing pulls from the server per batch
+POKEMON_BATCH_SIZE = 500
+# Page sizes for GET /pokemon?limit=
+POKEMON_PAGE_SIZE = 100
+MAX_POKEMON_PAGE = 1000
 
 
 class DbCollection(Enum):
@@ -22,6 +71,16 @@ class DbCollection(Enum):
     USER = "USER"
 
 
+class PokemonNotFound(Exception):
+    def __init__(self, names: List[str]) -> None:
+        super().__init__(f"Pokémon {', '.join(names)} not found in the database")
+        self.__names = names
+
+    # Every missing name, in request order
+    def get_names(self) -> List[str]:
+        return self.__names
+
+
 class DbService:
 
     # Return password encrypted with Fernet key from .env
@@ -43,35 +102,119 @@ class DbService:
             return None
         return user
 
-    # Fetches pokemon object by name
+    # Builds a pokemon object from its document in the pokemon collection
+    @staticmethod
+    def pokemon_from_document(pokemon: dict) -> Pokemon:
+        defenseSkills = [
+            DefenseSkill(name, damage)
+            for name, damage in pokemon["defense skills"].items()
+        ]
+        attackSkills = [
+            AttackSkill(name, damage)
+            for name, damage in pokemon["attack skills"].items()
+        ]
+        return Pokemon(
+            name=pokemon["name"],
+            max_hp=pokemon["max hp"],
+            image=pokemon["image"],
+            # Roster cache documents carry no counters, see RosterCache
+            battle_wins=pokemon.get("battle wins", 0),
+            battle_losses=pokemon.get("battle losses", 0),
+            tournament_wins=pokemon.get("tournament wins", 0),
+            tournament_losses=pokemon.get("tournament losses", 0),
+            attack_skills=attackSkills,
+            defense_skills=defenseSkills,
+        )
+
+    # Fetches pokemon object by name, a fresh one built from the roster cache
     def get_pokemon(self, name: str) -> Optional[Pokemon]:
-        pokemon = db.pokemon.find_one({"name": name})
+        pokemon = roster_cache.get_document(name)
         if pokemon is not None:
-            defenseSkills = [
-                DefenseSkill(name, damage)
-                for name, damage in pokemon["defense skills"].items()
-            ]
-            attackSkills = [
-                AttackSkill(name, damage)
-                for name, damage in pokemon["attack skills"].items()
-            ]
-            return Pokemon(
-                name=name,
-                max_hp=pokemon["max hp"],
-                image=pokemon["image"],
-                battle_wins=pokemon["battle wins"],
-                battle_losses=pokemon["battle losses"],
-                tournament_wins=pokemon["tournament wins"],
-                tournament_losses=pokemon["tournament losses"],
-                attack_skills=attackSkills,
-                defense_skills=defenseSkills,
-            )
+            return self.pokemon_from_document(pokemon)
         else:
             return None
 
+    # Fetches a fresh pokemon object per name in request order, so a name
+    # listed twice enters twice. Raises PokemonNotFound naming every missing one
+    def get_pokemon_many(self, names: List[str]) -> List[Pokemon]:
+        documents = self.get_pokemon_documents(names)
+        missing = [name for name in dict.fromkeys(names) if name not in documents]
+        if missing:
+            raise PokemonNotFound(missing)
+        return [self.pokemon_from_document(documents[name]) for name in names]
+
+    # Projection for a pokemon listing, every field when none are given
+    def pokemon_projection(self, fields: Optional[List[str]] = None) -> dict:
+        if not fields:
+            return {}
+        unknown = [field for field in fields if field not in POKEMON_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown pokemon fields: {', '.join(unknown)}")
+        projection = {field: 1 for field in fields}
+        projection.setdefault("_id", 0)
+        return projection
+
+    # Pokemon documents ordered by name, starting after the name given and
+    # read from the server POKEMON_BATCH_SIZE at a time, _id as a string
+    def iter_pokemon(
+        self,
+        fields: Optional[List[str]] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[dict]:
+        query = {"name": {"$gt": after}} if after is not None else {}
+        cursor = (
+            db.pokemon.find(query, self.pokemon_projection(fields) or None)
+            .sort("name", 1)
+            .batch_size(POKEMON_BATCH_SIZE)
+        )
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        for document in cursor:
+            if "_id" in document:
+                document["_id"] = str(document["_id"])
+            yield document
+
+    # One page of the listing and the name to continue after, None at the end
+    def get_pokemon_page(
+        self,
+        fields: Optional[List[str]] = None,
+        after: Optional[str] = None,
+        limit: int = POKEMON_PAGE_SIZE,
+    ) -> Tuple[List[dict], Optional[str]]:
+        limit = max(1, min(limit, MAX_POKEMON_PAGE))
+        # The page's last name is the cursor, so it is always fetched
+        wanted = list(fields) if fields else None
+        if wanted and "name" not in wanted:
+            wanted.append("name")
+        # One extra tells us whether there is another page
+        documents = list(self.iter_pokemon(wanted, after, limit + 1))
+        next_after = documents[limit - 1]["name"] if len(documents) > limit else None
+        documents = documents[:limit]
+        if fields and "name" not in fields:
+            for document in documents:
+                del document["name"]
+        return documents, next_after
+
+    # Fetches pokemon documents for many names, keyed by name. They come from
+    # the roster cache (misses in one query) and must not be modified
+    def get_pokemon_documents(self, names: List[str]) -> Dict[str, dict]:
+        return roster_cache.get_documents(names)
+
+    # Fetches a battle document, replaying its events if it was stored by seed.
+    # Battles no longer in the collection are looked up in the archive
+    def find_battle_document(self, battleid: int) -> Optional[dict]:
+        retrieved_battle = db.battle.find_one({"battle id": battleid}, {"_id": 0})
+        if retrieved_battle is None:
+            retrieved_battle = battle_archive.find_battle(battleid)
+
+        if retrieved_battle is None:
+            return None
+        return codec.unpack_battle(replay_store.materialize(retrieved_battle))
+
     # Fetches battle object by id
     def get_battle(self, battleid: int) -> Optional[Battle]:
-        retrieved_battle = db.battle.find_one({"battle id": battleid})
+        retrieved_battle = self.find_battle_document(battleid)
 
         if retrieved_battle is None:
             return None
@@ -91,7 +234,7 @@ class DbService:
     # Fetches battle log that just holds events
     def get_battle_events(self, battleid: int) -> List[str]:
         events: List[str] = []
-        retrieved_battle = db.battle.find_one({"battle id": battleid})
+        retrieved_battle = self.find_battle_document(battleid)
 
         if retrieved_battle is None:
             return None
@@ -100,60 +243,187 @@ class DbService:
             events.append(event)
         return events
 
-    # Fetches all battle objects in collection
+    # Fetches battle events rendered as log lines -- the only place text is built
+    def get_rendered_battle_events(self, battleid: int) -> Optional[List[str]]:
+        retrieved_battle = self.find_battle_document(battleid)
+
+        if retrieved_battle is None:
+            return None
+
+        renderer = EventRenderer.from_document(retrieved_battle)
+        return renderer.render_all(retrieved_battle["events"])
+
+    """ Fetches the logs of many battles with one query, keyed by battle id.
+    Events are rendered as text unless raw; missing ids are left out """
+
+    def get_battles_events(
+        self, battleids: List[int], raw: bool = False
+    ) -> Dict[int, dict]:
+        retrieved_battles = list(
+            db.battle.find(
+                {"battle id": {"$in": list(battleids)}}, BATTLE_LOG_PROJECTION
+            )
+        )
+        found = {battle["battle id"] for battle in retrieved_battles}
+        missing = [battleid for battleid in battleids if battleid not in found]
+        if missing:
+            retrieved_battles += battle_archive.find_battles(missing)
+
+        battles: Dict[int, dict] = {}
+        for battle in replay_store.materialize_many(retrieved_battles):
+            battle = codec.unpack_battle(battle)
+            events = battle.get("events", [])
+            if not raw:
+                events = EventRenderer.from_document(battle).render_all(events)
+            battles[battle["battle id"]] = {
+                "battle_id": battle["battle id"],
+                "pokemon1": battle["pokemon1"],
+                "pokemon2": battle["pokemon2"],
+                "events": events,
+            }
+        return battles
+
+    # Fetches all battle objects in collection and archive
     def get_all_battles(self) -> List:
         # Returns them in sorted (Ascending) order for ease of use
-        all_documents = db.battle.find().sort("battle id", 1)
-        return list(all_documents)
-
-    # Fetches most recent battle id and increments for next go
+        all_documents = heapq.merge(
+            db.battle.find({}, {"_id": 0}).sort("battle id", 1),
+            battle_archive.iter_battles(),
+            key=lambda document: document["battle id"],
+        )
+        return [
+            codec.unpack_battle(replay_store.materialize(document))
+            for document in all_documents
+        ]
+
+    # Allocates a unique battle id, see models/ids.py
     def get_next_battle_id(self) -> int:
-        # Generate unique battle ID
-        return db.battle.count_documents({}) + 1
+        return id_allocator.next_id("battle")
 
-    # Fetches most recent battle id and increments for next go
+    # Allocates count consecutive battle ids and returns the first
+    def reserve_battle_ids(self, count: int) -> int:
+        return id_allocator.reserve("battle", count)
+
+    # Allocates a unique tournament id
     def get_next_tournament_id(self) -> int:
-        return db.tournament.count_documents({}) + 1
+        return id_allocator.next_id("tournament")
 
     # Fetch tournament object by id
-    def get_tournament(self, tournamentid: int) -> Optional[Tournament]:
+    def get_tournament_document(self, tournamentid: int) -> Optional[dict]:
         retrieved_tourney = db.tournament.find_one({"tournament id": tournamentid})
-
         if retrieved_tourney is None:
             return None
+        return codec.unpack_tournament(retrieved_tourney)
 
-        participants: List[Pokemon] = []
+    def get_tournament(self, tournamentid: int) -> Optional[Tournament]:
+        retrieved_tourney = self.get_tournament_document(tournamentid)
 
-        for participant in retrieved_tourney["participants"]:
-            pokemon: Pokemon = self.get_pokemon(participant)
-            if pokemon is None:
-                return None
+        if retrieved_tourney is None:
+            return None
 
-            participants.append(pokemon)
+        try:
+            participants = self.get_pokemon_many(retrieved_tourney["participants"])
+        except PokemonNotFound:
+            return None
 
         tournament = Tournament(participants, retrieved_tourney["tournament id"])
 
-        for event in retrieved_tourney["events"]:
+        for event in self.get_tournament_events(tournamentid, retrieved_tourney):
             tournament.append_event(event)
 
         return tournament
 
-    # Fetches tournament log by id -- list of battle victors who move on to next round
-    def get_tournament_events(self, tournamentid: int) -> List[str]:
-        retrieved_tourney = db.battle.find_one({"tournament id": tournamentid})
+    # Fetches tournament log by id -- list of rounds with each battle's victor.
+    # Large brackets keep their rounds in tournament_round instead
+    def get_tournament_events(
+        self, tournamentid: int, retrieved_tourney: Optional[dict] = None
+    ) -> Optional[List[dict]]:
+        if retrieved_tourney is None:
+            retrieved_tourney = self.get_tournament_document(tournamentid)
 
         if retrieved_tourney is None:
             return None
 
-        events: List[str] = []
-
-        for event in retrieved_tourney["events"]:
-            events.append_event(event)
-
-        return events
-
-    # Fetches the grow-only admin log that stores administrative events
-    def get_admin_logs(self) -> Optional[List[str]]:
-        # Just have one super admin log to find and retrieve
-        admin_logs = db.admin.find_one()
-        return admin_logs["events"] if admin_logs else None
+        retrieved_tourney = codec.unpack_tournament(retrieved_tourney)
+        if "events" in retrieved_tourney:
+            return retrieved_tourney["events"]
+        return self.get_tournament_rounds(tournamentid)
+
+    # Reassembles round results that were stored page by page as they ran
+    def get_tournament_rounds(self, tournamentid: int) -> List[dict]:
+        rounds: List[dict] = []
+        pages = db.tournament_round.find(
+            {"tournament id": tournamentid},
+            {"_id": 0, "round": 1, "events": 1, codec.PACKED_EVENTS: 1},
+        ).sort([("round", 1), ("page", 1)])
+
+        for page in pages:
+            if not rounds or rounds[-1]["round"] != page["round"]:
+                rounds.append({"round": page["round"], "events": []})
+            if codec.PACKED_EVENTS in page:
+                for packed in codec.unpack_rounds(page[codec.PACKED_EVENTS]):
+                    rounds[-1]["events"].extend(packed["events"])
+            else:
+                rounds[-1]["events"].extend(page["events"])
+        return rounds
+
+    # Fetches the checkpoint of a tournament that has not finished
+    def get_tournament_checkpoint(self, tournamentid: int) -> Optional[dict]:
+        return db.tournament_checkpoint.find_one(
+            {"tournament id": tournamentid}, {"_id": 0}
+        )
+
+    # Takes the checkpoint for this owner unless another run holds an
+    # unexpired lease on it; None when it is held (or gone)
+    def claim_tournament_checkpoint(
+        self, tournamentid: int, owner: str
+    ) -> Optional[dict]:
+        return db.tournament_checkpoint.find_one_and_update(
+            {
+                "tournament id": tournamentid,
+                "$or": [
+                    {"lease until": None},
+                    {"lease until": {"$lt": datetime.now(timezone.utc)}},
+                ],
+            },
+            {"$set": {"owner": owner, "lease until": lease_until()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    """ Drops what an interrupted round left behind: its result pages and the
+    battles in its id range, so replaying the round writes them afresh """
+
+    def discard_unfinished_round(
+        self,
+        tournamentid: int,
+        completed_round: int,
+        first_battle_id: int,
+        battle_count: int,
+    ) -> None:
+        db.tournament_round.delete_many(
+            {"tournament id": tournamentid, "round": {"$gt": completed_round}}
+        )
+        db.battle.delete_many(
+            {
+                "battle id": {
+                    "$gte": first_battle_id,
+                    "$lt": first_battle_id + battle_count,
+                }
+            }
+        )
+
+    # One page of admin log entries, newest first, and the cursor of the next
+    def get_admin_logs(
+        self,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        level: Optional[AdminLevel] = None,
+        battle_id: Optional[int] = None,
+        tournament_id: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        return admin_logs.get_page(
+            since, until, cursor, limit, level, battle_id, tournament_id
+        )
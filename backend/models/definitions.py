@@ -0,0 +1,79 @@
+import hashlib
+import json
+from typing import Optional
+
+from models.database import db
+
+DEFINITION_PROJECTION = {
+    "_id": 0,
+    "name": 1,
+    "max hp": 1,
+    "attack skills": 1,
+    "defense skills": 1,
+}
+
+# A definition is everything a seeded battle needs to be played again:
+# name, max hp and the skills as ordered [name, damage] pairs (skill order
+# decides which one a seed picks). Definitions are compared by hash.
+
+
+def definition_of_pokemon(pokemon) -> dict:
+    return {
+        "name": pokemon.get_name(),
+        "max hp": pokemon.get_max_hp(),
+        "attack skills": [
+            [skill.get_name(), skill.get_damage()]
+            for skill in pokemon.get_attack_skills()
+        ],
+        "defense skills": [
+            [skill.get_name(), skill.get_damage()]
+            for skill in pokemon.get_defense_skills()
+        ],
+    }
+
+
+# Same shape from a document in the pokemon collection (skills as name: damage)
+def definition_of_document(document: dict) -> dict:
+    return {
+        "name": document["name"],
+        "max hp": document["max hp"],
+        "attack skills": [list(item) for item in document["attack skills"].items()],
+        "defense skills": [list(item) for item in document["defense skills"].items()],
+    }
+
+
+def hash_definition(definition: dict) -> str:
+    encoded = json.dumps(definition, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+# Called before a pokemon is written: if its battle relevant fields change,
+# the old definition is frozen so battles stored by hash can still replay
+def snapshot_if_changed(new_data: dict) -> Optional[str]:
+    existing = db.pokemon.find_one({"name": new_data["name"]}, DEFINITION_PROJECTION)
+    if existing is None:
+        return None
+
+    old_definition = definition_of_document(existing)
+    old_hash = hash_definition(old_definition)
+    if old_hash == hash_definition(definition_of_document(new_data)):
+        return None
+
+    db.pokemon_snapshot.update_one(
+        {"hash": old_hash},
+        {"$setOnInsert": {"hash": old_hash, "definition": old_definition}},
+        upsert=True,
+    )
+    return old_hash
+
+
+# The live definition if it still matches, otherwise the frozen snapshot
+def find_definition(name: str, definition_hash: str) -> Optional[dict]:
+    current = db.pokemon.find_one({"name": name}, DEFINITION_PROJECTION)
+    if current is not None:
+        definition = definition_of_document(current)
+        if hash_definition(definition) == definition_hash:
+            return definition
+
+    snapshot = db.pokemon_snapshot.find_one({"hash": definition_hash})
+    return snapshot["definition"] if snapshot else None
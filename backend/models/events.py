@@ -0,0 +1,117 @@
+from enum import Enum, IntEnum
+from typing import List, Optional, Sequence, Tuple, Union
+
+# Battle events are stored as (code, actor, skill, damage, remaining hp).
+# actor is the side index (0 for pokemon1, 1 for pokemon2) the line is about
+# and skill indexes that side's attack or defense skill list
+Event = Tuple[int, int, int, int, int]
+
+
+class EventCode(IntEnum):
+    START = 0
+    ATTACK = 1  # actor attacks with skill for damage
+    REDUCE = 2  # actor's defense skill reduced the incoming hit by damage
+    DAMAGE = 3  # actor took damage and has remaining hp left
+    DEFEND = 4  # actor raised defense skill
+    LOSE = 5
+    WIN = 6
+
+
+class Verbosity(Enum):
+    NONE = "none"  # no events at all
+    SUMMARY = "summary"  # start and outcome only
+    FULL = "full"  # every turn
+
+    @staticmethod
+    def parse(value: Optional[str]) -> "Verbosity":
+        if value is None:
+            return Verbosity.FULL
+        try:
+            return Verbosity(value)
+        except ValueError:
+            raise ValueError(
+                f"verbosity must be one of {', '.join(v.value for v in Verbosity)}"
+            )
+
+
+# Plain ints so events encode to BSON and JSON without help
+START = int(EventCode.START)
+ATTACK = int(EventCode.ATTACK)
+REDUCE = int(EventCode.REDUCE)
+DAMAGE = int(EventCode.DAMAGE)
+DEFEND = int(EventCode.DEFEND)
+LOSE = int(EventCode.LOSE)
+WIN = int(EventCode.WIN)
+
+START_EVENT: Event = (START, 0, 0, 0, 0)
+
+
+def outcome_events(winner: int) -> List[Event]:
+    return [(LOSE, 1 - winner, 0, 0, 0), (WIN, winner, 0, 0, 0)]
+
+
+class EventRenderer:
+    def __init__(
+        self,
+        names: Sequence[str],
+        attack_skills: Sequence[Sequence[str]],
+        defense_skills: Sequence[Sequence[str]],
+    ) -> None:
+        self.__names = names
+        self.__attack_skills = attack_skills
+        self.__defense_skills = defense_skills
+
+    # Builds a renderer from a stored battle document
+    @staticmethod
+    def from_document(document: dict) -> "EventRenderer":
+        return EventRenderer(
+            [document["pokemon1"], document["pokemon2"]],
+            document.get("attack skills", [[], []]),
+            document.get("defense skills", [[], []]),
+        )
+
+    # Builds a renderer for a live battle from its two pokemon
+    @staticmethod
+    def from_pokemon(pokemon: Sequence) -> "EventRenderer":
+        return EventRenderer(
+            [p.get_name() for p in pokemon],
+            [[skill.get_name() for skill in p.get_attack_skills()] for p in pokemon],
+            [[skill.get_name() for skill in p.get_defense_skills()] for p in pokemon],
+        )
+
+    def render(self, event: Union[Sequence[int], str]) -> str:
+        # Battles saved before structured events already hold their text
+        if isinstance(event, str):
+            return event
+
+        code, actor, skill, damage, hp = event
+        name = self.__names[actor]
+        other = self.__names[1 - actor]
+
+        if code == EventCode.START:
+            return "Welcome to the thunderdome!"
+        if code == EventCode.ATTACK:
+            return (
+                f"{name} is attacking with {self.__attack_skills[actor][skill]} "
+                f"for {damage} damage to {other}"
+            )
+        if code == EventCode.REDUCE:
+            return (
+                f"{name} successfully reduced {other}'s damage by {damage} "
+                f"with {self.__defense_skills[actor][skill]}"
+            )
+        if code == EventCode.DAMAGE:
+            return f"{name} has received {damage} damage, remaining hp is {hp}"
+        if code == EventCode.DEFEND:
+            return (
+                f"{name} is attempting to defend with "
+                f"{self.__defense_skills[actor][skill]}"
+            )
+        if code == EventCode.LOSE:
+            return f"{name} has lost"
+        if code == EventCode.WIN:
+            return f"{name} has won the battle"
+        raise ValueError(f"Unknown event code: {code}")
+
+    def render_all(self, events: Sequence[Union[Sequence[int], str]]) -> List[str]:
+        return [self.render(event) for event in events]
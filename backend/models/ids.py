@@ -0,0 +1,82 @@
+import os
+from threading import Lock
+from typing import Dict, Set, Tuple
+
+from pymongo import ReturnDocument
+
+from models.database import db
+
+# Ids a process takes from the counter at a time and hands out locally;
+# unused ones are skipped when the process exits. Tournaments stay gapless
+BLOCK_SIZES = {
+    "battle": int(os.getenv("BATTLE_ID_BLOCK", "32")),
+    "tournament": 1,
+}
+
+# Where each counter's ids live, to start it above ids handed out before
+# counters existed
+COUNTED_FIELDS = {
+    "battle": ("battle", "battle id"),
+    "tournament": ("tournament", "tournament id"),
+}
+
+
+class IdAllocator:
+    """
+    Hands out ids from the counters collection, one document per id kind
+    holding the last id reserved. Every reservation is a single atomic $inc,
+    so concurrent requests and processes never get the same id. next_id
+    serves single ids from a per-process block; reserve takes a contiguous
+    range straight from the counter, e.g. every battle of a tournament.
+    """
+
+    def __init__(self, block_sizes: Dict[str, int] = None) -> None:
+        self.__block_sizes = block_sizes if block_sizes else BLOCK_SIZES
+        # name -> (next id, end of the block exclusive)
+        self.__blocks: Dict[str, Tuple[int, int]] = {}
+        self.__started: Set[str] = set()
+        self.__pid = os.getpid()
+        self.__lock = Lock()
+
+    # First id of count consecutive ids nobody else will get
+    def reserve(self, name: str, count: int) -> int:
+        self.start_counter(name)
+        counter = db.counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["value"] - count + 1
+
+    def next_id(self, name: str) -> int:
+        with self.__lock:
+            # A forked child must not reuse its parent's block
+            if self.__pid != os.getpid():
+                self.__blocks.clear()
+                self.__pid = os.getpid()
+
+            next_id, end = self.__blocks.get(name, (0, 0))
+            if next_id >= end:
+                block_size = self.__block_sizes.get(name, 1)
+                next_id = self.reserve(name, block_size)
+                end = next_id + block_size
+            self.__blocks[name] = (next_id + 1, end)
+            return next_id
+
+    # Once per process: lift the counter to the highest id already stored.
+    # $max only ever raises it, so racing processes agree
+    def start_counter(self, name: str) -> None:
+        if name in self.__started:
+            return
+        collection, field = COUNTED_FIELDS[name]
+        latest = db[collection].find_one({}, {field: 1}, sort=[(field, -1)])
+        db.counters.update_one(
+            {"_id": name},
+            {"$max": {"value": latest[field] if latest else 0}},
+            upsert=True,
+        )
+        self.__started.add(name)
+
+
+id_allocator = IdAllocator()
@@ -0,0 +1,414 @@
+from models.battlemanager import BattleManager
+from models.database import db
+from models.dbservice import DbService, PokemonNotFound
+from models.events import Verbosity
+from models.adminlog import AdminLevel
+from models.logger import Logger
+from models.pokemon import Pokemon
+
+import math
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from threading import Lock, Thread
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+
+logger = Logger()
+
+# Tournaments running at the same time; each reserves its own battle ids
+JOB_WORKERS = int(os.getenv("TOURNAMENT_JOB_WORKERS", "2"))
+# Jobs allowed to wait for a worker before submissions are turned away
+JOB_QUEUE_DEPTH = int(os.getenv("TOURNAMENT_JOB_QUEUE", "16"))
+# Finished jobs kept in the job collection for GET /jobs/<id>
+JOB_HISTORY_HOURS = float(os.getenv("TOURNAMENT_JOB_HISTORY_HOURS", "24"))
+# How often a process marks its jobs alive, and how long without that before
+# another process takes them over
+JOB_HEARTBEAT_SECONDS = 10
+JOB_STALE_SECONDS = 60
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+UNFINISHED = [JobStatus.QUEUED.value, JobStatus.RUNNING.value]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+# The job was claimed by another queue; the run that finds out stops
+class JobTakenOver(Exception):
+    pass
+
+
+# GET /jobs/<id> from a job collection document
+def status_data(document: dict) -> dict:
+    data = {
+        "job_id": document["_id"],
+        "status": document["status"],
+        "tournament_id": document.get("tournament id"),
+        "progress": {
+            "round": document.get("round", 0),
+            "total_rounds": document.get("total rounds", 0),
+            "battles_done": document.get("battles done", 0),
+            "total_battles": document.get("total battles", 0),
+        },
+    }
+    if document["status"] == JobStatus.DONE.value:
+        data["winner"] = document.get("winner")
+    if document.get("error") is not None:
+        data["error"] = document["error"]
+    return data
+
+
+class TournamentJob:
+    def __init__(
+        self,
+        participants: List[Pokemon],
+        seed: Optional[int] = None,
+        verbosity: Verbosity = Verbosity.FULL,
+        job_id: Optional[str] = None,
+    ) -> None:
+        self.__job_id = job_id if job_id else uuid.uuid4().hex
+        self.__participants = participants
+        self.__seed = seed
+        self.__verbosity = verbosity
+        self.__status = JobStatus.QUEUED
+        self.__tournament_id: Optional[int] = None
+        self.__winner: Optional[str] = None
+        self.__error: Optional[str] = None
+        self.__owner: Optional[str] = None  # Queue that runs it, see JobQueue
+        self.__stored = False  # In the job collection already
+        # Progress, updated by the worker as the bracket runs
+        self.__round = 0
+        self.__total_rounds = (
+            math.ceil(math.log2(len(participants))) if len(participants) > 1 else 0
+        )
+        self.__battles_done = 0
+        self.__total_battles = max(len(participants) - 1, 0)
+
+    # A job read back from the job collection, to run again in this process
+    @classmethod
+    def from_document(
+        cls, document: dict, participants: List[Pokemon]
+    ) -> "TournamentJob":
+        job = cls(
+            participants,
+            document.get("seed"),
+            Verbosity(document["verbosity"]),
+            document["_id"],
+        )
+        job.restore(document)
+        return job
+
+    def restore(self, document: dict) -> None:
+        self.__tournament_id = document.get("tournament id")
+        self.__round = document.get("round", 0)
+        self.__battles_done = document.get("battles done", 0)
+        self.__owner = document.get("owner")
+        self.__stored = True
+
+    def get_job_id(self) -> str:
+        return self.__job_id
+
+    def get_status(self) -> JobStatus:
+        return self.__status
+
+    def set_owner(self, owner: str) -> None:
+        self.__owner = owner
+
+    def is_finished(self) -> bool:
+        return self.__status in (JobStatus.DONE, JobStatus.FAILED)
+
+    def get_status_data(self) -> dict:
+        return status_data(dict(self.get_document(), _id=self.__job_id))
+
+    # What the job collection keeps: status and progress for GET /jobs/<id>,
+    # and enough to run the job again if its process stops
+    def get_document(self) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "status": self.__status.value,
+            "tournament id": self.__tournament_id,
+            "round": self.__round,
+            "total rounds": self.__total_rounds,
+            "battles done": self.__battles_done,
+            "total battles": self.__total_battles,
+            "winner": self.__winner,
+            "error": self.__error,
+            "participants": [p.get_name() for p in self.__participants],
+            "seed": self.__seed,
+            "verbosity": self.__verbosity.value,
+            "owner": self.__owner,
+            "heartbeat": now,
+            "finished": now if self.is_finished() else None,
+        }
+
+    # Written when the job is queued, starts, finishes and at every round.
+    # Once stored, only the owner's writes match; raises JobTakenOver when
+    # another queue claimed the job meanwhile
+    def save(self) -> None:
+        if not self.__stored:
+            logger.update_or_insert("job", {"_id": self.__job_id}, self.get_document())
+            self.__stored = True
+            return
+        result = logger.update(
+            "job", {"_id": self.__job_id, "owner": self.__owner}, self.get_document()
+        )
+        if result.matched_count == 0:
+            raise JobTakenOver(f"Tournament job {self.__job_id} is run elsewhere")
+
+    # Runs on a worker thread. A manager per job keeps the seed this job was
+    # submitted with even if another request changes the shared one
+    def run(self) -> None:
+        self.__status = JobStatus.RUNNING
+        try:
+            self.save()
+            manager = BattleManager(self.__seed)
+            tournament = None
+            if self.__tournament_id is not None:
+                # Taken over from a process that stopped: finish the
+                # tournament from its last completed round
+                finished = DbService().get_tournament_document(self.__tournament_id)
+                if finished is not None and finished.get("winner"):
+                    self.finish(finished["winner"])
+                    return
+                tournament = manager.resume_tournament(self.__tournament_id)
+            if tournament is None:
+                tournament = manager.create_tournament(
+                    self.__participants, self.__verbosity
+                )
+                self.__round = 0
+                self.__battles_done = 0
+            self.__tournament_id = tournament.get_tournament_id()
+            self.save()
+
+            progress = manager.stream_tournament(tournament)
+            try:
+                while True:
+                    try:
+                        kind, value = next(progress)
+                    except StopIteration as stop:
+                        winner = stop.value
+                        break
+                    if kind == "round":
+                        self.__round = value
+                        self.save()
+                    elif kind == "battle":
+                        self.__battles_done += 1
+            finally:
+                progress.close()
+
+            if winner is None:
+                self.fail("Tournament terminated early")
+            else:
+                self.finish(winner.get_name())
+        except JobTakenOver as e:
+            # The queue that claimed it finishes the tournament
+            logger.admin_log(
+                f"{str(e)}, stopped here",
+                AdminLevel.WARNING,
+                tournament_id=self.__tournament_id,
+            )
+        except Exception as e:
+            logger.admin_log(
+                f"Tournament job {self.__job_id} failed: {str(e)}",
+                AdminLevel.ERROR,
+                tournament_id=self.__tournament_id,
+            )
+            self.fail(f"An error occurred: {str(e)}")
+
+    def finish(self, winner: str) -> None:
+        self.__winner = winner
+        self.__battles_done = self.__total_battles
+        self.__status = JobStatus.DONE
+        self.save()
+
+    def fail(self, error: str) -> None:
+        self.__error = error
+        self.__status = JobStatus.FAILED
+        try:
+            self.save()
+        except JobTakenOver:
+            pass
+        except Exception as e:
+            logger.admin_log(
+                f"Tournament job {self.__job_id} status not saved: {str(e)}",
+                AdminLevel.ERROR,
+            )
+
+
+class JobQueue:
+    """
+    Runs tournament jobs on a thread pool. Status and progress live in the
+    job collection, so GET /jobs/<id> answers from any process. A heartbeat
+    thread marks this process's unfinished jobs alive; jobs whose process
+    stopped beating (a restart, a crash) are claimed by one live queue and
+    run again, a started tournament resumed from its checkpoint.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = JOB_WORKERS,
+        max_queued: int = JOB_QUEUE_DEPTH,
+    ) -> None:
+        self.__max_workers = max_workers
+        self.__max_queued = max_queued
+        self.__lock = Lock()
+        self.__pid: Optional[int] = None
+        self.start_process()
+
+    # Threads don't survive a fork, so a child starts its own pool and owner
+    def start_process(self) -> None:
+        self.__pid = os.getpid()
+        self.__owner = uuid.uuid4().hex
+        self.__pool = ThreadPoolExecutor(
+            max_workers=self.__max_workers, thread_name_prefix="tournament-job"
+        )
+        self.__pending = 0
+        self.__heartbeat: Optional[Thread] = None
+
+    def check_process(self) -> None:
+        if self.__pid != os.getpid():
+            self.start_process()
+
+    def ensure_indexes(self) -> None:
+        db.job.create_index([("status", 1), ("heartbeat", 1)])
+        db.job.create_index("owner")
+        db.job.create_index("finished")
+
+    def get_max_workers(self) -> int:
+        return self.__max_workers
+
+    def get_max_queued(self) -> int:
+        return self.__max_queued
+
+    # Running and waiting jobs together, in this process
+    def get_pending(self) -> int:
+        return self.__pending
+
+    def submit(self, job: TournamentJob) -> TournamentJob:
+        with self.__lock:
+            self.check_process()
+            if self.__pending >= self.__max_workers + self.__max_queued:
+                raise JobQueueFull(
+                    f"Job queue is full ({self.__pending} jobs pending), try again later"
+                )
+            self.__pending += 1
+        job.set_owner(self.__owner)
+        try:
+            job.save()
+        except Exception:
+            with self.__lock:
+                self.__pending -= 1
+            raise
+
+        logger.admin_log(f"Tournament job queued: {job.get_job_id()}")
+        self.start()
+        self.__pool.submit(self.__run, job)
+        return job
+
+    def __run(self, job: TournamentJob) -> None:
+        try:
+            job.run()
+        finally:
+            with self.__lock:
+                self.__pending -= 1
+
+    def get_status_data(self, job_id: str) -> Optional[dict]:
+        document = db.job.find_one({"_id": job_id})
+        return None if document is None else status_data(document)
+
+    # Starts the heartbeat thread once per process
+    def start(self) -> None:
+        with self.__lock:
+            self.check_process()
+            if self.__heartbeat is not None:
+                return
+            self.__heartbeat = Thread(
+                target=self.beat, name="tournament-job-heartbeat", daemon=True
+            )
+            self.__heartbeat.start()
+
+    def beat(self) -> None:
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                db.job.update_many(
+                    {"owner": self.__owner, "status": {"$in": UNFINISHED}},
+                    {"$set": {"heartbeat": now}},
+                )
+                db.job.delete_many(
+                    {"finished": {"$lt": now - timedelta(hours=JOB_HISTORY_HOURS)}}
+                )
+                self.recover()
+            except Exception as e:
+                logger.admin_log(f"Job heartbeat failed: {str(e)}", AdminLevel.ERROR)
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+
+    """ Claims unfinished jobs whose process stopped beating and runs them
+    here, as many as the queue has room for. The claim is one atomic update,
+    so only one process gets each job; if the old one is still alive, its
+    next save finds the job gone and it stops. Returns how many were taken
+    over """
+
+    def recover(self) -> int:
+        now = datetime.now(timezone.utc)
+        stale = {
+            "status": {"$in": UNFINISHED},
+            "heartbeat": {"$lt": now - timedelta(seconds=JOB_STALE_SECONDS)},
+        }
+        recovered = 0
+        for found in list(db.job.find(stale, {"_id": 1})):
+            with self.__lock:
+                self.check_process()
+                if self.__pending >= self.__max_workers + self.__max_queued:
+                    break
+                self.__pending += 1  # Held for the job about to be claimed
+            document = db.job.find_one_and_update(
+                dict(stale, _id=found["_id"]),
+                {"$set": {"owner": self.__owner, "heartbeat": now}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if document is None:
+                with self.__lock:
+                    self.__pending -= 1
+                continue  # Another process claimed it first
+            try:
+                participants = DbService().get_pokemon_many(document["participants"])
+            except PokemonNotFound as e:
+                db.job.update_one(
+                    {"_id": document["_id"]},
+                    {
+                        "$set": {
+                            "status": JobStatus.FAILED.value,
+                            "error": f"Cannot resume job: {str(e)}",
+                            "finished": now,
+                        }
+                    },
+                )
+                with self.__lock:
+                    self.__pending -= 1
+                continue
+
+            job = TournamentJob.from_document(document, participants)
+            logger.admin_log(
+                f"Tournament job taken over: {job.get_job_id()}",
+                tournament_id=document.get("tournament id"),
+            )
+            self.__pool.submit(self.__run, job)
+            recovered += 1
+        return recovered
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.__pool.shutdown(wait=wait)
@@ -0,0 +1,180 @@
+from models.pokemon import Pokemon
+from models.events import ATTACK, DAMAGE, DEFEND, REDUCE, Event
+
+from typing import List, Optional, Tuple
+
+# Pokemon.choose_skill thresholds: attack when randint(0, 9) is below these
+AGGRESSIVE_ATTACK_ROLL = 7
+BALANCED_ATTACK_ROLL = 5
+DEFENSIVE_ATTACK_ROLL = 3
+
+NO_GUARD = -1
+
+# Random._randbelow(n) draws n.bit_length() bits and rejects values >= n;
+# the loop inlines that on getrandbits so seeded streams stay identical
+ROLL_SIDES = 10
+ROLL_BITS = ROLL_SIDES.bit_length()
+
+
+def lowest_hp_for_ratio(max_hp: int, ratio: float) -> float:
+    # Smallest hp where current / max >= ratio, matching get_hp_ratio's floats
+    if max_hp <= 0:
+        return float("inf")
+    hp = -(-int(ratio * 10) * max_hp // 10)
+    while hp > 0 and (hp - 1) / max_hp >= ratio:
+        hp -= 1
+    while hp / max_hp < ratio:
+        hp += 1
+    return hp
+
+
+class Fighter:
+    """
+    Flat battle state for one Pokemon, compiled once per battle so the turn
+    loop only reads and writes slots: no getters, Targets or skill lists.
+    Attack and defend events only depend on the skill used, so they are
+    built once here and shared by every turn that repeats them.
+    """
+
+    __slots__ = (
+        "pokemon",
+        "index",
+        "hp",
+        "aggressive_hp",
+        "balanced_hp",
+        "getrandbits",
+        "attack_count",
+        "attack_bits",
+        "attack_damage",
+        "attack_events",
+        "defense_count",
+        "defense_bits",
+        "defense_damage",
+        "defend_events",
+        "guard",
+        "foe",
+    )
+
+    def __init__(self, pokemon: Pokemon, index: int) -> None:
+        attack_skills = pokemon.get_attack_skills()
+        defense_skills = pokemon.get_defense_skills()
+
+        self.pokemon = pokemon
+        self.index = index
+        self.hp = pokemon.get_current_hp()
+        self.aggressive_hp = lowest_hp_for_ratio(pokemon.get_max_hp(), 0.7)
+        self.balanced_hp = lowest_hp_for_ratio(pokemon.get_max_hp(), 0.3)
+        # randint(0, 9) and choice() both come down to the same generator's
+        # getrandbits, so drawing from it directly keeps seeded battles identical
+        self.getrandbits = pokemon.get_random().getrandbits
+
+        self.attack_count = len(attack_skills)
+        self.attack_bits = self.attack_count.bit_length()
+        self.attack_damage = [skill.get_damage() for skill in attack_skills]
+        self.attack_events = [
+            (ATTACK, index, skill, damage, 0)
+            for skill, damage in enumerate(self.attack_damage)
+        ]
+        self.defense_count = len(defense_skills)
+        self.defense_bits = self.defense_count.bit_length()
+        self.defense_damage = [skill.get_damage() for skill in defense_skills]
+        self.defend_events = [
+            (DEFEND, index, skill, 0, 0) for skill in range(self.defense_count)
+        ]
+
+        active_defense = pokemon.get_active_defense()
+        self.guard = (
+            defense_skills.index(active_defense)
+            if active_defense in defense_skills
+            else NO_GUARD
+        )
+        self.foe: Optional[Fighter] = None
+
+    # Copy the end state back so the Pokemon objects look as if they fought
+    def store(self) -> None:
+        self.pokemon.set_current_hp(self.hp)
+        defense_skills = self.pokemon.get_defense_skills()
+        self.pokemon.set_active_defense(
+            defense_skills[self.guard] if self.guard != NO_GUARD else None
+        )
+
+
+def compile_fighters(pokemon1: Pokemon, pokemon2: Pokemon) -> Tuple[Fighter, Fighter]:
+    first = Fighter(pokemon1, 0)
+    second = Fighter(pokemon2, 1)
+    first.foe = second
+    # Battle.get_action_from_pokemon tells sides apart by name, so when both
+    # share one, pokemon2's attacks land on itself -- kept for identical logs
+    same_name = pokemon1.get_name() == pokemon2.get_name()
+    second.foe = second if same_name else first
+    return first, second
+
+
+def run_turns(
+    actor: Fighter,
+    waiting: Fighter,
+    events: Optional[List[Event]] = None,
+    max_turns: Optional[int] = None,
+) -> int:
+    """
+    Play turns until either side reaches 0 hp, starting with actor, and
+    return the number of turns taken. Turn events are appended to events
+    as (code, actor, skill, damage, remaining hp); pass None to skip them.
+    With max_turns the loop stops early so callers can resume it in chunks,
+    the side to act next is actor if an even number of turns were taken.
+    """
+    record = events is not None
+    append = events.append if record else None
+    turns = 0
+    limit = max_turns if max_turns is not None else -1
+
+    while actor.hp != 0 and waiting.hp != 0 and turns != limit:
+        getrandbits = actor.getrandbits
+        roll = getrandbits(ROLL_BITS)
+        while roll >= ROLL_SIDES:
+            roll = getrandbits(ROLL_BITS)
+        if actor.hp >= actor.aggressive_hp:
+            attacks = roll < AGGRESSIVE_ATTACK_ROLL
+        elif actor.hp >= actor.balanced_hp:
+            attacks = roll < BALANCED_ATTACK_ROLL
+        else:
+            attacks = roll < DEFENSIVE_ATTACK_ROLL
+
+        if attacks:
+            if not actor.attack_count:
+                raise ValueError("Skill list must not be empty.")
+            skill = getrandbits(actor.attack_bits)
+            while skill >= actor.attack_count:
+                skill = getrandbits(actor.attack_bits)
+            foe = actor.foe
+            damage = actor.attack_damage[skill]
+            if record:
+                append(actor.attack_events[skill])
+
+            guard = foe.guard
+            if guard != NO_GUARD:
+                hit = damage - foe.defense_damage[guard]
+                hit = hit if hit > 0 else 0
+                foe.guard = NO_GUARD
+                if record and damage > hit:
+                    append((REDUCE, foe.index, guard, damage - hit, 0))
+                damage = hit
+
+            taken = damage if damage < foe.hp else foe.hp
+            foe.hp = foe.hp - damage if damage < foe.hp else 0
+            if record:
+                append((DAMAGE, foe.index, 0, taken, foe.hp))
+        else:
+            if not actor.defense_count:
+                raise ValueError("Skill list must not be empty.")
+            skill = getrandbits(actor.defense_bits)
+            while skill >= actor.defense_count:
+                skill = getrandbits(actor.defense_bits)
+            actor.guard = skill
+            if record:
+                append(actor.defend_events[skill])
+
+        actor, waiting = waiting, actor
+        turns += 1
+
+    return turns
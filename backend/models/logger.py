@@ -1,22 +1,33 @@
 import os
 from enum import Enum
-from typing import Dict, Union
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from cryptography.fernet import Fernet  # Using Fernet for password encryption
-from pymongo import MongoClient
-from pymongo.results import InsertOneResult, UpdateResult
-from pymongo.errors import DuplicateKeyError
+from pymongo import UpdateOne
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    UpdateResult,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
+from models.adminlog import AdminLevel, admin_logs
+from models.database import db
+from models.roster import roster_cache
+from models.stats import STAT_FIELDS
 
-# Set up MongoDB connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client.pokemon_database
 # collection = db.pokemon
 
+# Writes a BulkLogger collects before it sends them on its own
+BULK_FLUSH_SIZE = int(os.getenv("BULK_FLUSH_SIZE", "1000"))
+
 
 class DbCollection(Enum):
     BATTLE = "BATTLE"
     TOURNAMENT = "TOURNAMENT"
+    TOURNAMENT_ROUND = "TOURNAMENT_ROUND"
+    TOURNAMENT_CHECKPOINT = "TOURNAMENT_CHECKPOINT"
     POKEMON = "POKEMON"
     USER = "USER"
 
@@ -26,16 +37,41 @@ class Logger:
     def __init__(self) -> None:
         return
 
-    def log(
-        self, data: dict, dbcollection: DbCollection
-    ) -> Union[InsertOneResult, UpdateResult, None]:
+    def log(self, data: dict, dbcollection: DbCollection) -> Optional[UpdateResult]:
+        target = self.locate(data, dbcollection)
+        if target is None:
+            self.admin_log("Improper call to logger", AdminLevel.ERROR)
+            return None
+
+        collection, filter_query = target
+        result = self.update_or_insert(
+            collection, filter_query, data, self.insert_only(dbcollection)
+        )
+        if dbcollection == DbCollection.POKEMON:
+            roster_cache.invalidate([data["name"]])
+        return result
 
+    # Collection and filter a document of this kind is stored under, None for
+    # kinds the logger doesn't store. User passwords are encrypted in place
+    def locate(
+        self, data: dict, dbcollection: DbCollection
+    ) -> Optional[Tuple[str, Dict]]:
         if dbcollection == DbCollection.BATTLE:
             collection = "battle"
             filter_query = {"battle id": data["battle id"]}
         elif dbcollection == DbCollection.TOURNAMENT:
             collection = "tournament"
             filter_query = {"tournament id": data["tournament id"]}
+        elif dbcollection == DbCollection.TOURNAMENT_ROUND:
+            collection = "tournament_round"
+            filter_query = {
+                "tournament id": data["tournament id"],
+                "round": data["round"],
+                "page": data["page"],
+            }
+        elif dbcollection == DbCollection.TOURNAMENT_CHECKPOINT:
+            collection = "tournament_checkpoint"
+            filter_query = {"tournament id": data["tournament id"]}
         elif dbcollection == DbCollection.POKEMON:
             collection = "pokemon"
             filter_query = {"name": data["name"]}
@@ -44,10 +80,27 @@ class Logger:
             data["password"] = self.encrypt_password(data["password"])
             filter_query = {"username": data["username"]}
         else:
-            self.admin_log("Improper call to logger")
             return None
 
-        return self.update_or_insert(collection, filter_query, data)
+        return collection, filter_query
+
+    # Fields only written when the document is first inserted: a pokemon's
+    # wins and losses belong to the stats pipeline after that
+    def insert_only(self, dbcollection: DbCollection) -> Tuple[str, ...]:
+        return STAT_FIELDS if dbcollection == DbCollection.POKEMON else ()
+
+    # $set for data, apart from insert_only fields which go in $setOnInsert
+    def update_query(self, data: Dict, insert_only: Iterable[str] = ()) -> Dict:
+        insert_only = set(insert_only)
+        update_query = {
+            "$set": {
+                key: value for key, value in data.items() if key not in insert_only
+            }
+        }
+        on_insert = {key: value for key, value in data.items() if key in insert_only}
+        if on_insert:
+            update_query["$setOnInsert"] = on_insert
+        return update_query
 
     def encrypt_password(self, password: str) -> str:
         key = os.getenv("ENCRYPTION_KEY")
@@ -59,36 +112,175 @@ class Logger:
         encrypted_password = cipher.encrypt(password.encode())
         return encrypted_password
 
-    # admin log is just an array of strings, so simplify by calling directly
-    def admin_log(self, message: str) -> int:
-        collection = db.admin
-        result = collection.update_one(
-            {},  # empty filter, should only be one log
-            {"$push": {"events": message}},  # append message to running admin event log
-        )
-        # Will tell us if document was successfully modified
-        return result.modified_count
+    # One entry in the admin log collection, written with the next batch
+    def admin_log(
+        self,
+        message: str,
+        level: AdminLevel = AdminLevel.INFO,
+        battle_id: Optional[int] = None,
+        tournament_id: Optional[int] = None,
+    ) -> None:
+        admin_logs.write(message, level, battle_id, tournament_id)
 
+    # Updates the matching document or inserts it, in one atomic round trip
     def update_or_insert(
-        self, select: str, filter_query: Dict, data: Dict
-    ) -> Union[UpdateResult, InsertOneResult, None]:
+        self,
+        select: str,
+        filter_query: Dict,
+        data: Dict,
+        insert_only: Iterable[str] = (),
+    ) -> Optional[UpdateResult]:
         collection = db[select]
+        update_query = self.update_query(data, insert_only)
 
-        existing_document = collection.find_one(filter_query)
+        try:
+            return collection.update_one(filter_query, update_query, upsert=True)
+        except DuplicateKeyError:
+            # Two upserts raced to insert the same document and this one lost;
+            # the document exists now, so trying again updates it
+            pass
+        try:
+            return collection.update_one(filter_query, update_query, upsert=True)
+        except DuplicateKeyError:
+            self.admin_log(
+                f"Duplicate key error: A document with {filter_query} already exists.",
+                AdminLevel.ERROR,
+            )
+            return None
 
-        if existing_document:
-            # Perform an update if the document exists
-            update_query = {"$set": data}
-            result = collection.update_one(filter_query, update_query)
-            return result
-        else:
+    # Updates the matching document and never inserts; matched_count is 0
+    # when nothing matched the filter
+    def update(self, select: str, filter_query: Dict, data: Dict) -> UpdateResult:
+        collection = db[select]
+        return collection.update_one(filter_query, self.update_query(data))
+
+    def remove(self, select: str, filter_query: Dict) -> DeleteResult:
+        collection = db[select]
+        return collection.delete_many(filter_query)
+
+    # One round trip for documents known to be new, e.g. a batch of battles
+    # that were just given fresh ids
+    def insert_many(self, select: str, documents: List[Dict]) -> InsertManyResult:
+        collection = db[select]
+        return collection.insert_many(documents, ordered=False)
+
+    # Unordered, so one failing write doesn't stop the others; raises
+    # BulkWriteError listing the writes that failed
+    def bulk_write(self, select: str, operations: List[UpdateOne]) -> BulkWriteResult:
+        collection = db[select]
+        return collection.bulk_write(operations, ordered=False)
+
+    def bulk(self, flush_size: int = BULK_FLUSH_SIZE) -> "BulkLogger":
+        return BulkLogger(self, flush_size)
+
+
+class BulkLogger:
+    """
+    Collects battle, tournament and pokemon writes (anything Logger.log takes)
+    and sends them as one unordered bulk_write per collection, every
+    flush_size writes and on flush(). Admin messages go to the admin log,
+    which batches its own writes.
+    Each write is an upsert, same as Logger.log. Failed writes are reported
+    per item, numbered in the order they were logged, instead of raising.
+    Works as a context manager that flushes on the way out.
+    """
+
+    def __init__(self, logger: Logger, flush_size: int = BULK_FLUSH_SIZE) -> None:
+        self.__logger = logger
+        self.__flush_size = flush_size
+        # (item number, collection, filter, update) not sent yet
+        self.__pending: List[Tuple[int, str, Dict, Dict]] = []
+        self.__logged = 0
+        self.__report = {"upserted": 0, "modified": 0, "errors": []}
+
+    # Totals over every flush so far
+    def get_report(self) -> dict:
+        return self.__report
+
+    def get_pending(self) -> int:
+        return len(self.__pending)
+
+    def log(self, data: dict, dbcollection: DbCollection) -> None:
+        target = self.__logger.locate(data, dbcollection)
+        item = self.__logged
+        self.__logged += 1
+        if target is None:
+            self.__logger.admin_log("Improper call to logger", AdminLevel.ERROR)
+            self.__report["errors"].append(
+                {"item": item, "message": "Improper call to logger"}
+            )
+            return
+
+        collection, filter_query = target
+        update_query = self.__logger.update_query(
+            data, self.__logger.insert_only(dbcollection)
+        )
+        self.__pending.append((item, collection, filter_query, update_query))
+        if len(self.__pending) >= self.__flush_size:
+            self.flush()
+
+    def admin_log(
+        self,
+        message: str,
+        level: AdminLevel = AdminLevel.INFO,
+        battle_id: Optional[int] = None,
+        tournament_id: Optional[int] = None,
+    ) -> None:
+        self.__logger.admin_log(message, level, battle_id, tournament_id)
+
+    # Sends everything collected, returns what this flush wrote
+    def flush(self) -> dict:
+        report = {"upserted": 0, "modified": 0, "errors": []}
+        by_collection: Dict[str, List[Tuple[int, str, Dict, Dict]]] = {}
+        for write in self.__pending:
+            by_collection.setdefault(write[1], []).append(write)
+        self.__pending = []
+
+        for collection, writes in by_collection.items():
+            operations = [
+                UpdateOne(filter_query, update_query, upsert=True)
+                for _, _, filter_query, update_query in writes
+            ]
             try:
-                # Insert a new document if no match is found
-                data.update(filter_query)
-                result = collection.insert_one(data)
-                return result
-            except DuplicateKeyError:
-                self.admin_log(
-                    f"Duplicate key error: A document with {filter_query} already exists."
-                )
-                return None
+                result = self.__logger.bulk_write(collection, operations)
+                report["upserted"] += result.upserted_count
+                report["modified"] += result.modified_count
+            except BulkWriteError as e:
+                details = e.details
+                report["upserted"] += details.get("nUpserted", 0)
+                report["modified"] += details.get("nModified", 0)
+                for error in details.get("writeErrors", []):
+                    item, _, filter_query, _ = writes[error["index"]]
+                    report["errors"].append(
+                        {
+                            "item": item,
+                            "collection": collection,
+                            "filter": filter_query,
+                            "message": error.get("errmsg", ""),
+                        }
+                    )
+
+        # Only now that they landed, or a reader could cache the old ones again
+        if "pokemon" in by_collection:
+            roster_cache.invalidate(
+                filter_query["name"]
+                for _, _, filter_query, _ in by_collection["pokemon"]
+            )
+
+        if report["errors"]:
+            self.__logger.admin_log(
+                f"Bulk write failed for {len(report['errors'])} documents: "
+                f"{report['errors'][0]['message']}",
+                AdminLevel.ERROR,
+            )
+
+        self.__report["upserted"] += report["upserted"]
+        self.__report["modified"] += report["modified"]
+        self.__report["errors"].extend(report["errors"])
+        return report
+
+    def __enter__(self) -> "BulkLogger":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
@@ -0,0 +1,202 @@
+from models.solver import Definition, solve_definitions
+from models.adminlog import AdminLevel
+from models.logger import Logger
+from models.database import db
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+logger = Logger()
+
+# Below this many cells a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+POOL_CHUNK_SIZE = 32
+# Rows of GET /matchups per page, each row a win rate against every pokemon
+MATCHUP_PAGE_ROWS = 20
+MAX_MATCHUP_PAGE_ROWS = 200
+
+Cell = Tuple[str, str, Optional[float], Optional[float]]
+
+
+def definition_from_document(document: dict) -> Definition:
+    return (
+        document["max hp"],
+        tuple(sorted(document["attack skills"].values())),
+        tuple(sorted(document["defense skills"].values())),
+    )
+
+
+# Top level so the process pool can pickle it
+def solve_cell(job: Tuple[str, Definition, str, Definition]) -> Cell:
+    name1, definition1, name2, definition2 = job
+    try:
+        odds = solve_definitions(definition1, definition2)
+    except ValueError:
+        # Matchups that can never finish have no win rate
+        return name1, name2, None, None
+    return name1, name2, odds.get_win_probability(), odds.get_expected_turns()
+
+
+class MatchupMatrix:
+    """
+    Win rates of every pokemon against every other, stored one cell per
+    pair. Cells are solved on a process pool kept for the life of the
+    process; schedule_update() recomputes a pokemon's row and column on a
+    background thread so the request that changed it does not wait.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.__max_workers = max_workers
+        self.__pool: Optional[ProcessPoolExecutor] = None
+        self.__pool_pid: Optional[int] = None
+        self.__updater = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="matchup-update"
+        )
+        self.__scheduled: Set[str] = set()  # Waiting for the updater
+        self.__lock = Lock()
+
+    def ensure_indexes(self) -> None:
+        db.matchup.create_index(
+            [("pokemon1", ASCENDING), ("pokemon2", ASCENDING)], unique=True
+        )
+        db.matchup.create_index([("pokemon2", ASCENDING)])
+
+    def load_roster(self) -> Dict[str, Definition]:
+        roster = {}
+        projection = {
+            "_id": 0,
+            "name": 1,
+            "max hp": 1,
+            "attack skills": 1,
+            "defense skills": 1,
+        }
+        for document in db.pokemon.find({}, projection):
+            roster[document["name"]] = definition_from_document(document)
+        return roster
+
+    def solve(self, jobs: List[Tuple[str, Definition, str, Definition]]) -> List[Cell]:
+        if len(jobs) < PARALLEL_THRESHOLD:
+            return [solve_cell(job) for job in jobs]
+        return list(self.get_pool().map(solve_cell, jobs, chunksize=POOL_CHUNK_SIZE))
+
+    # Made on first use; a forked child must not use its parent's pool
+    def get_pool(self) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__pool is None or self.__pool_pid != os.getpid():
+                self.__pool = ProcessPoolExecutor(max_workers=self.__max_workers)
+                self.__pool_pid = os.getpid()
+            return self.__pool
+
+    def save(self, cells: List[Cell]) -> None:
+        if not cells:
+            return
+        db.matchup.bulk_write(
+            [
+                UpdateOne(
+                    {"pokemon1": name1, "pokemon2": name2},
+                    {"$set": {"win rate": win_rate, "expected turns": turns}},
+                    upsert=True,
+                )
+                for name1, name2, win_rate, turns in cells
+            ],
+            ordered=False,
+        )
+
+    # Full N x N recompute, dropping rows for Pokemon no longer in the roster
+    def rebuild(self) -> int:
+        roster = self.load_roster()
+        jobs = [
+            (name1, definition1, name2, definition2)
+            for name1, definition1 in roster.items()
+            for name2, definition2 in roster.items()
+        ]
+        cells = self.solve(jobs)
+        self.save(cells)
+
+        names = list(roster)
+        db.matchup.delete_many(
+            {"$or": [{"pokemon1": {"$nin": names}}, {"pokemon2": {"$nin": names}}]}
+        )
+        logger.admin_log(f"Matchup matrix rebuilt for {len(names)} pokemon")
+        return len(cells)
+
+    # Only the changed Pokemon's row and column need recomputing
+    def update_pokemon(self, name: str) -> int:
+        roster = self.load_roster()
+        if name not in roster:
+            return 0
+
+        definition = roster[name]
+        jobs = []
+        for other, other_definition in roster.items():
+            jobs.append((name, definition, other, other_definition))
+            if other != name:
+                jobs.append((other, other_definition, name, definition))
+
+        cells = self.solve(jobs)
+        self.save(cells)
+        logger.admin_log(f"Matchup matrix updated for {name}")
+        return len(cells)
+
+    # Queues update_pokemon; a name already waiting is not queued twice
+    def schedule_update(self, name: str) -> None:
+        with self.__lock:
+            if name in self.__scheduled:
+                return
+            self.__scheduled.add(name)
+        self.__updater.submit(self.run_update, name)
+
+    def run_update(self, name: str) -> None:
+        with self.__lock:
+            self.__scheduled.discard(name)
+        try:
+            self.update_pokemon(name)
+        except Exception as e:
+            # The pokemon is saved either way, the matrix can be rebuilt later
+            logger.admin_log(
+                f"Matchup update failed for {name}: {str(e)}", AdminLevel.ERROR
+            )
+
+    def iter_cells(self, name: Optional[str] = None) -> Iterator[dict]:
+        query = {"pokemon1": name} if name else {}
+        return db.matchup.find(query, {"_id": 0})
+
+    # {pokemon1: {pokemon2: win rate of pokemon1 moving first}}
+    def get_matrix(self, name: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        matrix: Dict[str, Dict[str, float]] = {}
+        for cell in self.iter_cells(name):
+            row = matrix.setdefault(cell["pokemon1"], {})
+            row[cell["pokemon2"]] = cell["win rate"]
+        return matrix
+
+    """ One page of rows, for the pokemon after the name given in name order,
+    and the name to continue after, None at the end """
+
+    def get_page(
+        self, after: Optional[str] = None, limit: int = MATCHUP_PAGE_ROWS
+    ) -> Tuple[Dict[str, Dict[str, float]], Optional[str]]:
+        limit = max(1, min(limit, MAX_MATCHUP_PAGE_ROWS))
+        query = {"name": {"$gt": after}} if after is not None else {}
+        # One extra tells us whether there is another page
+        names = [
+            document["name"]
+            for document in db.pokemon.find(query, {"_id": 0, "name": 1})
+            .sort("name", 1)
+            .limit(limit + 1)
+        ]
+        next_after = names[limit - 1] if len(names) > limit else None
+        names = names[:limit]
+
+        matrix: Dict[str, Dict[str, float]] = {name: {} for name in names}
+        for cell in db.matchup.find({"pokemon1": {"$in": names}}, {"_id": 0}):
+            matrix[cell["pokemon1"]][cell["pokemon2"]] = cell["win rate"]
+        return {name: row for name, row in matrix.items() if row}, next_after
+
+
+# Shared by the routes and pokemon writes, so a process has one updater
+# thread and one pool
+matchup_matrix = MatchupMatrix()
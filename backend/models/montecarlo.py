@@ -0,0 +1,190 @@
+from models.pokemon import Pokemon
+
+from typing import List
+
+import numpy as np
+
+# splitmix64 constants -- every battle draws from its own counter based stream,
+# so a seed gives the same battle no matter how many others run beside it
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+WORD_MASK = (1 << 64) - 1
+MIX_MULT_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_MULT_2 = np.uint64(0x94D049BB133111EB)
+LOW_MASK = np.uint64(0xFFFFFFFF)
+
+# Attack cutoffs out of 10 for each Pokemon.choose_skill HP-ratio band
+AGGRESSIVE_CUTOFF = 7
+BALANCED_CUTOFF = 5
+DEFENSIVE_CUTOFF = 3
+
+# Safety net for matchups that can never finish (all attacks deal 0 damage)
+DEFAULT_MAX_TURNS = 10_000
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    z = values.copy()
+    z ^= z >> np.uint64(30)
+    z *= MIX_MULT_1
+    z ^= z >> np.uint64(27)
+    z *= MIX_MULT_2
+    z ^= z >> np.uint64(31)
+    return z
+
+
+def scaled_draw(bits: np.ndarray, bound) -> np.ndarray:
+    # Map 32 random bits onto [0, bound) with a multiply-shift
+    return ((bits * np.asarray(bound, dtype=np.uint64)) >> np.uint64(32)).astype(
+        np.int64
+    )
+
+
+# Array friendly copy of the battle relevant parts of a Pokemon
+class Combatant:
+    def __init__(self, pokemon: Pokemon) -> None:
+        self.name: str = pokemon.get_name()
+        self.max_hp: int = pokemon.get_max_hp()
+        self.attack_damage = np.array(
+            [skill.get_damage() for skill in pokemon.get_attack_skills()],
+            dtype=np.int64,
+        )
+        self.defense_damage = np.array(
+            [skill.get_damage() for skill in pokemon.get_defense_skills()],
+            dtype=np.int64,
+        )
+
+        if self.max_hp <= 0:
+            raise ValueError(f"{self.name} must have positive max hp")
+        if len(self.attack_damage) == 0 or len(self.defense_damage) == 0:
+            raise ValueError(f"{self.name} needs attack and defense skills")
+
+
+class BatchOutcome:
+    def __init__(
+        self,
+        seeds: np.ndarray,
+        winners: np.ndarray,
+        turns: np.ndarray,
+        damage: np.ndarray,
+    ) -> None:
+        self.__seeds = seeds
+        self.__winners = winners
+        self.__turns = turns
+        self.__damage = damage
+
+    def get_seeds(self) -> np.ndarray:
+        return self.__seeds
+
+    # 0 if pokemon1 won, 1 if pokemon2 won, -1 if the turn limit was reached
+    def get_winners(self) -> np.ndarray:
+        return self.__winners
+
+    def get_turns(self) -> np.ndarray:
+        return self.__turns
+
+    # Shape (2, N): damage actually dealt by pokemon1 and pokemon2
+    def get_damage(self) -> np.ndarray:
+        return self.__damage
+
+    def get_win_rate(self) -> float:
+        finished = self.__winners >= 0
+        if not finished.any():
+            return 0.0
+        return float((self.__winners[finished] == 0).mean())
+
+
+class MonteCarloEngine:
+    def __init__(self, max_turns: int = DEFAULT_MAX_TURNS) -> None:
+        self.__max_turns = max_turns
+
+    def get_max_turns(self) -> int:
+        return self.__max_turns
+
+    def simulate(
+        self, pokemon1: Pokemon, pokemon2: Pokemon, seeds: List[int]
+    ) -> BatchOutcome:
+        # Run one battle per seed, all at once, under Battle.start_battle rules
+        sides = (Combatant(pokemon1), Combatant(pokemon2))
+        # negative seeds wrap around like any other 64 bit value
+        seeds = np.asarray(seeds, dtype=np.int64).astype(np.uint64)
+        n = len(seeds)
+
+        winners = np.full(n, -1, dtype=np.int64)
+        turns = np.zeros(n, dtype=np.int64)
+        damage = np.zeros((2, n), dtype=np.int64)
+
+        # Live battles are kept packed at the front of these arrays and
+        # repacked whenever some finish, so each turn is plain elementwise math
+        ids = np.arange(n)
+        stream = mix64(seeds)
+        hp = [np.full(n, side.max_hp, dtype=np.int64) for side in sides]
+        defending = [np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)]
+        defense_value = [np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)]
+        dealt = [np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)]
+
+        for step in range(self.__max_turns):
+            if len(ids) == 0:
+                break
+
+            # pokemon1 always opens, so every live battle shares the same actor
+            actor = step & 1
+            other = 1 - actor
+            side = sides[actor]
+
+            offset = np.uint64((GOLDEN_GAMMA * (step + 1)) & WORD_MASK)
+            bits = mix64(stream + offset)
+            threshold = scaled_draw(bits >> np.uint64(32), 10)
+            pick = bits & LOW_MASK
+
+            # HP ratio bands from Pokemon.get_hp_ratio, kept in integer math
+            actor_hp = hp[actor] * 10
+            cutoff = np.where(
+                actor_hp >= side.max_hp * 7,
+                AGGRESSIVE_CUTOFF,
+                np.where(
+                    actor_hp >= side.max_hp * 3,
+                    BALANCED_CUTOFF,
+                    DEFENSIVE_CUTOFF,
+                ),
+            )
+            attacks = threshold < cutoff
+
+            # DefenseSkill.reduce_damage, then the defense is spent
+            hit = side.attack_damage[scaled_draw(pick, len(side.attack_damage))]
+            hit = np.where(
+                defending[other],
+                np.maximum(0, hit - defense_value[other]),
+                hit,
+            )
+            hit *= attacks
+            defending[other] &= ~attacks
+            taken = np.minimum(hp[other], hit)
+            hp[other] -= taken
+            dealt[actor] += taken
+
+            guard = side.defense_damage[scaled_draw(pick, len(side.defense_damage))]
+            defending[actor] |= ~attacks
+            defense_value[actor] = np.where(attacks, defense_value[actor], guard)
+
+            fainted = hp[other] == 0
+            if not fainted.any():
+                continue
+
+            done = ids[fainted]
+            winners[done] = actor
+            turns[done] = step + 1
+            damage[0, done] = dealt[0][fainted]
+            damage[1, done] = dealt[1][fainted]
+
+            alive = ~fainted
+            ids = ids[alive]
+            stream = stream[alive]
+            for arrays in (hp, defending, defense_value, dealt):
+                arrays[0] = arrays[0][alive]
+                arrays[1] = arrays[1][alive]
+
+        # Anything left ran out of turns without a winner
+        turns[ids] = self.__max_turns
+        damage[0, ids] = dealt[0]
+        damage[1, ids] = dealt[1]
+
+        return BatchOutcome(seeds, winners, turns, damage)
@@ -1,5 +1,6 @@
 from models.skill import Skill, AttackSkill, DefenseSkill
 from models.logger import Logger, DbCollection
+from models.definitions import snapshot_if_changed
 
 import random
 from enum import Enum
@@ -116,6 +117,14 @@ class Pokemon:
     def get_active_defense(self) -> DefenseSkill:
         return self.__active_defense
 
+    # Lets the battle kernel restore state it tracked on its own
+    def set_current_hp(self, value: int) -> None:
+        self.__current_hp = value
+
+    def set_active_defense(self, skill: Optional[DefenseSkill]) -> None:
+        self.__defense_active = skill is not None
+        self.__active_defense = skill
+
     def get_hp_ratio(self) -> Ratio:
         if self.__max_hp > 0:
             ratio = self.__current_hp / self.__max_hp
@@ -128,6 +137,9 @@ class Pokemon:
     def get_seed(self) -> int:
         return self.__poke_seed
 
+    def get_random(self) -> random.Random:
+        return self.__poke_random
+
     def set_seed(self, value: int = None) -> None:
         # set this pokemon's seed
         self.__poke_seed = value
@@ -251,6 +263,9 @@ class Pokemon_Data:
         return self.__data
 
     def save(self) -> None:
+        # Freeze the old definition first so replay-stored battles still work
+        if snapshot_if_changed(self.__data):
+            logger.admin_log(f"Pokemon {self.__data['name']} definition snapshotted")
         logger.log(self.__data, DbCollection.POKEMON)
         logger.admin_log(f"Pokemon {self.__data['name']} upserted")
 
@@ -0,0 +1,480 @@
+import heapq
+import os
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from models import codec
+from models.archive import battle_archive
+from models.database import db
+from models.events import WIN
+
+INITIAL_RATING = float(os.getenv("ELO_INITIAL_RATING", "1500"))
+# Most a rating moves in one battle
+ELO_K = float(os.getenv("ELO_K", "32"))
+
+# One bucket per rating point; ratings outside still rank correctly, they
+# just share the end buckets
+RATING_BUCKETS = 4096
+REBUILD_BATCH = 1000
+
+# Ranks per GET /ratings page
+RATINGS_PAGE = 50
+MAX_RATINGS_PAGE = 1000
+
+# Counter bumped by every rating write; a process reloads its table when
+# another one moved it, reading it at most every RATINGS_REFRESH_SECONDS
+RATING_VERSION = "rating"
+RATINGS_REFRESH_SECONDS = float(os.getenv("RATINGS_REFRESH_SECONDS", "1"))
+
+# Enough of a battle document to replay its result; packed battles keep it
+# in their blob
+RESULT_PROJECTION = {
+    "_id": 0,
+    "battle id": 1,
+    "pokemon1": 1,
+    "pokemon2": 1,
+    "winner": 1,
+    "events": {"$slice": -1},
+    codec.PACKED_EVENTS: 1,
+}
+
+
+# Chance the first rating beats the second
+def expected_score(rating: float, opponent: float) -> float:
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+# Sets the new rating if the stored one is still what it was computed from
+# (None: not rated yet); if another process rated the pokemon meanwhile, adds
+# this change to theirs instead, so neither write is lost
+def rating_pipeline(before: Optional[float], rating: float, battles: int) -> List[dict]:
+    unchanged = {"$eq": [{"$ifNull": ["$rating", None]}, before]}
+    change = rating - (INITIAL_RATING if before is None else before)
+    return [
+        {
+            "$set": {
+                "rating": {
+                    "$cond": [
+                        unchanged,
+                        rating,
+                        {"$add": [{"$ifNull": ["$rating", INITIAL_RATING]}, change]},
+                    ]
+                },
+                "battles": {"$add": [{"$ifNull": ["$battles", 0]}, battles]},
+            }
+        }
+    ]
+
+
+# Side that won a stored battle, None if the document can't tell
+def battle_winner(document: dict) -> Optional[int]:
+    if document.get("winner") is not None:
+        return document["winner"]
+    events = document.get("events") or []
+    if events and isinstance(events[-1], (list, tuple)) and events[-1][0] == WIN:
+        return events[-1][1]
+    return None
+
+
+class FenwickTree:
+    """Counts per position with O(log n) prefix sums and k-th lookups"""
+
+    def __init__(self, size: int) -> None:
+        self.__size = size
+        self.__tree = [0] * (size + 1)
+        # Highest power of two within size, where find starts its descent
+        self.__top = 1 << (size.bit_length() - 1) if size else 0
+
+    def add(self, position: int, delta: int) -> None:
+        index = position + 1
+        while index <= self.__size:
+            self.__tree[index] += delta
+            index += index & -index
+
+    # Sum of counts at positions before this one
+    def prefix(self, position: int) -> int:
+        total = 0
+        index = position
+        while index > 0:
+            total += self.__tree[index]
+            index -= index & -index
+        return total
+
+    # Position holding the k-th counted item, k from 0
+    def find(self, k: int) -> int:
+        position = 0
+        step = self.__top
+        while step:
+            index = position + step
+            if index <= self.__size and self.__tree[index] <= k:
+                position = index
+                k -= self.__tree[index]
+            step >>= 1
+        return position
+
+
+class RatingTable:
+    """
+    Ratings in rank order. A Fenwick tree counts pokemon per rating bucket,
+    best bucket first, and each bucket keeps its few entries sorted by
+    (-rating, name); rank and rank-range lookups walk the tree, not the table.
+    """
+
+    def __init__(self, buckets: int = RATING_BUCKETS) -> None:
+        self.__buckets = buckets
+        self.__counts = FenwickTree(buckets)
+        self.__entries: Dict[int, List[Tuple[float, str]]] = {}
+        self.__ratings: Dict[str, float] = {}
+
+    def size(self) -> int:
+        return len(self.__ratings)
+
+    def get_rating(self, name: str) -> Optional[float]:
+        return self.__ratings.get(name)
+
+    # Position of a rating in the tree, best ratings first
+    def position(self, rating: float) -> int:
+        bucket = min(max(int(rating), 0), self.__buckets - 1)
+        return self.__buckets - 1 - bucket
+
+    def set_rating(self, name: str, rating: float) -> None:
+        self.remove(name)
+        position = self.position(rating)
+        insort(self.__entries.setdefault(position, []), (-rating, name))
+        self.__counts.add(position, 1)
+        self.__ratings[name] = rating
+
+    def remove(self, name: str) -> None:
+        rating = self.__ratings.pop(name, None)
+        if rating is None:
+            return
+        position = self.position(rating)
+        entries = self.__entries[position]
+        del entries[bisect_left(entries, (-rating, name))]
+        if not entries:
+            del self.__entries[position]
+        self.__counts.add(position, -1)
+
+    # 1 for the best rated
+    def get_rank(self, name: str) -> Optional[int]:
+        rating = self.__ratings.get(name)
+        if rating is None:
+            return None
+        position = self.position(rating)
+        within = bisect_left(self.__entries[position], (-rating, name))
+        return self.__counts.prefix(position) + within + 1
+
+    # (rank, name, rating) for ranks first to last, inclusive
+    def get_range(self, first: int, last: int) -> List[Tuple[int, str, float]]:
+        first = max(first, 1)
+        last = min(last, len(self.__ratings))
+        found = []
+        rank = first
+        while rank <= last:
+            position = self.__counts.find(rank - 1)
+            entries = self.__entries[position]
+            within = rank - 1 - self.__counts.prefix(position)
+            for negative, name in entries[within : within + last - rank + 1]:
+                found.append((rank, name, -negative))
+                rank += 1
+        return found
+
+
+class RatingTally:
+    """
+    Battle results in the order they were played, gathered over a battle, a
+    batch or a tournament round like StatsTally and rated together by
+    flush(). Nothing reaches the rating table or collection before then, so
+    a round that stops early leaves every rating as it was. A tournament
+    keeps a round's tally in its checkpoint until rated, so a resume rates
+    its battles once.
+    """
+
+    def __init__(self) -> None:
+        self.__results: List[Tuple[str, str]] = []
+
+    def get_results(self) -> List[Tuple[str, str]]:
+        return self.__results
+
+    def is_empty(self) -> bool:
+        return not self.__results
+
+    def record_battle(self, winner: str, loser: str) -> None:
+        self.__results.append((winner, loser))
+
+    # [[winner, loser], ...] to store, e.g. in a tournament checkpoint
+    def to_document(self) -> List[list]:
+        return [[winner, loser] for winner, loser in self.__results]
+
+    @staticmethod
+    def from_document(document: List[list]) -> "RatingTally":
+        tally = RatingTally()
+        for winner, loser in document:
+            tally.record_battle(winner, loser)
+        return tally
+
+    def flush(self, writer, engine: Optional["RatingEngine"] = None) -> int:
+        if not self.__results:
+            return 0
+        results, self.__results = self.__results, []
+        return (engine if engine is not None else rating_engine).rate(results, writer)
+
+
+class RatingEngine:
+    """
+    Elo ratings for every pokemon that fought. The table lives in memory for
+    rank queries and is loaded from the rating collection on first use.
+    Battles are rated in groups by rate() (see RatingTally) from the ratings
+    stored at that moment, and both the collection and the table take the
+    result, one upsert per pokemon.
+
+    Other processes rate too: each write bumps the rating version in the
+    counters collection, and a process that finds it moved by someone else
+    reloads its table. A pokemon rated by two processes at once keeps both
+    changes, each computed from the rating its process read. rebuild()
+    recomputes everything from the battle history in battle order.
+
+    Given ratings, the engine keeps to them and never reads the database,
+    for benchmarks that rate without one.
+    """
+
+    def __init__(
+        self,
+        ratings: Optional[Iterable[dict]] = None,
+        refresh_seconds: float = RATINGS_REFRESH_SECONDS,
+    ) -> None:
+        self.__table = RatingTable()
+        self.__battles: Dict[str, int] = {}
+        self.__loaded = False
+        self.__version: Optional[int] = None  # Rating version the table holds
+        self.__checked = 0.0  # time.monotonic() of the last version read
+        self.__refresh_seconds = refresh_seconds
+        self.__lock = Lock()
+        self.__rate_lock = Lock()  # One rate() at a time in this process
+        self.__detached = ratings is not None
+        if ratings is not None:
+            self.load(ratings)
+
+    def ensure_indexes(self) -> None:
+        db.rating.create_index("name", unique=True)
+
+    def load(self, ratings: Optional[Iterable[dict]] = None) -> None:
+        if ratings is None:
+            ratings = db.rating.find({}, {"_id": 0})
+        table = RatingTable()
+        battles: Dict[str, int] = {}
+        for document in ratings:
+            table.set_rating(document["name"], document["rating"])
+            battles[document["name"]] = document.get("battles", 0)
+        self.__table = table
+        self.__battles = battles
+        self.__loaded = True
+
+    # Loaded on first use, and again when another process rated since
+    def get_table(self) -> RatingTable:
+        now = time.monotonic()
+        if self.__detached or (
+            self.__loaded and now - self.__checked < self.__refresh_seconds
+        ):
+            return self.__table
+        version = self.read_version()
+        with self.__lock:
+            if not self.__loaded or version != self.__version:
+                self.load()
+                self.__version = version
+            self.__checked = now
+        return self.__table
+
+    @staticmethod
+    def read_version() -> int:
+        counter = db.counters.find_one({"_id": RATING_VERSION})
+        return counter["value"] if counter else 0
+
+    # Tells every process the stored ratings changed, returns the new version
+    @staticmethod
+    def bump_version() -> int:
+        counter = db.counters.find_one_and_update(
+            {"_id": RATING_VERSION},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["value"]
+
+    def get_rating(self, name: str) -> Optional[dict]:
+        table = self.get_table()
+        with self.__lock:
+            rating = table.get_rating(name)
+            if rating is None:
+                return None
+            return self.rating_data(name, rating, table.get_rank(name))
+
+    def get_range(self, first: int, last: int) -> List[dict]:
+        table = self.get_table()
+        with self.__lock:
+            return [
+                self.rating_data(name, rating, rank)
+                for rank, name, rating in table.get_range(first, last)
+            ]
+
+    def size(self) -> int:
+        return self.get_table().size()
+
+    def rating_data(self, name: str, rating: float, rank: int) -> dict:
+        return {
+            "name": name,
+            "rating": round(rating, 2),
+            "rank": rank,
+            "battles": self.__battles.get(name, 0),
+        }
+
+    @staticmethod
+    def apply(
+        table: RatingTable, battles: Dict[str, int], winner: str, loser: str
+    ) -> Tuple[float, float]:
+        winner_rating = table.get_rating(winner)
+        loser_rating = table.get_rating(loser)
+        if winner_rating is None:
+            winner_rating = INITIAL_RATING
+        if loser_rating is None:
+            loser_rating = INITIAL_RATING
+        if winner != loser:
+            change = ELO_K * (1 - expected_score(winner_rating, loser_rating))
+            winner_rating += change
+            loser_rating -= change
+        table.set_rating(winner, winner_rating)
+        table.set_rating(loser, loser_rating)
+        battles[winner] = battles.get(winner, 0) + 1
+        if loser != winner:
+            battles[loser] = battles.get(loser, 0) + 1
+        return winner_rating, loser_rating
+
+    """ Rates (winner, loser) results in order, starting from the stored
+    ratings of the pokemon involved, and writes one upsert per pokemon
+    through the writer. The table takes the stored result. Returns how many
+    pokemon were rated """
+
+    def rate(self, results: List[Tuple[str, str]], writer) -> int:
+        with self.__rate_lock:
+            names = list({name for result in results for name in result})
+            if self.__detached:
+                before = {
+                    name: self.__table.get_rating(name)
+                    for name in names
+                    if self.__table.get_rating(name) is not None
+                }
+            else:
+                before = {
+                    document["name"]: document["rating"]
+                    for document in db.rating.find({"name": {"$in": names}}, {"_id": 0})
+                }
+            table = RatingTable()
+            for name, rating in before.items():
+                table.set_rating(name, rating)
+            battles: Dict[str, int] = {}
+            for winner, loser in results:
+                self.apply(table, battles, winner, loser)
+
+            operations = [
+                UpdateOne(
+                    {"name": name},
+                    rating_pipeline(
+                        before.get(name), table.get_rating(name), battles[name]
+                    ),
+                    upsert=True,
+                )
+                for name in names
+            ]
+            try:
+                writer.bulk_write("rating", operations)
+            except BulkWriteError as e:
+                # Two processes inserting a pokemon's first rating at once:
+                # the loser's upsert finds the document on a second try
+                failed = [
+                    operations[error["index"]] for error in e.details["writeErrors"]
+                ]
+                try:
+                    writer.bulk_write("rating", failed)
+                except BulkWriteError as retry:
+                    errors = retry.details.get("writeErrors", [])
+                    writer.admin_log(f"Rating update failed for {len(errors)} pokemon")
+
+            if self.__detached:
+                with self.__lock:
+                    for name in names:
+                        self.__table.set_rating(name, table.get_rating(name))
+                        self.__battles[name] = (
+                            self.__battles.get(name, 0) + battles[name]
+                        )
+                return len(names)
+
+            version = self.bump_version()
+            stored = list(db.rating.find({"name": {"$in": names}}, {"_id": 0}))
+
+        self.get_table()
+        with self.__lock:
+            for document in stored:
+                self.__table.set_rating(document["name"], document["rating"])
+                self.__battles[document["name"]] = document.get("battles", 0)
+            # Nobody else wrote since the table was read, it is current
+            if self.__version == version - 1:
+                self.__version = version
+        return len(names)
+
+    # Every battle in id order, archived ones included, one streaming pass,
+    # then swap in the result
+    def rebuild(self) -> int:
+        table = RatingTable()
+        battles: Dict[str, int] = {}
+        rated = 0
+        previous = None  # Still stored and already archived, count it once
+        for document in heapq.merge(
+            db.battle.find({}, RESULT_PROJECTION)
+            .sort("battle id", 1)
+            .batch_size(REBUILD_BATCH),
+            battle_archive.iter_battles(),
+            key=lambda document: document["battle id"],
+        ):
+            if document["battle id"] == previous:
+                continue
+            previous = document["battle id"]
+            document = codec.unpack_battle(document)
+            side = battle_winner(document)
+            if side is None:
+                continue
+            names = (document["pokemon1"], document["pokemon2"])
+            self.apply(table, battles, names[side], names[1 - side])
+            rated += 1
+
+        db.rating.delete_many({})
+        batch: List[ReplaceOne] = []
+        for rank, name, rating in table.get_range(1, table.size()):
+            batch.append(
+                ReplaceOne(
+                    {"name": name},
+                    {"name": name, "rating": rating, "battles": battles[name]},
+                    upsert=True,
+                )
+            )
+            if len(batch) == REBUILD_BATCH:
+                db.rating.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            db.rating.bulk_write(batch, ordered=False)
+        version = self.bump_version()
+
+        with self.__lock:
+            self.__table = table
+            self.__battles = battles
+            self.__loaded = True
+            self.__version = version
+            self.__checked = time.monotonic()
+        return rated
+
+
+rating_engine = RatingEngine()
@@ -0,0 +1,135 @@
+from models.battle import Battle, StorageMode, restore_state
+from models.definitions import find_definition
+from models.events import Verbosity
+from models.adminlog import AdminLevel
+from models.logger import Logger
+from models.pokemon import Pokemon
+from models.skill import AttackSkill, DefenseSkill
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = Logger()
+
+REPLAY_CACHE_SIZE = 256
+
+
+def pokemon_from_definition(definition: dict) -> Pokemon:
+    return Pokemon(
+        name=definition["name"],
+        max_hp=definition["max hp"],
+        image="",
+        attack_skills=[
+            AttackSkill(name, damage) for name, damage in definition["attack skills"]
+        ],
+        defense_skills=[
+            DefenseSkill(name, damage) for name, damage in definition["defense skills"]
+        ],
+    )
+
+
+# A replay-mode battle whose events can't be regenerated: a pokemon
+# definition is missing, or the replay doesn't reach the stored result
+class ReplayError(Exception):
+    pass
+
+
+class ReplayStore:
+    def __init__(self, cache_size: int = REPLAY_CACHE_SIZE) -> None:
+        self.__cache_size = cache_size
+        # battle id -> materialized document, most recently used last
+        self.__cache: "OrderedDict[int, dict]" = OrderedDict()
+        self.__lock = Lock()
+
+    def is_replay(self, document: dict) -> bool:
+        return document.get("storage") == StorageMode.REPLAY.value
+
+    # Fill in events and skill names, so callers see a full battle document
+    def materialize(
+        self,
+        document: dict,
+        known: Optional[Dict[Tuple[str, str], Optional[dict]]] = None,
+    ) -> dict:
+        if not self.is_replay(document):
+            return document
+
+        battle_id = document["battle id"]
+        with self.__lock:
+            if battle_id in self.__cache:
+                self.__cache.move_to_end(battle_id)
+                return self.__cache[battle_id]
+
+        materialized = self.replay(document, known)
+        with self.__lock:
+            self.__cache[battle_id] = materialized
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return materialized
+
+    # materialize for many documents, looking each definition up only once
+    def materialize_many(self, documents: Iterable[dict]) -> List[dict]:
+        definitions: Dict[Tuple[str, str], Optional[dict]] = {}
+        materialized = []
+        for document in documents:
+            if self.is_replay(document):
+                for key in self.definition_keys(document):
+                    if key not in definitions:
+                        definitions[key] = find_definition(*key)
+            materialized.append(self.materialize(document, definitions))
+        return materialized
+
+    def definition_keys(self, document: dict) -> List[Tuple[str, str]]:
+        names = [document["pokemon1"], document["pokemon2"]]
+        return list(zip(names, document["definitions"]))
+
+    def replay(
+        self,
+        document: dict,
+        known: Optional[Dict[Tuple[str, str], Optional[dict]]] = None,
+    ) -> dict:
+        definitions = [
+            known[key] if known is not None and key in known else find_definition(*key)
+            for key in self.definition_keys(document)
+        ]
+        if None in definitions:
+            self.fail(document, "definition missing")
+
+        pokemon = [pokemon_from_definition(definition) for definition in definitions]
+        for p, state in zip(pokemon, document["start"]):
+            restore_state(p, state)
+
+        battle = Battle(
+            pokemon[0],
+            pokemon[1],
+            document["battle id"],
+            document["seed"],
+            Verbosity(document["verbosity"]),
+        )
+        battle.play()
+
+        # A stored result that does not match means the replay went wrong
+        result = (battle.get_winner(), battle.get_turns())
+        if result != (document["winner"], document["turns"]):
+            self.fail(document, "replay does not match stored result")
+
+        materialized = dict(document)
+        materialized["events"] = battle.get_events()
+        materialized["attack skills"] = [
+            [name for name, _ in definition["attack skills"]]
+            for definition in definitions
+        ]
+        materialized["defense skills"] = [
+            [name for name, _ in definition["defense skills"]]
+            for definition in definitions
+        ]
+        return materialized
+
+    def fail(self, document: dict, reason: str) -> None:
+        message = f"Battle {document['battle id']} cannot be replayed: {reason}"
+        logger.admin_log(message, AdminLevel.ERROR, battle_id=document["battle id"])
+        raise ReplayError(message)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__cache.clear()
@@ -0,0 +1,129 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, Optional
+
+from models.database import db
+from models.stats import STAT_FIELDS
+
+ROSTER_CACHE_SIZE = int(os.getenv("ROSTER_CACHE_SIZE", "1024"))
+# How long a lookup trusts the roster version it last read
+ROSTER_VERSION_SECONDS = float(os.getenv("ROSTER_VERSION_SECONDS", "1"))
+
+# Counter every process compares against before trusting its cache
+ROSTER_VERSION = "roster"
+
+# Cached documents leave out the win and loss counters: StatsTally moves them
+# on every battle without touching the roster version
+ROSTER_PROJECTION = dict({"_id": 0}, **{field: 0 for field in STAT_FIELDS})
+
+
+class RosterCache:
+    """
+    Pokemon documents by name, most recently used last, so battles and
+    tournaments stop reloading the same roster. Cached documents are shared
+    and must not be changed; callers build fresh Pokemon from them.
+
+    Every write to the pokemon collection bumps the roster version in the
+    counters collection. Lookups read the version (one small query by _id)
+    at most every version_seconds and drop the whole cache when it moved, so
+    a write made by any worker process is seen by all of them within that
+    time; this process drops the names it writes at once.
+
+    Documents hold definitions only, without the battle and tournament
+    counters, which change on every battle; pokemon built from them start
+    those at 0.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = ROSTER_CACHE_SIZE,
+        version_seconds: float = ROSTER_VERSION_SECONDS,
+    ) -> None:
+        self.__cache_size = cache_size
+        self.__version_seconds = version_seconds
+        self.__cache: "OrderedDict[str, dict]" = OrderedDict()
+        self.__version: Optional[int] = None
+        self.__checked = 0.0  # time.monotonic() of the last version read
+        self.__writes = 0  # Local invalidations, a load that spans one is stale
+        self.__lock = Lock()
+
+    def get_version(self) -> Optional[int]:
+        return self.__version
+
+    def size(self) -> int:
+        return len(self.__cache)
+
+    # Documents for the names found, keyed by name, loading misses in one query
+    def get_documents(self, names: Iterable[str]) -> Dict[str, dict]:
+        names = set(names)
+        self.check_version()
+        with self.__lock:
+            generation = (self.__version, self.__writes)
+
+        found: Dict[str, dict] = {}
+        with self.__lock:
+            for name in names:
+                if name in self.__cache:
+                    self.__cache.move_to_end(name)
+                    found[name] = self.__cache[name]
+        missing = names - found.keys()
+        if not missing:
+            return found
+
+        documents = list(
+            db.pokemon.find({"name": {"$in": list(missing)}}, ROSTER_PROJECTION)
+        )
+        with self.__lock:
+            # Another thread saw a newer version or wrote meanwhile, ours may
+            # be stale
+            keep = generation == (self.__version, self.__writes)
+            for document in documents:
+                found[document["name"]] = document
+                if keep:
+                    self.__cache[document["name"]] = document
+            while len(self.__cache) > self.__cache_size:
+                self.__cache.popitem(last=False)
+        return found
+
+    def get_document(self, name: str) -> Optional[dict]:
+        return self.get_documents([name]).get(name)
+
+    # Drop everything if another process (or this one) wrote since we looked,
+    # reading the version again once the last read is version_seconds old
+    def check_version(self) -> Optional[int]:
+        now = time.monotonic()
+        with self.__lock:
+            if (
+                self.__version is not None
+                and now - self.__checked < self.__version_seconds
+            ):
+                return self.__version
+        counter = db.counters.find_one({"_id": ROSTER_VERSION})
+        version = counter["value"] if counter else 0
+        with self.__lock:
+            if version != self.__version:
+                self.__cache.clear()
+                self.__version = version
+            self.__checked = now
+        return version
+
+    # Call after writing pokemon; other processes notice the new version
+    def invalidate(self, names: Iterable[str] = ()) -> None:
+        db.counters.update_one(
+            {"_id": ROSTER_VERSION}, {"$inc": {"value": 1}}, upsert=True
+        )
+        with self.__lock:
+            self.__writes += 1
+            for name in names:
+                self.__cache.pop(name, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__cache.clear()
+            self.__version = None
+            self.__writes += 1
+
+
+roster_cache = RosterCache()
@@ -0,0 +1,164 @@
+from models.pokemon import Pokemon
+from models.montecarlo import AGGRESSIVE_CUTOFF, BALANCED_CUTOFF, DEFENSIVE_CUTOFF
+
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# (max hp, sorted attack damages, sorted defense damages) -- names and skill
+# order never change the odds, so this is all a matchup depends on
+Definition = Tuple[int, Tuple[int, ...], Tuple[int, ...]]
+
+SOLVER_CACHE_SIZE = 4096
+
+
+def definition_of(pokemon: Pokemon) -> Definition:
+    return (
+        pokemon.get_max_hp(),
+        tuple(sorted(skill.get_damage() for skill in pokemon.get_attack_skills())),
+        tuple(sorted(skill.get_damage() for skill in pokemon.get_defense_skills())),
+    )
+
+
+def attack_cutoff(hp: int, max_hp: int) -> int:
+    # Same bands as Pokemon.get_hp_ratio, kept in integer math
+    if hp * 10 >= max_hp * 7:
+        return AGGRESSIVE_CUTOFF
+    if hp * 10 >= max_hp * 3:
+        return BALANCED_CUTOFF
+    return DEFENSIVE_CUTOFF
+
+
+def distribution(damages: Tuple[int, ...]) -> List[Tuple[int, float]]:
+    # choose_skill picks uniformly from the list, so duplicates weigh more
+    counts = Counter(damages)
+    return [(damage, count / len(damages)) for damage, count in sorted(counts.items())]
+
+
+class MatchupOdds:
+    def __init__(self, win_probability: float, expected_turns: float) -> None:
+        self.__win_probability = win_probability
+        self.__expected_turns = expected_turns
+
+    # Chance that pokemon1 (who always moves first) wins
+    def get_win_probability(self) -> float:
+        return self.__win_probability
+
+    def get_loss_probability(self) -> float:
+        return 1.0 - self.__win_probability
+
+    def get_expected_turns(self) -> float:
+        return self.__expected_turns
+
+
+class ChainLayout:
+    """
+    The battle is a Markov chain over (hp1, hp2, turn, defense1, defense2).
+    Active defenses are stored by value (0 for none, which behaves the same),
+    and only an hp drop leaves an (hp1, hp2) layer, so each layer is a small
+    linear system whose right hand side comes from layers already solved.
+    """
+
+    def __init__(self, definition1: Definition, definition2: Definition) -> None:
+        self.max_hp = (definition1[0], definition2[0])
+        self.attacks = (distribution(definition1[1]), distribution(definition2[1]))
+        self.defenses = (distribution(definition1[2]), distribution(definition2[2]))
+        self.guards = tuple(
+            sorted({0, *(damage for damage, _ in defense)}) for defense in self.defenses
+        )
+        self.guard_index = tuple(
+            {value: index for index, value in enumerate(guard)} for guard in self.guards
+        )
+        self.size = 2 * len(self.guards[0]) * len(self.guards[1])
+
+    def state(self, turn: int, guard1: int, guard2: int) -> int:
+        return (turn * len(self.guards[0]) + guard1) * len(self.guards[1]) + guard2
+
+    def states(self):
+        for turn in (0, 1):
+            for guard1 in range(len(self.guards[0])):
+                for guard2 in range(len(self.guards[1])):
+                    yield self.state(turn, guard1, guard2), turn, (guard1, guard2)
+
+    def layer_inverse(self, cutoffs: Tuple[int, int]) -> np.ndarray:
+        # Same-layer moves: defending, or attacks that a defense absorbs fully
+        chain = np.eye(self.size)
+        for index, turn, guards in self.states():
+            other = 1 - turn
+            attack_chance = cutoffs[turn] / 10
+            for damage, weight in self.attacks[turn]:
+                if damage - self.guards[other][guards[other]] <= 0:
+                    after = list(guards)
+                    after[other] = 0
+                    chain[index, self.state(other, *after)] -= attack_chance * weight
+            for value, weight in self.defenses[turn]:
+                after = list(guards)
+                after[turn] = self.guard_index[turn][value]
+                chain[index, self.state(other, *after)] -= (1 - attack_chance) * weight
+        return np.linalg.inv(chain)
+
+
+@lru_cache(maxsize=SOLVER_CACHE_SIZE)
+def solve_definitions(definition1: Definition, definition2: Definition) -> MatchupOdds:
+    for max_hp, attacks, defenses in (definition1, definition2):
+        if max_hp <= 0:
+            raise ValueError("Pokemon must have positive max hp")
+        if not attacks or not defenses:
+            raise ValueError("Pokemon need attack and defense skills")
+    if not any(definition1[1]) and not any(definition2[1]):
+        raise ValueError("Neither Pokemon can deal damage, battle never ends")
+
+    layout = ChainLayout(definition1, definition2)
+    inverses: Dict[Tuple[int, int], np.ndarray] = {}
+
+    # win[h1][h2][state] and turns[h1][h2][state]; row/column 0 stay unused
+    hp1, hp2 = layout.max_hp
+    win = [[None] * (hp2 + 1) for _ in range(hp1 + 1)]
+    turns = [[None] * (hp2 + 1) for _ in range(hp1 + 1)]
+
+    for h1 in range(1, hp1 + 1):
+        for h2 in range(1, hp2 + 1):
+            hp = (h1, h2)
+            cutoffs = (attack_cutoff(h1, hp1), attack_cutoff(h2, hp2))
+            win_rhs = np.zeros(layout.size)
+            turns_rhs = np.ones(layout.size)
+
+            for index, turn, guards in layout.states():
+                other = 1 - turn
+                attack_chance = cutoffs[turn] / 10
+                for damage, weight in layout.attacks[turn]:
+                    dealt = damage - layout.guards[other][guards[other]]
+                    if dealt <= 0:
+                        continue
+                    chance = attack_chance * weight
+                    remaining = hp[other] - dealt
+                    if remaining <= 0:
+                        # pokemon1 wins when it lands the final blow
+                        win_rhs[index] += chance * (turn == 0)
+                        continue
+                    after = list(guards)
+                    after[other] = 0
+                    landed = list(hp)
+                    landed[other] = remaining
+                    target = layout.state(other, *after)
+                    win_rhs[index] += chance * win[landed[0]][landed[1]][target]
+                    turns_rhs[index] += chance * turns[landed[0]][landed[1]][target]
+
+            if cutoffs not in inverses:
+                inverses[cutoffs] = layout.layer_inverse(cutoffs)
+            win[h1][h2] = inverses[cutoffs] @ win_rhs
+            turns[h1][h2] = inverses[cutoffs] @ turns_rhs
+
+    start = layout.state(0, 0, 0)
+    return MatchupOdds(float(win[hp1][hp2][start]), float(turns[hp1][hp2][start]))
+
+
+class BattleSolver:
+    # Exact odds for fresh Pokemon, answered from the cache for repeated pairs
+    def solve(self, pokemon1: Pokemon, pokemon2: Pokemon) -> MatchupOdds:
+        return solve_definitions(definition_of(pokemon1), definition_of(pokemon2))
+
+    def clear_cache(self) -> None:
+        solve_definitions.cache_clear()
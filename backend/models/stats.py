@@ -0,0 +1,234 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from models.database import db
+
+# Counters the stats pipeline owns once a pokemon exists; saving a pokemon
+# only sets them when it is first inserted
+COUNTER_FIELDS = (
+    "battle wins",
+    "battle losses",
+    "tournament wins",
+    "tournament losses",
+)
+STAT_FIELDS = COUNTER_FIELDS + ("battle W/L", "tournament W/L")
+
+# Leaderboard order: best win rate, then most battles, then name
+LEADERBOARD_SORT = [
+    ("win rate", DESCENDING),
+    ("battles", DESCENDING),
+    ("name", ASCENDING),
+]
+LEADERBOARD_PAGE = 10
+MAX_LEADERBOARD_PAGE = 1000
+REBUILD_BATCH = 1000
+
+
+# wins / losses, 0 without losses -- same as Pokemon's W/L getters
+def ratio(wins: str, losses: str) -> dict:
+    return {"$cond": [{"$gt": [losses, 0]}, {"$divide": [wins, losses]}, 0]}
+
+
+# Adds deltas to the counters and recomputes everything derived from them,
+# as one update pipeline so a single write is atomic per document
+def increment_pipeline(deltas: Dict[str, int], leaderboard: bool) -> List[dict]:
+    derived = {
+        "battle W/L": ratio("$battle wins", "$battle losses"),
+        "tournament W/L": ratio("$tournament wins", "$tournament losses"),
+    }
+    if leaderboard:
+        derived["battles"] = {"$add": ["$battle wins", "$battle losses"]}
+    pipeline = [
+        {
+            "$set": {
+                field: {"$add": [{"$ifNull": [f"${field}", 0]}, deltas.get(field, 0)]}
+                for field in COUNTER_FIELDS
+            }
+        },
+        {"$set": derived},
+    ]
+    if leaderboard:
+        pipeline.append(
+            {
+                "$set": {
+                    "win rate": {
+                        "$cond": [
+                            {"$gt": ["$battles", 0]},
+                            {"$divide": ["$battle wins", "$battles"]},
+                            0,
+                        ]
+                    }
+                }
+            }
+        )
+    return pipeline
+
+
+class StatsTally:
+    """
+    Wins and losses by pokemon name, gathered over a battle, a batch or a
+    tournament round and written with flush(): one unordered bulk_write to
+    the pokemon collection and one to the leaderboard, one update per name
+    however many battles it fought. Writes go through the logger handed to
+    flush, like every other write.
+
+    Cached rosters (models/roster.py) are left alone: they hold definitions
+    only, without these counters.
+    """
+
+    def __init__(self) -> None:
+        self.__deltas: Dict[str, Dict[str, int]] = {}
+
+    def get_deltas(self) -> Dict[str, Dict[str, int]]:
+        return self.__deltas
+
+    def is_empty(self) -> bool:
+        return not self.__deltas
+
+    def add(self, name: str, field: str, count: int = 1) -> None:
+        deltas = self.__deltas.setdefault(name, {})
+        deltas[field] = deltas.get(field, 0) + count
+
+    def record_battle(self, winner: str, loser: str) -> None:
+        self.add(winner, "battle wins")
+        self.add(loser, "battle losses")
+
+    def record_tournament(self, winner: str, losers: Iterable[str]) -> None:
+        self.add(winner, "tournament wins")
+        for name in losers:
+            self.add(name, "tournament losses")
+
+    # [[name, {field: count}], ...] to store, e.g. in a tournament checkpoint;
+    # names can't be keys, they may hold dots
+    def to_document(self) -> List[list]:
+        return [[name, dict(delta)] for name, delta in self.__deltas.items()]
+
+    @staticmethod
+    def from_document(document: List[list]) -> "StatsTally":
+        tally = StatsTally()
+        for name, delta in document:
+            for field, count in delta.items():
+                tally.add(name, field, count)
+        return tally
+
+    def flush(self, writer) -> int:
+        if not self.__deltas:
+            return 0
+        deltas, self.__deltas = self.__deltas, {}
+
+        for collection, leaderboard in (("pokemon", False), ("leaderboard", True)):
+            operations = [
+                UpdateOne(
+                    {"name": name},
+                    increment_pipeline(delta, leaderboard),
+                    # Only the leaderboard gains entries, pokemon must exist
+                    upsert=leaderboard,
+                )
+                for name, delta in deltas.items()
+            ]
+            try:
+                writer.bulk_write(collection, operations)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                writer.admin_log(
+                    f"Stats update to {collection} failed for {len(errors)} pokemon"
+                )
+        return len(deltas)
+
+
+class Leaderboard:
+    """
+    Materialized ranking in the leaderboard collection, one document per
+    pokemon that fought, kept current by StatsTally and read through an index
+    in leaderboard order. Pages are keyset based: the cursor holds the rank
+    and sort key of the last entry, so the next page starts right after it.
+    """
+
+    def ensure_indexes(self) -> None:
+        db.leaderboard.create_index("name", unique=True)
+        db.leaderboard.create_index(LEADERBOARD_SORT)
+
+    # Rebuild from the counters in the pokemon collection, e.g. after seeding
+    def rebuild(self) -> int:
+        db.leaderboard.delete_many({})
+        projection = {"_id": 0, "name": 1}
+        projection.update({field: 1 for field in COUNTER_FIELDS})
+
+        written = 0
+        batch: List[ReplaceOne] = []
+        for document in db.pokemon.find({}, projection):
+            batch.append(
+                ReplaceOne(
+                    {"name": document["name"]}, leaderboard_entry(document), upsert=True
+                )
+            )
+            if len(batch) == REBUILD_BATCH:
+                written += db.leaderboard.bulk_write(
+                    batch, ordered=False
+                ).upserted_count
+                batch = []
+        if batch:
+            written += db.leaderboard.bulk_write(batch, ordered=False).upserted_count
+        return written
+
+    def get_page(
+        self, limit: int = LEADERBOARD_PAGE, cursor: Optional[str] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        limit = max(1, min(limit, MAX_LEADERBOARD_PAGE))
+        rank = 0
+        query = {}
+        if cursor is not None:
+            rank, win_rate, battles, name = decode_cursor(cursor)
+            query = {
+                "$or": [
+                    {"win rate": {"$lt": win_rate}},
+                    {"win rate": win_rate, "battles": {"$lt": battles}},
+                    {"win rate": win_rate, "battles": battles, "name": {"$gt": name}},
+                ]
+            }
+
+        # One extra tells us whether there is another page
+        documents = list(
+            db.leaderboard.find(query, {"_id": 0})
+            .sort(LEADERBOARD_SORT)
+            .limit(limit + 1)
+        )
+        entries = []
+        for position, document in enumerate(documents[:limit], start=rank + 1):
+            entries.append(dict(document, rank=position))
+        next_cursor = encode_cursor(entries[-1]) if len(documents) > limit else None
+        return entries, next_cursor
+
+
+# A leaderboard document from a pokemon's counters
+def leaderboard_entry(document: dict) -> dict:
+    entry = {"name": document["name"]}
+    for field in COUNTER_FIELDS:
+        entry[field] = document.get(field, 0)
+    battles = entry["battle wins"] + entry["battle losses"]
+    entry["battles"] = battles
+    entry["win rate"] = entry["battle wins"] / battles if battles > 0 else 0
+    for field, wins, losses in (
+        ("battle W/L", "battle wins", "battle losses"),
+        ("tournament W/L", "tournament wins", "tournament losses"),
+    ):
+        entry[field] = entry[wins] / entry[losses] if entry[losses] > 0 else 0
+    return entry
+
+
+# "<rank>:<win rate>:<battles>:<name>" of the last entry of a page
+def encode_cursor(entry: dict) -> str:
+    return f"{entry['rank']}:{float(entry['win rate'])!r}:{entry['battles']}:{entry['name']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, float, int, str]:
+    try:
+        rank, win_rate, battles, name = cursor.split(":", 3)
+        return int(rank), float(win_rate), int(battles), name
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,1002 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bson import ObjectId, json_util
+from bson.json_util import JSONOptions, JSONMode
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.operations import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    ReplaceOne,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+""" Storage that needs no mongod: an in-process dict (STORAGE_BACKEND=memory)
+and a SQLite file (STORAGE_BACKEND=sqlite, SQLITE_PATH). Both answer the part
+of the pymongo Collection API this app uses -- find / find_one with sort,
+limit and projections, update operators and update pipelines, upserts,
+insert_many, bulk_write with pymongo's write models (InsertOne, UpdateOne,
+UpdateMany, ReplaceOne, DeleteOne, DeleteMany), find_one_and_update and unique indexes -- and raise pymongo's own errors and
+results, so the models run on any of the three unchanged.
+
+Queries cover the operators the app sends ($in, $nin, $lt, $lte, $gt, $gte,
+$ne, $exists, $or, $and; $set, $setOnInsert, $inc, $max, $min, $unset;
+pipelines of $set stages with $add, $subtract, $multiply, $divide, $cond,
+$ifNull and comparisons). Equality on an indexed field is served from the
+index, everything else scans the collection.
+
+The memory backend lives and dies with the process; forked workers get a
+copy, so only the parent should write. SQLite is shared by every process on
+the machine.
+"""
+
+# Order of types when sorting and comparing, as in BSON
+TYPE_ORDER = {
+    type(None): 0,
+    int: 1,
+    float: 1,
+    str: 2,
+    dict: 3,
+    list: 4,
+    bytes: 5,
+    ObjectId: 6,
+    bool: 7,
+    datetime: 8,
+}
+
+# Missing fields and null are the same thing to a query
+MISSING = None
+
+RELAXED = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+
+
+class Index:
+    def __init__(self, fields: List[Tuple[str, int]], unique: bool, sparse: bool):
+        self.__keys = fields
+        self.__fields = [field for field, _ in fields]
+        self.__unique = unique
+        self.__sparse = sparse
+        self.__name = "_".join(f"{field}_{direction}" for field, direction in fields)
+
+    def get_fields(self) -> List[str]:
+        return self.__fields
+
+    def get_name(self) -> str:
+        return self.__name
+
+    def is_unique(self) -> bool:
+        return self.__unique
+
+    def get_information(self) -> dict:
+        information: Dict[str, Any] = {"key": self.__keys}
+        if self.__unique:
+            information["unique"] = True
+        if self.__sparse:
+            information["sparse"] = True
+        return information
+
+    # Key of a document in this index, None when a sparse index skips it
+    def key(self, document: dict) -> Optional[tuple]:
+        values = [get_path(document, field) for field in self.__fields]
+        if self.__sparse and all(value is MISSING for value in values):
+            return None
+        return tuple(hashable(value) for value in values)
+
+
+class Cursor:
+    """Evaluated when first iterated, so sort / limit / skip can be chained"""
+
+    def __init__(self, collection: "LocalCollection", query: dict, projection):
+        self.__collection = collection
+        self.__query = query
+        self.__projection = projection
+        self.__sort: List[Tuple[str, int]] = []
+        self.__skip = 0
+        self.__limit = 0
+        self.__results: Optional[Iterator[dict]] = None
+
+    def sort(self, key_or_list, direction: int = 1) -> "Cursor":
+        self.__sort = index_fields(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "Cursor":
+        self.__skip = skip
+        return self
+
+    def limit(self, limit: int) -> "Cursor":
+        self.__limit = limit
+        return self
+
+    # Nothing is fetched in batches here, accepted for pymongo's sake
+    def batch_size(self, batch_size: int) -> "Cursor":
+        return self
+
+    def __iter__(self) -> "Cursor":
+        return self
+
+    def __next__(self) -> dict:
+        if self.__results is None:
+            self.__results = iter(
+                self.__collection.run_query(
+                    self.__query,
+                    self.__projection,
+                    self.__sort,
+                    self.__skip,
+                    self.__limit,
+                )
+            )
+        return next(self.__results)
+
+    def close(self) -> None:
+        self.__results = iter(())
+
+
+class LocalCollection:
+    """
+    Query, update and bulk logic shared by both backends. A store holds the
+    documents and indexes: scan / insert / replace / delete and a transaction
+    that makes find-then-write atomic.
+    """
+
+    def __init__(self, name: str, store) -> None:
+        self.name = name
+        self.__store = store
+        self.__indexes: Dict[str, Index] = {}
+
+    def get_store(self):
+        return self.__store
+
+    def create_index(self, keys, unique: bool = False, sparse: bool = False, **_):
+        index = Index(index_fields(keys), unique, sparse)
+        self.__store.create_index(index)
+        self.__indexes[index.get_name()] = index
+        return index.get_name()
+
+    def index_information(self) -> Dict[str, dict]:
+        information = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self.__indexes.items():
+            information[name] = index.get_information()
+        return information
+
+    def find(self, filter: Optional[dict] = None, projection=None, **kwargs):
+        cursor = Cursor(self, filter or {}, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    def find_one(self, filter: Optional[dict] = None, projection=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for document in self.find(filter, projection, **kwargs).limit(1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict, **_) -> int:
+        return sum(1 for doc in self.__store.scan(filter) if matches(doc, filter))
+
+    def run_query(
+        self,
+        query: dict,
+        projection,
+        sort: List[Tuple[str, int]],
+        skip: int,
+        limit: int,
+    ) -> List[dict]:
+        documents = [doc for doc in self.__store.scan(query) if matches(doc, query)]
+        for field, direction in reversed(sort):
+            documents.sort(
+                key=lambda doc: sort_key(get_path(doc, field)), reverse=direction < 0
+            )
+        documents = documents[skip:]
+        if limit:
+            documents = documents[:limit]
+        return [project(doc, projection) for doc in documents]
+
+    def insert_one(self, document: dict, **_) -> InsertOneResult:
+        with self.__store.transaction():
+            self.__store.insert(with_id(document))
+        return InsertOneResult(document["_id"], True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True, **_):
+        documents = list(documents)
+        self.bulk_write(
+            [InsertOne(document) for document in documents], ordered=ordered
+        )
+        return InsertManyResult([doc["_id"] for doc in documents], True)
+
+    def update_one(self, filter: dict, update, upsert: bool = False, **_):
+        with self.__store.transaction():
+            matched, modified, upserted = self.apply_update(filter, update, upsert)
+        raw = {"n": matched or int(upserted is not None), "nModified": modified}
+        if upserted is not None:
+            raw["upserted"] = upserted
+        return UpdateResult(raw, True)
+
+    def update_many(self, filter: dict, update, upsert: bool = False, **_):
+        with self.__store.transaction():
+            matched, modified, upserted = self.apply_update(
+                filter, update, upsert, multi=True
+            )
+        raw = {"n": matched or int(upserted is not None), "nModified": modified}
+        if upserted is not None:
+            raw["upserted"] = upserted
+        return UpdateResult(raw, True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **_):
+        with self.__store.transaction():
+            matched, modified, upserted = self.apply_replace(
+                filter, replacement, upsert
+            )
+        raw = {"n": matched or int(upserted is not None), "nModified": modified}
+        if upserted is not None:
+            raw["upserted"] = upserted
+        return UpdateResult(raw, True)
+
+    def delete_one(self, filter: dict, **_) -> DeleteResult:
+        return self.delete(filter, 1)
+
+    def delete_many(self, filter: dict, **_) -> DeleteResult:
+        return self.delete(filter, 0)
+
+    def delete(self, filter: dict, limit: int) -> DeleteResult:
+        with self.__store.transaction():
+            ids = [
+                doc["_id"] for doc in self.__store.scan(filter) if matches(doc, filter)
+            ]
+            if limit:
+                ids = ids[:limit]
+            self.__store.delete(ids)
+        return DeleteResult({"n": len(ids)}, True)
+
+    def find_one_and_update(
+        self,
+        filter: dict,
+        update,
+        projection=None,
+        sort=None,
+        upsert: bool = False,
+        return_document: bool = False,
+        **_,
+    ) -> Optional[dict]:
+        with self.__store.transaction():
+            found = self.find_one(filter, sort=sort)
+            _, _, upserted = self.apply_update(
+                filter if found is None else {"_id": found["_id"]}, update, upsert
+            )
+            if not return_document:
+                return project(found, projection) if found is not None else None
+            if found is None and upserted is None:
+                return None
+            document_id = upserted if upserted is not None else found["_id"]
+            return self.find_one({"_id": document_id}, projection)
+
+    def bulk_write(self, requests: List[Any], ordered: bool = True, **_):
+        operations = [write_operation(request) for request in requests]
+
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0}
+        counts.update({"nRemoved": 0, "upserted": [], "writeErrors": []})
+        for index, (kind, arguments) in enumerate(operations):
+            try:
+                with self.__store.transaction():
+                    if kind == "insert":
+                        self.__store.insert(with_id(arguments[0]))
+                        counts["nInserted"] += 1
+                        continue
+                    if kind == "delete":
+                        selector, limit = arguments
+                        counts["nRemoved"] += self.delete(selector, limit).deleted_count
+                        continue
+                    if kind == "update":
+                        selector, update, multi, upsert = arguments
+                        matched, modified, upserted = self.apply_update(
+                            selector, update, upsert, multi
+                        )
+                    else:
+                        selector, replacement, upsert = arguments
+                        matched, modified, upserted = self.apply_replace(
+                            selector, replacement, upsert
+                        )
+            except DuplicateKeyError as e:
+                counts["writeErrors"].append(
+                    {"index": index, "code": 11000, "errmsg": str(e), "op": arguments}
+                )
+                if ordered:
+                    break
+                continue
+            counts["nMatched"] += matched
+            counts["nModified"] += modified
+            if upserted is not None:
+                counts["nUpserted"] += 1
+                counts["upserted"].append({"index": index, "_id": upserted})
+
+        if counts["writeErrors"]:
+            raise BulkWriteError(counts)
+        return BulkWriteResult(counts, True)
+
+    # (matched, modified, upserted _id or None), caller holds the transaction
+    def apply_update(
+        self, filter: dict, update, upsert: bool, multi: bool = False
+    ) -> Tuple[int, int, Any]:
+        found = [doc for doc in self.__store.scan(filter) if matches(doc, filter)]
+        if not multi:
+            found = found[:1]
+        modified = 0
+        for document in found:
+            updated = apply_update(document, update, inserting=False)
+            if updated != document:
+                self.__store.replace(updated)
+                modified += 1
+        if found or not upsert:
+            return len(found), modified, None
+
+        document = apply_update(upsert_base(filter), update, inserting=True)
+        document = with_id(document)
+        self.__store.insert(document)
+        return 0, 0, document["_id"]
+
+    def apply_replace(
+        self, filter: dict, replacement: dict, upsert: bool
+    ) -> Tuple[int, int, Any]:
+        for document in list(self.__store.scan(filter)):
+            if matches(document, filter):
+                replaced = dict(copy.deepcopy(replacement), _id=document["_id"])
+                if replaced != document:
+                    self.__store.replace(replaced)
+                    return 1, 1, None
+                return 1, 0, None
+        if not upsert:
+            return 0, 0, None
+        document = upsert_base(filter)
+        document.update(copy.deepcopy(replacement))
+        document = with_id(document)
+        self.__store.insert(document)
+        return 0, 0, document["_id"]
+
+
+# (kind, arguments) of one of pymongo's write models for bulk_write. The
+# models keep what they were given in the same slots (_doc, _filter,
+# _upsert) since pymongo 3; requirements.txt holds pymongo to 4.x
+def write_operation(request) -> Tuple[str, tuple]:
+    if isinstance(request, InsertOne):
+        return "insert", (request._doc,)
+    if isinstance(request, (UpdateOne, UpdateMany)):
+        multi = isinstance(request, UpdateMany)
+        return "update", (request._filter, request._doc, multi, bool(request._upsert))
+    if isinstance(request, ReplaceOne):
+        return "replace", (request._filter, request._doc, bool(request._upsert))
+    if isinstance(request, (DeleteOne, DeleteMany)):
+        return "delete", (request._filter, 1 if isinstance(request, DeleteOne) else 0)
+    raise TypeError(f"{request!r} is not a valid request")
+
+
+class MemoryStore:
+    """Documents in insertion order in a dict, indexes as dicts of key -> ids"""
+
+    def __init__(self, name: str) -> None:
+        self.__name = name
+        self.__documents: Dict[Any, dict] = {}
+        # Insertion order of each document, for index lookups
+        self.__order: Dict[Any, int] = {}
+        self.__inserted = 0
+        self.__indexes: Dict[str, Index] = {}
+        self.__entries: Dict[str, Dict[tuple, set]] = {}
+        self.__lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self):
+        with self.__lock:
+            yield
+
+    def create_index(self, index: Index) -> None:
+        with self.__lock:
+            if index.get_name() in self.__indexes:
+                return
+            entries: Dict[tuple, set] = {}
+            for document_id, document in self.__documents.items():
+                key = index.key(document)
+                if key is None:
+                    continue
+                if index.is_unique() and key in entries:
+                    raise DuplicateKeyError(self.duplicate(index, key), 11000)
+                entries.setdefault(key, set()).add(document_id)
+            self.__indexes[index.get_name()] = index
+            self.__entries[index.get_name()] = entries
+
+    # Copies of the documents matching query, from an index if we can
+    def scan(self, query: dict) -> Iterator[dict]:
+        with self.__lock:
+            ids = self.candidates(query)
+            if ids is None:
+                documents = self.__documents.values()
+            else:
+                documents = [self.__documents[i] for i in ids if i in self.__documents]
+            return iter(
+                [copy.deepcopy(doc) for doc in documents if matches(doc, query)]
+            )
+
+    def candidates(self, query: dict) -> Optional[List[Any]]:
+        if "_id" in query and is_plain(query["_id"]):
+            return [hashable(query["_id"])]
+        for name, index in self.__indexes.items():
+            fields = index.get_fields()
+            if len(fields) == 1 and fields[0] in query and is_plain(query[fields[0]]):
+                key = (hashable(query[fields[0]]),)
+                ids = self.__entries[name].get(key, set())
+                return sorted(ids, key=self.__order.__getitem__)
+        return None
+
+    def insert(self, document: dict) -> None:
+        document_id = hashable(document["_id"])
+        if document_id in self.__documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.__name} _id", 11000
+            )
+        self.check_unique(document, document_id)
+        self.__documents[document_id] = copy.deepcopy(document)
+        self.__order[document_id] = self.__inserted
+        self.__inserted += 1
+        self.add_entries(document, document_id)
+
+    def replace(self, document: dict) -> None:
+        document_id = hashable(document["_id"])
+        self.check_unique(document, document_id)
+        self.remove_entries(self.__documents[document_id], document_id)
+        self.__documents[document_id] = copy.deepcopy(document)
+        self.add_entries(document, document_id)
+
+    def delete(self, ids: Iterable[Any]) -> None:
+        for document_id in ids:
+            document_id = hashable(document_id)
+            document = self.__documents.pop(document_id, None)
+            if document is not None:
+                del self.__order[document_id]
+                self.remove_entries(document, document_id)
+
+    def check_unique(self, document: dict, document_id: Any) -> None:
+        for name, index in self.__indexes.items():
+            key = index.key(document)
+            if not index.is_unique() or key is None:
+                continue
+            if self.__entries[name].get(key, set()) - {document_id}:
+                raise DuplicateKeyError(self.duplicate(index, key), 11000)
+
+    def add_entries(self, document: dict, document_id: Any) -> None:
+        for name, index in self.__indexes.items():
+            key = index.key(document)
+            if key is not None:
+                self.__entries[name].setdefault(key, set()).add(document_id)
+
+    def remove_entries(self, document: dict, document_id: Any) -> None:
+        for name, index in self.__indexes.items():
+            key = index.key(document)
+            if key is not None:
+                ids = self.__entries[name].get(key, set())
+                ids.discard(document_id)
+                if not ids:
+                    self.__entries[name].pop(key, None)
+
+    def duplicate(self, index: Index, key: tuple) -> str:
+        return f"E11000 duplicate key error {self.__name} index: {index.get_name()} dup key: {key}"
+
+
+class SqliteStore:
+    """
+    One table per collection, (id, doc) with the document as extended JSON.
+    Each index becomes a SQLite index on json_extract of its fields, unique
+    ones enforce uniqueness, and equality queries on a field are pushed down
+    as a WHERE the index can serve. Connections are per thread and process.
+    """
+
+    def __init__(self, database: "SqliteDatabase", name: str) -> None:
+        self.__database = database
+        self.__name = name
+        self.__table = quote(name)
+        self.__indexes: Dict[str, Index] = {}
+        self.__depth = threading.local()
+        self.get_connection().execute(
+            f"CREATE TABLE IF NOT EXISTS {self.__table} "
+            "(id TEXT PRIMARY KEY, doc TEXT NOT NULL)"
+        )
+
+    def get_connection(self) -> sqlite3.Connection:
+        return self.__database.get_connection()
+
+    @contextmanager
+    def transaction(self):
+        connection = self.get_connection()
+        depth = getattr(self.__depth, "value", 0)
+        if depth == 0:
+            connection.execute("BEGIN IMMEDIATE")
+        self.__depth.value = depth + 1
+        try:
+            yield
+        except BaseException:
+            self.__depth.value = depth
+            if depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        self.__depth.value = depth
+        if depth == 0:
+            connection.execute("COMMIT")
+
+    def create_index(self, index: Index) -> None:
+        fields = ", ".join(json_path(field) for field in index.get_fields())
+        unique = "UNIQUE " if index.is_unique() else ""
+        name = quote(f"{self.__name}.{index.get_name()}")
+        try:
+            self.get_connection().execute(
+                f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {self.__table} ({fields})"
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.__name}: {e}", 11000
+            )
+        self.__indexes[index.get_name()] = index
+
+    def scan(self, query: dict) -> Iterator[dict]:
+        where, parameters = self.pushdown(query)
+        rows = self.get_connection().execute(
+            f"SELECT doc FROM {self.__table}{where} ORDER BY rowid", parameters
+        )
+        return (decode(doc) for doc, in rows)
+
+    # A WHERE for the plain equalities in query; matches() checks the rest
+    def pushdown(self, query: dict) -> Tuple[str, list]:
+        clauses, parameters = [], []
+        for field, value in query.items():
+            if field.startswith("$"):
+                continue
+            if field == "_id" and is_plain(value):
+                clauses.append("id = ?")
+                parameters.append(encode_id(value))
+            elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+                clauses.append(f"{json_path(field)} = ?")
+                parameters.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), parameters
+
+    def insert(self, document: dict) -> None:
+        try:
+            self.get_connection().execute(
+                f"INSERT INTO {self.__table} (id, doc) VALUES (?, ?)",
+                (encode_id(document["_id"]), encode(document)),
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.__name}: {e}", 11000
+            )
+
+    def replace(self, document: dict) -> None:
+        try:
+            self.get_connection().execute(
+                f"UPDATE {self.__table} SET doc = ? WHERE id = ?",
+                (encode(document), encode_id(document["_id"])),
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.__name}: {e}", 11000
+            )
+
+    def delete(self, ids: Iterable[Any]) -> None:
+        self.get_connection().executemany(
+            f"DELETE FROM {self.__table} WHERE id = ?",
+            [(encode_id(document_id),) for document_id in ids],
+        )
+
+
+class LocalDatabase:
+    """Collections by name, made on first use like MongoDB's"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__collections: Dict[str, LocalCollection] = {}
+        self.__lock = threading.Lock()
+
+    def make_store(self, name: str):
+        raise NotImplementedError
+
+    def get_collection(self, name: str, **_) -> LocalCollection:
+        with self.__lock:
+            if name not in self.__collections:
+                self.__collections[name] = LocalCollection(name, self.make_store(name))
+            return self.__collections[name]
+
+    def list_collection_names(self) -> List[str]:
+        return list(self.__collections)
+
+    def drop_collection(self, name: str) -> None:
+        self.get_collection(name).delete_many({})
+
+    def __getattr__(self, name: str) -> LocalCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def __getitem__(self, name: str) -> LocalCollection:
+        return self.get_collection(name)
+
+
+class MemoryDatabase(LocalDatabase):
+    def make_store(self, name: str) -> MemoryStore:
+        return MemoryStore(name)
+
+
+class SqliteDatabase(LocalDatabase):
+    def __init__(self, name: str, path: str) -> None:
+        super().__init__(name)
+        self.__path = path
+        self.__local = threading.local()
+
+    def get_path(self) -> str:
+        return self.__path
+
+    def make_store(self, name: str) -> SqliteStore:
+        return SqliteStore(self, name)
+
+    def get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self.__local, "connection", None)
+        if connection is None or self.__local.pid != os.getpid():
+            # Autocommit; transactions are begun explicitly
+            connection = sqlite3.connect(self.__path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.__local.connection = connection
+            self.__local.pid = os.getpid()
+        return connection
+
+
+# Matching
+
+
+def get_path(document: Any, path: str) -> Any:
+    for part in path.split("."):
+        if isinstance(document, dict):
+            document = document.get(part, MISSING)
+        elif isinstance(document, list) and part.isdigit():
+            document = document[int(part)] if int(part) < len(document) else MISSING
+        else:
+            return MISSING
+    return document
+
+
+def has_path(document: Any, path: str) -> bool:
+    for part in path.split("."):
+        if not isinstance(document, dict) or part not in document:
+            return False
+        document = document[part]
+    return True
+
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, part) for part in condition):
+                return False
+        elif not matches_field(document, key, condition):
+            return False
+    return True
+
+
+def matches_field(document: dict, field: str, condition: Any) -> bool:
+    value = get_path(document, field)
+    if not is_operator(condition):
+        return equals(value, condition)
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            ok = equals(value, operand)
+        elif operator == "$ne":
+            ok = not equals(value, operand)
+        elif operator == "$in":
+            ok = any(equals(value, item) for item in operand)
+        elif operator == "$nin":
+            ok = not any(equals(value, item) for item in operand)
+        elif operator == "$exists":
+            ok = has_path(document, field) == bool(operand)
+        elif operator in ("$lt", "$lte", "$gt", "$gte"):
+            ok = any(compare(item, operator, operand) for item in candidates(value))
+        else:
+            raise ValueError(f"Unsupported query operator {operator}")
+        if not ok:
+            return False
+    return True
+
+
+# Arrays match when any element does, like MongoDB
+def candidates(value: Any) -> List[Any]:
+    return [value] + value if isinstance(value, list) else [value]
+
+
+def equals(value: Any, expected: Any) -> bool:
+    return any(same(item, expected) for item in candidates(value))
+
+
+def same(value: Any, expected: Any) -> bool:
+    if isinstance(value, bool) != isinstance(expected, bool):
+        return False
+    return normalize(value) == normalize(expected)
+
+
+def compare(value: Any, operator: str, operand: Any) -> bool:
+    # Only values of the same kind compare, as in MongoDB
+    if value is MISSING or type_rank(value) != type_rank(operand):
+        return False
+    value, operand = normalize(value), normalize(operand)
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    if operator == "$gt":
+        return value > operand
+    return value >= operand
+
+
+def is_operator(condition: Any) -> bool:
+    return (
+        isinstance(condition, dict)
+        and bool(condition)
+        and all(key.startswith("$") for key in condition)
+    )
+
+
+def is_plain(value: Any) -> bool:
+    return not isinstance(value, (dict, list))
+
+
+# Aware datetimes as naive UTC, which is how MongoDB hands them back
+def normalize(value: Any) -> Any:
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def type_rank(value: Any) -> int:
+    return TYPE_ORDER.get(type(value), 9)
+
+
+def sort_key(value: Any) -> tuple:
+    if isinstance(value, dict):
+        return (type_rank(value), json.dumps(value, sort_keys=True, default=str))
+    if isinstance(value, list):
+        return (type_rank(value), [sort_key(item) for item in value])
+    return (type_rank(value), normalize(value) if value is not None else 0)
+
+
+def hashable(value: Any) -> Any:
+    if isinstance(value, dict):
+        return tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    return value
+
+
+# Projection
+
+
+def project(document: Optional[dict], projection) -> Optional[dict]:
+    if document is None or not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    slices = {k: v["$slice"] for k, v in projection.items() if isinstance(v, dict)}
+    included = [k for k, v in projection.items() if not isinstance(v, dict) and v]
+    excluded = [k for k, v in projection.items() if not isinstance(v, dict) and not v]
+    include_id = "_id" not in excluded
+
+    if [field for field in included if field != "_id"] or (
+        slices and not [field for field in excluded if field != "_id"]
+    ):
+        result = {}
+        if include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        for field in included + list(slices):
+            if field in document:
+                result[field] = document[field]
+    else:
+        result = {k: v for k, v in document.items() if k not in excluded}
+
+    for field, count in slices.items():
+        if isinstance(result.get(field), list):
+            result[field] = slice_list(result[field], count)
+    return result
+
+
+def slice_list(values: list, count: Union[int, list]) -> list:
+    if isinstance(count, list):
+        skip, limit = count
+        start = skip if skip >= 0 else max(len(values) + skip, 0)
+        return values[start : start + limit]
+    return values[count:] if count < 0 else values[:count]
+
+
+# Updates
+
+
+def apply_update(document: dict, update: Union[dict, list], inserting: bool) -> dict:
+    document = copy.deepcopy(document)
+    if isinstance(update, list):
+        for stage in update:
+            for operator, fields in stage.items():
+                if operator not in ("$set", "$addFields"):
+                    raise ValueError(f"Unsupported pipeline stage {operator}")
+                current = copy.deepcopy(document)
+                for field, expression in fields.items():
+                    set_path(document, field, evaluate(current, expression))
+        return document
+
+    if not any(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == "$set":
+                set_path(document, field, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    set_path(document, field, copy.deepcopy(value))
+            elif operator == "$unset":
+                unset_path(document, field)
+            elif operator == "$inc":
+                set_path(document, field, (get_path(document, field) or 0) + value)
+            elif operator in ("$max", "$min"):
+                current = get_path(document, field)
+                if (
+                    current is MISSING
+                    or (operator == "$max" and sort_key(value) > sort_key(current))
+                    or (operator == "$min" and sort_key(value) < sort_key(current))
+                ):
+                    set_path(document, field, value)
+            elif operator == "$push":
+                current = get_path(document, field)
+                set_path(document, field, (current or []) + [copy.deepcopy(value)])
+            else:
+                raise ValueError(f"Unsupported update operator {operator}")
+    return document
+
+
+def evaluate(document: dict, expression: Any) -> Any:
+    if isinstance(expression, str) and expression.startswith("$"):
+        return get_path(document, expression[1:])
+    if isinstance(expression, list):
+        return [evaluate(document, item) for item in expression]
+    if not is_operator(expression):
+        if isinstance(expression, dict):
+            return {k: evaluate(document, v) for k, v in expression.items()}
+        return expression
+
+    ((operator, arguments),) = expression.items()
+    if operator == "$literal":
+        return arguments
+    if operator == "$cond":
+        if isinstance(arguments, dict):
+            arguments = [arguments["if"], arguments["then"], arguments["else"]]
+        condition, then, otherwise = arguments
+        return evaluate(document, then if evaluate(document, condition) else otherwise)
+    if operator == "$ifNull":
+        *values, fallback = arguments
+        for value in values:
+            value = evaluate(document, value)
+            if value is not None:
+                return value
+        return evaluate(document, fallback)
+
+    values = [evaluate(document, argument) for argument in arguments]
+    if operator == "$add":
+        return None if None in values else sum(values)
+    if operator == "$multiply":
+        product = 1
+        for value in values:
+            product *= value
+        return product
+    if operator == "$subtract":
+        return values[0] - values[1]
+    if operator == "$divide":
+        return values[0] / values[1]
+    if operator in ("$max", "$min"):
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        return (
+            max(present, key=sort_key)
+            if operator == "$max"
+            else min(present, key=sort_key)
+        )
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        left, right = sort_key(values[0]), sort_key(values[1])
+        return {
+            "$eq": left == right,
+            "$ne": left != right,
+            "$gt": left > right,
+            "$gte": left >= right,
+            "$lt": left < right,
+            "$lte": left <= right,
+        }[operator]
+    raise ValueError(f"Unsupported expression operator {operator}")
+
+
+def set_path(document: dict, path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def unset_path(document: dict, path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(last, None)
+
+
+# The equality fields of an upsert's filter start the new document
+def upsert_base(filter: dict) -> dict:
+    document: dict = {}
+    for field, condition in filter.items():
+        if field.startswith("$"):
+            continue
+        if is_operator(condition):
+            if "$eq" in condition:
+                set_path(document, field, copy.deepcopy(condition["$eq"]))
+            continue
+        set_path(document, field, copy.deepcopy(condition))
+    return document
+
+
+def with_id(document: dict) -> dict:
+    # pymongo also adds the _id to the caller's document
+    if "_id" not in document:
+        document["_id"] = ObjectId()
+    return document
+
+
+def index_fields(keys, direction: int = 1) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, direction)]
+    return [(field, order) for field, order in keys]
+
+
+# SQLite encoding
+
+
+def encode(document: dict) -> str:
+    return json_util.dumps(document, json_options=RELAXED)
+
+
+def decode(text: str) -> dict:
+    return json_util.loads(text, json_options=RELAXED)
+
+
+def encode_id(document_id: Any) -> str:
+    return json_util.dumps(document_id, json_options=RELAXED)
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def json_path(field: str) -> str:
+    path = "".join(f'."{part}"' for part in field.split("."))
+    return f"json_extract(doc, '${path}')"
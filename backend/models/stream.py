@@ -0,0 +1,23 @@
+import json
+from typing import Any, Generator, Optional, TypeVar
+
+Result = TypeVar("Result")
+
+
+# Runs a generator to the end for callers that only want its return value
+def drain(generator: Generator[Any, Any, Result]) -> Result:
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+
+# One Server-Sent Events message, data is sent as a single line of JSON
+def sse_message(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
@@ -1,12 +1,131 @@
 from models.pokemon import Pokemon
-from models.battle import Battle
-from models.logger import Logger, DbCollection
-
+from models.bracket import Bracket
+from models.battle import Battle, Battle_Data, pokemon_state, restore_state
+from models.definitions import definition_of_pokemon, hash_definition
+from models import codec
+from models.events import Verbosity
+from models.replay import pokemon_from_definition
+from models.adminlog import AdminLevel
+from models.logger import BulkLogger, Logger, DbCollection
+from models.ratings import RatingTally, rating_engine
+from models.stats import StatsTally
+from models.stream import drain
+
+import hashlib
+from array import array
+import os
 import random
-from typing import List, Optional, Tuple
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from threading import Lock
+from typing import Dict, Generator, Iterator, List, Optional, Tuple, Union
 
 logger = Logger()
 
+# Processes used to play the battles of a round, 1 plays them in this process
+ROUND_WORKERS = int(os.getenv("TOURNAMENT_ROUND_WORKERS", "1"))
+# Rounds with fewer battles than this are played here even with workers
+PARALLEL_THRESHOLD = 32
+# Battles handed to the pool at once, so a huge round is never all in memory
+PARALLEL_SLICE = 4096
+# Round results are stored as they come, this many per tournament_round page
+ROUND_PAGE_SIZE = 1000
+# Up to this many participants the round results are also kept on the
+# tournament document; larger brackets only keep them in tournament_round
+EMBED_EVENTS_LIMIT = 1024
+# A running tournament holds its checkpoint this long, renewed as battles are
+# played; nobody else can resume it meanwhile
+LEASE_SECONDS = int(os.getenv("TOURNAMENT_LEASE_SECONDS", "30"))
+
+# (pokemon1, pokemon2, battle id, seed, verbosity value)
+RoundJob = Tuple[Pokemon, Pokemon, int, Optional[int], str]
+# What a worker gets for each side: definition and [hp, active defense], far
+# smaller to pickle than a Pokemon and its random generator
+Fighter = Tuple[dict, List[int]]
+
+
+""" Seed for the battle at a bracket position (pair index within the round).
+Seeded tournaments get the same battles however and wherever they are played;
+kept below 2**62 so the seed and seed + 1 given to pokemon2 fit in BSON """
+
+
+def derive_battle_seed(seed: int, round_number: int, position: int) -> int:
+    key = f"{seed}:{round_number}:{position}".encode()
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 2
+
+
+def pack_fighter(pokemon: Pokemon) -> Fighter:
+    return definition_of_pokemon(pokemon), pokemon_state(pokemon)
+
+
+def unpack_fighter(fighter: Fighter) -> Pokemon:
+    definition, state = fighter
+    pokemon = pokemon_from_definition(definition)
+    restore_state(pokemon, state)
+    return pokemon
+
+
+# Top level so the process pool can pickle it. Plays without persisting and
+# returns the winning side, both pokemon's end state and the battle document
+def play_round_battle(
+    job: Tuple[Fighter, Fighter, int, Optional[int], str],
+) -> Tuple[int, List[List[int]], dict]:
+    fighter1, fighter2, battle_id, seed, verbosity = job
+    battle = Battle(
+        unpack_fighter(fighter1),
+        unpack_fighter(fighter2),
+        battle_id,
+        seed,
+        Verbosity(verbosity),
+    )
+    battle.play()
+    return (
+        battle.get_winner(),
+        [pokemon_state(pokemon) for pokemon in battle.get_pokemon()],
+        Battle_Data(battle).get_battle_data(),
+    )
+
+
+# Some of a round's writes failed; the round is not counted or checkpointed
+class RoundNotSaved(Exception):
+    pass
+
+
+# Another run holds the tournament's checkpoint
+class CheckpointHeld(Exception):
+    pass
+
+
+def lease_until() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+
+
+class RoundPool:
+    """Worker processes for large rounds, shared by every tournament in the
+    process: one pool per worker count, started on first use. Workers don't
+    survive a fork, so a child starts its own"""
+
+    def __init__(self) -> None:
+        self.__pools: Dict[int, ProcessPoolExecutor] = {}
+        self.__pid: Optional[int] = None
+        self.__lock = Lock()
+
+    def get_pool(self, workers: int) -> ProcessPoolExecutor:
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__pools = {}
+                self.__pid = os.getpid()
+            if workers not in self.__pools:
+                self.__pools[workers] = ProcessPoolExecutor(max_workers=workers)
+            return self.__pools[workers]
+
+
+round_pool = RoundPool()
+
 
 class Tournament:
     def __init__(
@@ -15,9 +134,13 @@ class Tournament:
         tournament_id: int = 1,
         battle_id: int = 1,
         seed: int = None,
+        verbosity: Verbosity = Verbosity.FULL,
+        workers: int = ROUND_WORKERS,
     ):
-        self.__participants = participants
-        self.__remaining = participants
+        # Our own copy, the caller's list is never changed
+        self.__participants = list(participants)
+        # Who is still in, as indexes into participants
+        self.__bracket = Bracket(range(len(self.__participants)))
         self.__tournament_random = random.Random()
 
         # Set tournament seed
@@ -26,8 +149,22 @@ class Tournament:
 
         self.__tournament_id = tournament_id
         self.__battle_id = battle_id
-        self.__events: List[str] = []
-        self.__victors: List[List[str]] = []
+        # Passed to every battle; the round results below are always kept
+        self.__verbosity = verbosity
+        self.__workers = workers
+        self.__round = 0
+        self.__keep_events = len(self.__participants) <= EMBED_EVENTS_LIMIT
+        self.__events: List[dict] = []
+        # This run, as the holder of the checkpoint lease
+        self.__owner = uuid.uuid4().hex
+        self.__lease_renewed = 0.0
+        # Stats and ratings of the latest step (a round, then the tournament
+        # result as the step after the last round) and the last step written,
+        # see apply_tally
+        self.__tally_step = 0
+        self.__stats = StatsTally()
+        self.__ratings = RatingTally()
+        self.__flushed = 0
 
     def get_seed(self) -> int:
         return self.__tournament_seed
@@ -38,88 +175,376 @@ class Tournament:
 
         return
 
-    def get_victors(self):
-        return self.__victors
+    # Names of everyone still in, byes first then winners in bracket order
+    def get_victors(self) -> List[str]:
+        return [
+            self.__participants[index].get_name()
+            for index in self.__bracket.get_entrants()
+        ]
 
     def get_participants(self) -> List[Pokemon]:
         return self.__participants
 
-    def get_events(self) -> List[str]:
+    # Round results, only kept in memory for brackets up to EMBED_EVENTS_LIMIT
+    def get_events(self) -> List[dict]:
         return self.__events
 
+    def keeps_events(self) -> bool:
+        return self.__keep_events
+
+    def get_round(self) -> int:
+        return self.__round
+
     def get_tournament_id(self):
         return self.__tournament_id
 
     def get_battle_id(self):
         return self.__battle_id
 
-    def append_event(self, event: str):
-        self.__events.append(event)
+    def get_workers(self) -> int:
+        return self.__workers
 
-    def conduct_round(self) -> None:
-        next_round = []
+    def get_verbosity(self) -> Verbosity:
+        return self.__verbosity
+
+    def get_owner(self) -> str:
+        return self.__owner
+
+    def get_flushed(self) -> int:
+        return self.__flushed
+
+    # The stats and ratings not written yet with their step, None once they are
+    def get_tally_data(self) -> Optional[dict]:
+        if self.__tally_step <= self.__flushed:
+            return None
+        return {
+            "step": self.__tally_step,
+            "stats": self.__stats.to_document(),
+            "ratings": self.__ratings.to_document(),
+        }
+
+    # A few times per lease, so it never runs out while battles are played
+    def renew_lease(self) -> None:
+        now = time.monotonic()
+        if now - self.__lease_renewed < LEASE_SECONDS / 3:
+            return None
+        Tournament_Checkpoint.renew(self.__tournament_id, self.__owner)
+        self.__lease_renewed = now
+
+    def get_bracket(self) -> Bracket:
+        return self.__bracket
+
+    def get_random_state(self) -> tuple:
+        return self.__tournament_random.getstate()
+
+    """ Puts the tournament back where a Tournament_Checkpoint left it: after
+    its last completed round, with the same entrants, their hp and defense,
+    battle id cursor and random state. events are the stored round results """
+
+    def restore_checkpoint(self, checkpoint: dict, events: List[dict]) -> None:
+        self.__round = checkpoint["round"]
+        self.__battle_id = checkpoint["battle id"]
+        version, internal_state, gauss = checkpoint["random state"]
+        self.__tournament_random.setstate((version, tuple(internal_state), gauss))
+
+        if checkpoint["entrants"] is not None:
+            self.__bracket = Bracket(index for index, _, _ in checkpoint["entrants"])
+            for index, hp, guard in checkpoint["entrants"]:
+                restore_state(self.__participants[index], [hp, guard])
+        if self.__keep_events:
+            self.__events = list(events)
+
+        # Older checkpoints were saved after their round's stats were written
+        self.__flushed = checkpoint.get("flushed through", self.__round)
+        tally = checkpoint.get("tally")
+        if tally is not None:
+            self.__tally_step = tally["step"]
+            self.__stats = StatsTally.from_document(tally["stats"])
+            self.__ratings = RatingTally.from_document(tally.get("ratings", []))
+
+    # The last one standing, None while the bracket is still running
+    def get_winner(self) -> Optional[Pokemon]:
+        if self.__bracket.size() != 1:
+            return None
+        return self.__participants[self.__bracket.get_entrants()[0]]
 
-        if len(self.__remaining) % 2 == 1:
-            bye_pokemon: Pokemon = self.__tournament_random.choice(self.__remaining)
-            self.__remaining.remove(bye_pokemon)
-            next_round.append(bye_pokemon)
+    def append_event(self, event: dict):
+        self.__events.append(event)
 
-        round_events = []  # Holds events for this round
+    def conduct_round(self) -> None:
+        drain(self.stream_round())
+        self.flush_tally()
+        return None
 
-        for i in range(0, len(self.__remaining), 2):
-            pokemon1: Pokemon = self.__remaining[i]
-            pokemon2: Pokemon = self.__remaining[i + 1]
+    # Writes the stats and ratings of the latest step unless they were; True
+    # if it did
+    def flush_tally(self) -> bool:
+        if self.__tally_step <= self.__flushed:
+            return False
+        self.__stats.flush(logger)
+        self.__ratings.flush(logger, rating_engine)
+        self.__flushed = self.__tally_step
+        return True
+
+    """ Writes the latest step's stats and ratings once the checkpoint holds
+    them, then marks them written there. A run that stops in between leaves them in the
+    checkpoint for the resume to write; one that stops after is never
+    counted twice, the resume sees the mark and skips them """
+
+    def apply_tally(self) -> None:
+        if self.flush_tally():
+            Tournament_Checkpoint.mark_flushed(
+                self.__tournament_id, self.__owner, self.__flushed
+            )
 
-            battle = Battle(
-                pokemon1, pokemon2, self.__battle_id, self.__tournament_seed
+    """ Plays one round, yielding each battle's result as soon as it is decided.
+    Results are stored ROUND_PAGE_SIZE at a time while the round runs, so
+    memory follows the size of the round, not the history of the bracket.
+    Battles played here and round pages are collected and written as bulk
+    upserts, a few round trips per thousand battles. With a pool, large rounds
+    are played across its processes and stored with insert_many; results and
+    battle ids match playing them here """
+
+    def stream_round(
+        self, pool: Optional[Executor] = None
+    ) -> Generator[dict, None, None]:
+        self.__round += 1
+        round_number = self.__round
+        self.__bracket.draw_bye(self.__tournament_random)
+        first_battle_id = self.__battle_id
+        self.__battle_id += self.__bracket.battle_count()
+
+        winners = array("q")
+        page = []  # Results for this round not stored yet
+        round_events = []  # Holds events for this round when they are kept
+        stats = StatsTally()  # Wins and losses, written once the round is done
+        ratings = RatingTally()  # Results, rated once the round is done
+
+        # Leaving the block, even when the caller stops early, sends what's left
+        with logger.bulk() as bulk:
+            jobs = self.round_jobs(round_number, first_battle_id)
+            if pool is not None and self.__bracket.battle_count() >= PARALLEL_THRESHOLD:
+                outcomes = self.play_parallel(jobs, pool, bulk)
+            else:
+                outcomes = self.play_serial(jobs, bulk)
+
+            for (position, first, second), winner in zip(
+                self.__bracket.pairs(), outcomes
+            ):
+                if winner == 1:
+                    first, second = second, first
+                victor = self.__participants[first]
+                loser = self.__participants[second]
+
+                # Add battle results to the round's events
+                result = {
+                    "battle_id": first_battle_id + position,
+                    "winner": victor.get_name(),
+                    "loser": loser.get_name(),
+                }
+                page.append(result)
+                if self.__keep_events:
+                    round_events.append(result)
+                if len(page) == ROUND_PAGE_SIZE:
+                    self.save_round_page(
+                        round_number, position // ROUND_PAGE_SIZE, page, bulk
+                    )
+                    page = []
+
+                winners.append(first)  # Winner proceeds
+                victor.increment_battle_wins()
+                loser.increment_battle_losses()
+                stats.record_battle(victor.get_name(), loser.get_name())
+                ratings.record_battle(victor.get_name(), loser.get_name())
+                yield result
+
+            if page:
+                self.save_round_page(
+                    round_number,
+                    self.__bracket.battle_count() // ROUND_PAGE_SIZE,
+                    page,
+                    bulk,
+                )
+
+        # A round missing results is played again on resume, never checkpointed
+        errors = bulk.get_report()["errors"]
+        if errors:
+            raise RoundNotSaved(
+                f"Round {round_number} of tournament {self.__tournament_id}: "
+                f"{len(errors)} writes failed, first: {errors[0]['message']}"
             )
-            self.__battle_id += 1
-            outcome = battle.start_battle()
 
-            # Add battle results to the round's events
-            round_events.append(
+        # Left unwritten if the round stops early; a resume plays it again.
+        # Both wait for the round's checkpoint, see apply_tally
+        self.__tally_step = round_number
+        self.__stats = stats
+        self.__ratings = ratings
+        self.__bracket.advance(winners)
+        if self.__keep_events:
+            self.__events.append(
                 {
-                    "battle_id": self.__battle_id - 1,
-                    "winner": outcome[0].get_name(),
-                    "loser": outcome[1].get_name(),
+                    "round": round_number,
+                    "events": round_events,
                 }
             )
+        return None
 
-            next_round.append(outcome[0])  # Winner proceeds
-            outcome[0].increment_battle_wins()
-            outcome[1].increment_battle_losses()
+    # (pokemon1, pokemon2, battle id, seed, verbosity) for each pair, lazily
+    def round_jobs(self, round_number: int, first_battle_id: int) -> Iterator[RoundJob]:
+        for position, first, second in self.__bracket.pairs():
+            seed = self.__tournament_seed
+            if seed is not None:
+                seed = derive_battle_seed(seed, round_number, position)
+            yield (
+                self.__participants[first],
+                self.__participants[second],
+                first_battle_id + position,
+                seed,
+                self.__verbosity.value,
+            )
 
-        self.__remaining = next_round
-        self.__events.append(
-            {
-                "round": len(self.__events) + 1,
-                "events": round_events,
-            }
-        )
-        return None
+    def save_round_page(
+        self, round_number: int, page: int, events: List[dict], writer: BulkLogger
+    ) -> None:
+        data = {
+            "tournament id": self.__tournament_id,
+            "round": round_number,
+            "page": page,
+            "events": events,
+        }
+        if codec.enabled() and codec.can_pack_results(events):
+            data[codec.PACKED_EVENTS] = codec.pack_rounds(
+                [{"round": round_number, "events": data.pop("events")}]
+            )
+        writer.log(data, DbCollection.TOURNAMENT_ROUND)
+
+    # Winning side of each battle, played one at a time and saved in bulk
+    def play_serial(
+        self, jobs: Iterator[RoundJob], bulk: BulkLogger
+    ) -> Generator[int, None, None]:
+        for pokemon1, pokemon2, battle_id, seed, verbosity in jobs:
+            battle = Battle(pokemon1, pokemon2, battle_id, seed, Verbosity(verbosity))
+            battle.play()
+            bulk.admin_log(
+                f"battle started: {battle_id}",
+                battle_id=battle_id,
+                tournament_id=self.__tournament_id,
+            )
+            Battle_Data(battle).save(bulk)
+            yield battle.get_winner()
+
+    # Winning side of each battle, PARALLEL_SLICE battles at a time on the pool
+    def play_parallel(
+        self, jobs: Iterator[RoundJob], pool: Executor, bulk: BulkLogger
+    ) -> Generator[int, None, None]:
+        while True:
+            sliced = list(islice(jobs, PARALLEL_SLICE))
+            if not sliced:
+                return
+            chunksize = max(1, len(sliced) // (self.__workers * 4))
+            packed = [
+                (
+                    pack_fighter(pokemon1),
+                    pack_fighter(pokemon2),
+                    battle_id,
+                    seed,
+                    verbosity,
+                )
+                for pokemon1, pokemon2, battle_id, seed, verbosity in sliced
+            ]
+            played = list(pool.map(play_round_battle, packed, chunksize=chunksize))
+
+            # Workers fought on copies; carry hp and defense over to our pokemon
+            for (pokemon1, pokemon2, _, _, _), (_, states, _) in zip(sliced, played):
+                restore_state(pokemon1, states[0])
+                restore_state(pokemon2, states[1])
+
+            logger.insert_many("battle", [data for _, _, data in played])
+            bulk.admin_log(
+                f"Battles {sliced[0][2]}-{sliced[-1][2]} logged",
+                tournament_id=self.__tournament_id,
+            )
+            for winner, _, _ in played:
+                yield winner
 
     def run_tournament(self) -> Optional[Pokemon]:
-        logger.admin_log(f"tournament started: {self.__tournament_id}")
+        return drain(self.stream_tournament())
 
-        if not self.validate_participants() or len(self.__participants) < 4:
-            logger.admin_log(f"Invalid tournament: {self.__tournament_id}")
-            return None
+    """ Runs the whole bracket as a generator of progress updates:
+    ("round", number) when a round starts, ("battle", result) per battle and
+    ("victors", names) when it ends. Returns the winner, or None if the
+    participants are invalid """
 
-        while len(self.__remaining) > 1:
-            self.conduct_round()
+    def stream_tournament(
+        self,
+    ) -> Generator[Tuple[str, Union[int, dict, List[str]]], None, Optional[Pokemon]]:
+        logger.admin_log(
+            f"tournament started: {self.__tournament_id}",
+            tournament_id=self.__tournament_id,
+        )
 
-            # Append victors from this round for logging
-            self.__victors.append(
-                list(participant.get_name() for participant in self.__remaining)
+        if not self.validate_participants() or len(self.__participants) < 4:
+            logger.admin_log(
+                f"Invalid tournament: {self.__tournament_id}",
+                AdminLevel.WARNING,
+                tournament_id=self.__tournament_id,
             )
+            return None
 
-        winner = self.__remaining[0]
-        winner.increment_tournament_wins()
-
-        tourney_data = Tournament_Data(self)
-        tourney_data.save()
+        pool = round_pool.get_pool(self.__workers) if self.__workers > 1 else None
+        try:
+            # A resumed tournament already has its first checkpoint
+            if self.__round == 0:
+                Tournament_Checkpoint(self).save()
+            # What the interrupted run left unwritten
+            self.apply_tally()
+            while self.__bracket.size() > 1:
+                yield "round", self.__round + 1
+                for result in self.stream_round(pool):
+                    self.renew_lease()
+                    yield "battle", result
+                Tournament_Checkpoint(self).save()
+                self.apply_tally()
+                yield "victors", self.get_victors()
+
+            winner = self.get_winner()
+            winner.increment_tournament_wins()
+            self.record_tournament_stats()
+            Tournament_Checkpoint(self).save()
+            self.apply_tally()
+
+            tourney_data = Tournament_Data(self)
+            tourney_data.save()
+            Tournament_Checkpoint.discard(self.__tournament_id)
+        except BaseException:
+            # Stopped or failed: free the checkpoint for a resume right away
+            Tournament_Checkpoint.release(self.__tournament_id, self.__owner)
+            raise
         return winner
 
+    # A tournament win for the winner and a loss for every other entry, the
+    # step after the last round; unless a resumed run already wrote them
+    def record_tournament_stats(self) -> None:
+        champion = self.__bracket.get_entrants()[0]
+        for index, pokemon in enumerate(self.__participants):
+            if index != champion:
+                pokemon.increment_tournament_losses()
+        if self.__flushed > self.__round:
+            return None
+
+        stats = StatsTally()
+        stats.record_tournament(
+            self.__participants[champion].get_name(),
+            (
+                pokemon.get_name()
+                for index, pokemon in enumerate(self.__participants)
+                if index != champion
+            ),
+        )
+        self.__tally_step = self.__round + 1
+        self.__stats = stats
+        self.__ratings = RatingTally()
+
     def validate_participants(self) -> bool:
         return all(isinstance(entry, Pokemon) for entry in self.__participants)
 
@@ -134,11 +559,15 @@ class Tournament_Data:
 
     def save(self) -> None:
         logger.log(self.__data, DbCollection.TOURNAMENT)
-        logger.admin_log(f"Tournament {self.__data['tournament id']} logged")
+        tournament_id = self.__data["tournament id"]
+        logger.admin_log(
+            f"Tournament {tournament_id} logged", tournament_id=tournament_id
+        )
 
     def deconstruct_tournament(
         self, tournament: Tournament
     ) -> Tuple[int, List[str], List[dict], str]:
+        winner = tournament.get_winner()
         return tuple(
             [
                 tournament.get_tournament_id(),
@@ -147,7 +576,7 @@ class Tournament_Data:
                     for participant in tournament.get_participants()
                 ),
                 tournament.get_events(),
-                tournament.get_victors(),
+                winner.get_name() if winner else "",
             ]
         )
 
@@ -156,9 +585,132 @@ class Tournament_Data:
         self.__data = {
             "tournament id": deconstructed[0],
             "participants": deconstructed[1],
-            "events": deconstructed[2],  # Events with round winners
-            "winner": (
-                deconstructed[3][-1][-1] if deconstructed[3] else ""
-            ),  # Final winner's name
+            "rounds": tournament.get_round(),
+            "winner": deconstructed[3],  # Final winner's name
         }
+        # Large brackets keep their results in tournament_round only
+        if tournament.keeps_events():
+            self.__data["events"] = deconstructed[2]  # Events with round winners
+        results = [
+            result
+            for tournament_round in self.__data.get("events", [])
+            for result in tournament_round["events"]
+        ]
+        if codec.enabled() and codec.can_pack_results(results):
+            self.__data = codec.pack_tournament(self.__data)
         return None
+
+
+""" What BattleManager.resume_tournament needs to carry on after a restart,
+one document per running tournament. The first one, written before round 1,
+also names the participants and hashes their definitions so a resume can
+tell if the roster changed; later ones only update the bracket """
+
+
+class Tournament_Checkpoint:
+    def __init__(self, tournament: Tournament) -> None:
+        self.__data = {}
+        self.build_data(tournament)
+
+    def get_checkpoint_data(self) -> dict:
+        return self.__data
+
+    # The first checkpoint creates the document; later ones are only written
+    # while this run holds the lease
+    def save(self) -> None:
+        if self.__data["round"] == 0:
+            logger.log(self.__data, DbCollection.TOURNAMENT_CHECKPOINT)
+            return None
+        result = logger.update(
+            "tournament_checkpoint",
+            {
+                "tournament id": self.__data["tournament id"],
+                "owner": self.__data["owner"],
+            },
+            self.__data,
+        )
+        if result.matched_count == 0:
+            raise CheckpointHeld(
+                f"Tournament {self.__data['tournament id']} is run elsewhere"
+            )
+
+    # Stats through this step are written, see Tournament.apply_tally
+    @staticmethod
+    def mark_flushed(tournament_id: int, owner: str, step: int) -> None:
+        result = logger.update(
+            "tournament_checkpoint",
+            {"tournament id": tournament_id, "owner": owner},
+            {"flushed through": step, "tally": None},
+        )
+        if result.matched_count == 0:
+            raise CheckpointHeld(f"Tournament {tournament_id} is run elsewhere")
+
+    @staticmethod
+    def renew(tournament_id: int, owner: str) -> None:
+        result = logger.update(
+            "tournament_checkpoint",
+            {"tournament id": tournament_id, "owner": owner},
+            {"lease until": lease_until()},
+        )
+        if result.matched_count == 0:
+            raise CheckpointHeld(f"Tournament {tournament_id} is run elsewhere")
+
+    # Best effort, the lease runs out anyway
+    @staticmethod
+    def release(tournament_id: int, owner: str) -> None:
+        try:
+            logger.update(
+                "tournament_checkpoint",
+                {"tournament id": tournament_id, "owner": owner},
+                {"owner": None, "lease until": None},
+            )
+        except Exception:
+            pass
+
+    # Called once the tournament document is saved
+    @staticmethod
+    def discard(tournament_id: int) -> None:
+        logger.remove("tournament_checkpoint", {"tournament id": tournament_id})
+
+    def build_data(self, tournament: Tournament) -> None:
+        version, internal_state, gauss = tournament.get_random_state()
+        self.__data = {
+            "tournament id": tournament.get_tournament_id(),
+            "round": tournament.get_round(),
+            "battle id": tournament.get_battle_id(),
+            "random state": [version, list(internal_state), gauss],
+            "owner": tournament.get_owner(),
+            "lease until": lease_until(),
+            "flushed through": tournament.get_flushed(),
+            "tally": tournament.get_tally_data(),
+        }
+
+        if tournament.get_round() == 0:
+            # Everyone is still in with the hp they came with
+            self.__data["entrants"] = None
+            self.__data["participants"] = [
+                participant.get_name() for participant in tournament.get_participants()
+            ]
+            self.__data["roster hash"] = roster_hash(tournament.get_participants())
+            self.__data["seed"] = tournament.get_seed()
+            self.__data["verbosity"] = tournament.get_verbosity().value
+            return None
+
+        participants = tournament.get_participants()
+        self.__data["entrants"] = [
+            [index] + pokemon_state(participants[index])
+            for index in tournament.get_bracket().get_entrants()
+        ]
+        return None
+
+
+# One hash over the definition of every distinct participant
+def roster_hash(participants: List[Pokemon]) -> str:
+    definitions = {}
+    for participant in participants:
+        if participant.get_name() not in definitions:
+            definitions[participant.get_name()] = hash_definition(
+                definition_of_pokemon(participant)
+            )
+    encoded = ",".join(definitions[name] for name in sorted(definitions))
+    return hashlib.sha1(encoded.encode()).hexdigest()
@@ -7,9 +7,11 @@ from models.tournament import Tournament
 from models.pokemon import Pokemon, Pokemon_Data
 from models.battle import Battle
 from models.battlemanager import BattleManager
+from models.adminlog import AdminLevel
 from models.logger import Logger, DbCollection
-from models.dbservice import DbService
+from models.dbservice import DbService, PokemonNotFound
 from models.skill import AttackSkill, DefenseSkill
+from models.matchups import matchup_matrix
 
 logger = Logger()
 db_service = DbService()
@@ -131,6 +133,7 @@ class Operator(User):
 
         poke_data = Pokemon_Data(pokemon)
         poke_data.save()
+        self.refresh_matchups(pokemon.get_name())
 
     def create_pokemon(self, data: dict) -> None:
         try:
@@ -163,11 +166,17 @@ class Operator(User):
             )
 
         except Exception as e:
-            logger.admin_log(f"Error creating Pokémon: {str(e)}")
+            logger.admin_log(f"Error creating Pokémon: {str(e)}", AdminLevel.ERROR)
             raise ValueError(f"Validation error: {str(e)}")
 
         poke_data = Pokemon_Data(pokemon)
         poke_data.save()
+        self.refresh_matchups(pokemon.get_name())
+
+    # Only the written pokemon's row and column of the matchup matrix change,
+    # recomputed in the background
+    def refresh_matchups(self, name: str) -> None:
+        matchup_matrix.schedule_update(name)
 
     # Update active seed for user to propogate to events started by user
     def set_seed(self, seed: int = None):
@@ -184,20 +193,22 @@ class Operator(User):
     ) -> Optional[Tournament]:
         logger.admin_log("Attempting to create tournament")
 
-        # Fetch pokemon participants by name
-        pokemon = list(db_service.get_pokemon(participant) for participant in participants)
-
-        # Found all pokemon successfully
-        if None not in pokemon:
-            return self.__battle_manager.start_tournament(pokemon)
+        # Fetch pokemon participants by name, all in one go
+        try:
+            pokemon = db_service.get_pokemon_many(participants)
 
         # Fetched failed for whatever reason, so can't create tournament
-        else:
+        except PokemonNotFound as e:
             logger.admin_log(
-                "create_tournament Failed: Improper attempt to create tournament"
+                "create_tournament Failed: Improper attempt to create tournament: "
+                + str(e),
+                AdminLevel.WARNING,
             )
             return None
 
+        # Found all pokemon successfully
+        return self.__battle_manager.start_tournament(pokemon)
+
     # Start a battle between two pokemon
     def execute_battle(self, pokemon1: Pokemon, pokemon2: Pokemon):
         # Battle can manage passing seeds to pokemon
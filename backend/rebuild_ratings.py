@@ -0,0 +1,10 @@
+from models.ratings import rating_engine
+
+# Recomputes every Elo rating from the stored battles, oldest first, in one
+# pass. Run it with the app stopped: a running app keeps the ratings it
+# loaded until it restarts.
+if __name__ == "__main__":
+    rated = rating_engine.rebuild()
+    print(
+        f"Ratings rebuilt from {rated} battles, {rating_engine.size()} pokemon rated."
+    )
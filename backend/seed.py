@@ -1,19 +1,30 @@
-from pymongo import MongoClient
 from cryptography.fernet import Fernet
 from models.pokemon import Pokemon, Pokemon_Data
 from models.skill import AttackSkill, DefenseSkill
+from models.matchups import matchup_matrix
+from models.database import db
+from models.adminlog import admin_logs
+from models.archive import battle_archive
+from models.stats import leaderboard
 import os
 
-client = MongoClient("mongodb://mongo:27017")
-db = client.pokemon_database
-
 
 def clear_tables():
     db.pokemon.delete_many({})
     db.battle.delete_many({})
+    battle_archive.clear()
     db.tournament.delete_many({})
     db.user.delete_many({})
     db.admin.delete_many({})
+    db.admin_log.delete_many({})
+    db.matchup.delete_many({})
+    db.pokemon_snapshot.delete_many({})
+    db.tournament_round.delete_many({})
+    db.tournament_checkpoint.delete_many({})
+    db.job.delete_many({})
+    db.counters.delete_many({})
+    db.leaderboard.delete_many({})
+    db.rating.delete_many({})
     print("All tables cleared.")
 
 
@@ -252,18 +263,25 @@ def initialize_pokemon():
 
 
 def initialize_admin():
-    adminData = [
-        {
-            "events": ["Initialized Admin."],
-        },
-    ]
-
-    db.admin.insert_many(adminData)
+    admin_logs.write("Initialized Admin.")
+    admin_logs.flush()
     print(f"Sample Admin table initialized.")
 
 
+def initialize_leaderboard():
+    entries = leaderboard.rebuild()
+    print(f"Leaderboard built with {entries} entries.")
+
+
+def initialize_matchups():
+    cells = matchup_matrix.rebuild()
+    print(f"Matchup matrix built with {cells} entries.")
+
+
 if __name__ == "__main__":
     clear_tables()
     initialize_users()
     initialize_pokemon()
     initialize_admin()
+    initialize_matchups()
+    initialize_leaderboard()
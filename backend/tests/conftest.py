@@ -0,0 +1,59 @@
+import os
+import sys
+
+# Before any model touches the database: the whole suite runs without mongod
+os.environ["STORAGE_BACKEND"] = "memory"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from models.database import db
+from models.storage import MemoryDatabase, SqliteDatabase
+
+
+# A fresh local database of each kind, for tests of the storage itself
+@pytest.fixture(params=["memory", "sqlite"])
+def local_db(request, tmp_path):
+    if request.param == "memory":
+        return MemoryDatabase("test")
+    return SqliteDatabase("test", str(tmp_path / "test.sqlite3"))
+
+
+# The shared db the models write to, emptied around each test that uses it
+@pytest.fixture
+def shared_db():
+    def clear():
+        for name in db.list_collection_names():
+            db.drop_collection(name)
+
+    clear()
+    yield db
+    clear()
+
+
+def pokemon_document(name: str, max_hp: int = 25) -> dict:
+    return {
+        "name": name,
+        "max hp": max_hp,
+        "image": "",
+        "attack skills": {"Tackle": 3, "Blast": 6},
+        "defense skills": {"Endure": 1},
+        "battle wins": 0,
+        "battle losses": 0,
+        "tournament wins": 0,
+        "tournament losses": 0,
+    }
+
+
+# Eight pokemon in the shared db, with the roster cache reading them afresh
+@pytest.fixture
+def roster(shared_db):
+    from models.roster import roster_cache
+
+    names = [f"Mon{i}" for i in range(8)]
+    shared_db.pokemon.insert_many(
+        [pokemon_document(name, 20 + 3 * i) for i, name in enumerate(names)]
+    )
+    roster_cache.clear()
+    yield names
+    roster_cache.clear()
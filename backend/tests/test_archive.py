@@ -0,0 +1,73 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from models.archive import ArchiveError, BattleArchive, Segment, write_segment
+
+
+def battle(battle_id: int) -> dict:
+    return {
+        "battle id": battle_id,
+        "pokemon1": "a",
+        "pokemon2": "b",
+        "winner": battle_id % 2,
+        "events": [[0, 0, 0, battle_id, 0]],
+    }
+
+
+def test_segment_binary_search(tmp_path):
+    # Written out of order, with gaps, sorted by the index
+    battle_ids = list(range(100, 0, -3))
+    assert write_segment(str(tmp_path), 1, map(battle, battle_ids)) == sorted(
+        battle_ids
+    )
+    segment = Segment(str(tmp_path), 1)
+    try:
+        assert segment.size() == len(battle_ids)
+        assert (segment.get_first_id(), segment.get_last_id()) == (1, 100)
+        for battle_id in range(-1, 103):
+            found = segment.find(battle_id)
+            if battle_id in battle_ids:
+                assert found == battle(battle_id)
+            else:
+                assert found is None
+        assert [d["battle id"] for d in segment.iter_documents()] == sorted(battle_ids)
+    finally:
+        segment.close()
+
+
+def test_empty_segment_is_not_written(tmp_path):
+    assert write_segment(str(tmp_path), 1, []) == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_bad_index(tmp_path):
+    write_segment(str(tmp_path), 1, [battle(1)])
+    with open(tmp_path / "00000001.idx", "r+b") as index_file:
+        index_file.write(b"XXXX")
+    with pytest.raises(ArchiveError):
+        Segment(str(tmp_path), 1)
+
+
+def test_archive_moves_old_battles(shared_db, tmp_path):
+    archive = BattleArchive(str(tmp_path / "archive"))
+    shared_db.battle.insert_many([battle(battle_id) for battle_id in range(1, 11)])
+    # Nothing stored before an hour ago
+    assert archive.archive(datetime.now(timezone.utc) - timedelta(hours=1)) == 0
+
+    assert archive.archive(datetime.now(timezone.utc) + timedelta(minutes=1)) == 10
+    assert shared_db.battle.count_documents({}) == 0
+    assert archive.size() == 10
+    assert archive.find_battle(4) == battle(4)
+    assert archive.find_battle(11) is None
+    assert [d["battle id"] for d in archive.find_battles([9, 2, 42])] == [9, 2]
+
+    # A later run seals a new segment; reads merge both in id order
+    shared_db.battle.insert_many([battle(battle_id) for battle_id in (12, 11)])
+    assert archive.archive(datetime.now(timezone.utc) + timedelta(minutes=1)) == 2
+    assert len(archive.get_segments()) == 2
+    assert [d["battle id"] for d in archive.iter_battles()] == list(range(1, 13))
+
+    archive.clear()
+    assert archive.size() == 0
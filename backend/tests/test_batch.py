@@ -0,0 +1,32 @@
+from models.batch import run_batch_job
+from models.events import Verbosity
+
+
+def pokemon_document(name: str) -> dict:
+    return {
+        "name": name,
+        "max hp": 25,
+        "image": "",
+        "attack skills": {"Tackle": 3, "Blast": 6},
+        "defense skills": {"Endure": 1},
+    }
+
+
+def job(raw: bool):
+    return (
+        1,
+        pokemon_document("Mew"),
+        pokemon_document("Ditto"),
+        7,
+        Verbosity.FULL.value,
+        raw,
+    )
+
+
+def test_events_are_rendered_unless_raw():
+    rendered = run_batch_job(job(False))
+    raw = run_batch_job(job(True))
+    assert all(isinstance(event, str) for event in rendered["events"])
+    assert all(not isinstance(event, str) for event in raw["events"])
+    assert len(rendered["events"]) == len(raw["events"])
+    assert rendered["winner"] == raw["winner"]
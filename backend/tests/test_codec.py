@@ -0,0 +1,140 @@
+import zlib
+
+import bson
+import pytest
+
+from models import codec
+from models.battle import Battle, Battle_Data, StorageMode
+from models.pokemon import AttackSkill, DefenseSkill, Pokemon
+
+
+@pytest.fixture(autouse=True)
+def zlib_compression(monkeypatch):
+    monkeypatch.setattr(codec, "EVENT_COMPRESSION", "zlib")
+
+
+def make_pokemon(name: str, hp: int) -> Pokemon:
+    return Pokemon(
+        name=name,
+        max_hp=hp,
+        image="",
+        attack_skills=[AttackSkill("Tackle", 2), AttackSkill("Blast", 5)],
+        defense_skills=[DefenseSkill("Endure", 1), DefenseSkill("Protect", 3)],
+    )
+
+
+def play(seed: int) -> Battle:
+    battle = Battle(make_pokemon("Ditto", 30), make_pokemon("Mew", 27), seed, seed)
+    battle.play()
+    return battle
+
+
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, 300, -(2**40), 2**62])
+def test_varint_round_trip(value):
+    out = bytearray()
+    codec.write_varint(out, value)
+    assert codec.read_varint(bytes(out), 0) == (value, len(out))
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_battle_round_trip(monkeypatch, seed):
+    monkeypatch.setattr(codec, "EVENT_COMPRESSION", "off")
+    document = Battle_Data(play(seed), StorageMode.FULL).get_battle_data()
+    monkeypatch.setattr(codec, "EVENT_COMPRESSION", "zlib")
+    packed = Battle_Data(play(seed), StorageMode.FULL).get_battle_data()
+    assert set(packed) == {"battle id", codec.PACKED_EVENTS}
+    assert len(packed[codec.PACKED_EVENTS]) < len(bson.encode(document))
+    # Compared through BSON: unpacked events are lists, played ones tuples
+    unpacked = codec.unpack_battle(bson.decode(bson.encode(packed)))
+    assert unpacked == bson.decode(bson.encode(document))
+
+
+def test_text_events_round_trip():
+    document = {
+        "battle id": 1,
+        "events": ["Welcome!", (0, 0, 1, 0, 0), "The end"],
+        "attack skills": [["Tackle"], ["Blast", "Bite"]],
+        "defense skills": [[], ["Endure"]],
+    }
+    unpacked = codec.unpack_battle(codec.pack_battle(document))
+    assert unpacked["events"] == ["Welcome!", [0, 0, 1, 0, 0], "The end"]
+    assert unpacked["defense skills"] == [[], ["Endure"]]
+
+
+def test_none_and_missing_fields_round_trip():
+    document = {"battle id": 2, "pokemon1": "Mew", "seed": None, "winner": 0}
+    assert codec.unpack_battle(codec.pack_battle(document)) == dict(
+        document, events=[], **{"attack skills": [], "defense skills": []}
+    )
+
+
+def test_small_payloads_are_stored_as_they_are():
+    blob = codec.compress(b"\x01\x02")
+    assert blob == bytes([codec.FORMAT, codec.Compressor.NONE, 1, 2])
+    assert codec.decompress(blob) == b"\x01\x02"
+
+
+# What format 1 wrote: skill names per side, text lines, then the columns
+def test_format_1_blobs_are_read():
+    payload = bytearray()
+    for skills in ([["Tackle"], ["Blast"]], [["Endure"], []]):
+        codec.write_varint(payload, len(skills))
+        for names in skills:
+            codec.write_strings(payload, names)
+    codec.write_strings(payload, ["Go!"])
+    codec.write_columns(payload, [(-1, 0, 0, 0, 0), (1, 1, 0, 5, 20)], 5)
+    document = {
+        "battle id": 3,
+        "pokemon1": "Mew",
+        codec.PACKED_EVENTS: bytes([1, codec.Compressor.ZLIB])
+        + zlib.compress(bytes(payload)),
+    }
+    assert codec.unpack_battle(document) == {
+        "battle id": 3,
+        "pokemon1": "Mew",
+        "events": ["Go!", [1, 1, 0, 5, 20]],
+        "attack skills": [["Tackle"], ["Blast"]],
+        "defense skills": [["Endure"], []],
+    }
+
+
+def test_zstd_round_trip(monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(codec, "EVENT_COMPRESSION", "off")
+    document = Battle_Data(play(4), StorageMode.FULL).get_battle_data()
+    monkeypatch.setattr(codec, "EVENT_COMPRESSION", "zstd")
+    packed = codec.pack_battle(document)
+    assert packed[codec.PACKED_EVENTS][1] in (
+        codec.Compressor.ZSTD,
+        codec.Compressor.NONE,
+    )
+    assert codec.unpack_battle(packed) == bson.decode(bson.encode(document))
+
+
+def test_unpacked_documents_are_left_alone():
+    document = {"battle id": 1, "events": [[0, 0, 0, 0, 0]]}
+    assert codec.unpack_battle(document) is document
+
+
+def test_rounds_and_tournament_round_trip():
+    rounds = [
+        {
+            "round": 1,
+            "events": [
+                {"battle_id": 10, "winner": "a", "loser": "b"},
+                {"battle_id": 11, "winner": "c", "loser": "d"},
+            ],
+        },
+        {"round": 2, "events": [{"battle_id": 12, "winner": "c", "loser": "a"}]},
+    ]
+    assert codec.unpack_rounds(codec.pack_rounds(rounds)) == rounds
+
+    document = {"tournament id": 3, "participants": ["a", "b", "c", "d"]}
+    assert codec.unpack_tournament(codec.pack_tournament(document)) == document
+    document["events"] = rounds
+    assert codec.unpack_tournament(codec.pack_tournament(document)) == document
+
+
+def test_unknown_format():
+    with pytest.raises(codec.CodecError):
+        codec.decompress(b"\x09\x01garbage")
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+from threading import Event
+
+import pytest
+
+from models.dbservice import DbService
+from models.jobs import JobQueue, JobTakenOver, TournamentJob
+
+
+def stale_job(job_id: str, names: list) -> dict:
+    return {
+        "_id": job_id,
+        "status": "queued",
+        "tournament id": None,
+        "participants": names,
+        "seed": 7,
+        "verbosity": "full",
+        "owner": "gone",
+        "heartbeat": datetime.now(timezone.utc) - timedelta(minutes=5),
+        "finished": None,
+    }
+
+
+def test_save_stops_once_another_queue_owns_the_job(roster, shared_db):
+    job = TournamentJob(DbService().get_pokemon_many(roster[:2]), 7)
+    job.set_owner("first")
+    job.save()
+    shared_db.job.update_one({"_id": job.get_job_id()}, {"$set": {"owner": "second"}})
+    with pytest.raises(JobTakenOver):
+        job.save()
+
+    # The run stops at its first save and leaves the job to its new owner
+    job.run()
+    document = shared_db.job.find_one({"_id": job.get_job_id()})
+    assert document["owner"] == "second"
+    assert document["status"] == "queued"
+    assert document["tournament id"] is None
+
+
+def test_recover_respects_the_queue_limit(roster, shared_db, monkeypatch):
+    # Taken-over jobs hold their slots until released
+    release = Event()
+    monkeypatch.setattr(TournamentJob, "run", lambda job: release.wait(5))
+    shared_db.job.insert_many([stale_job(f"stale{i}", roster[:2]) for i in range(4)])
+    queue = JobQueue(max_workers=1, max_queued=1)
+    try:
+        assert queue.recover() == 2
+        assert queue.get_pending() == 2
+    finally:
+        release.set()
+        queue.shutdown()
+    assert queue.get_pending() == 0
+    owners = [document["owner"] for document in shared_db.job.find()]
+    assert owners.count("gone") == 2
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from models.logger import Logger
+from models.ratings import (
+    ELO_K,
+    INITIAL_RATING,
+    FenwickTree,
+    RatingEngine,
+    RatingTable,
+    RatingTally,
+)
+
+
+def test_fenwick_prefix_and_find():
+    pick = random.Random(1)
+    counts = [0] * 50
+    tree = FenwickTree(len(counts))
+    for _ in range(500):
+        position = pick.randrange(len(counts))
+        delta = 1 if counts[position] == 0 or pick.random() < 0.7 else -1
+        counts[position] += delta
+        tree.add(position, delta)
+
+    for position in range(len(counts) + 1):
+        assert tree.prefix(position) == sum(counts[:position])
+    items = [position for position, count in enumerate(counts) for _ in range(count)]
+    for k, position in enumerate(items):
+        assert tree.find(k) == position
+
+
+def test_rating_table_matches_sorting():
+    pick = random.Random(2)
+    table = RatingTable()
+    ratings = {}
+    for step in range(3000):
+        name = f"p{pick.randrange(300)}"
+        # Ties and ratings outside the buckets still rank correctly
+        rating = 1500.0 if step % 7 == 0 else pick.uniform(-200, 4500)
+        table.set_rating(name, rating)
+        ratings[name] = rating
+        if step % 11 == 0:
+            removed = f"p{pick.randrange(300)}"
+            table.remove(removed)
+            ratings.pop(removed, None)
+
+    order = sorted(ratings, key=lambda name: (-ratings[name], name))
+    assert table.size() == len(order)
+    for rank, name in enumerate(order, 1):
+        assert table.get_rank(name) == rank
+    assert [name for _, name, _ in table.get_range(1, table.size())] == order
+    assert [rank for rank, _, _ in table.get_range(37, 90)] == list(range(37, 91))
+    assert [name for _, name, _ in table.get_range(37, 90)] == order[36:90]
+    assert table.get_range(table.size() - 1, table.size() + 10)[-1][0] == table.size()
+    assert table.get_rank("nobody") is None
+
+
+def test_tally_rates_only_on_flush(shared_db):
+    engine = RatingEngine()
+    tally = RatingTally()
+    tally.record_battle("a", "b")
+    tally.record_battle("a", "c")
+    assert engine.get_rating("a") is None
+    assert shared_db.rating.count_documents({}) == 0
+
+    assert tally.flush(Logger(), engine) == 3
+    assert tally.is_empty()
+    first = ELO_K / 2
+    assert engine.get_rating("b")["rating"] == round(INITIAL_RATING - first, 2)
+    assert engine.get_rating("a")["battles"] == 2
+    assert engine.get_rating("a")["rank"] == 1
+    stored = shared_db.rating.find_one({"name": "a"})
+    assert stored["battles"] == 2
+    assert round(stored["rating"], 2) == engine.get_rating("a")["rating"]
+
+
+def test_concurrent_engines_keep_both_changes(shared_db):
+    logger = Logger()
+    first, second = RatingEngine(), RatingEngine(refresh_seconds=0)
+    first.rate([("a", "b")], logger)
+    second.get_table()
+    first.rate([("a", "b")], logger)
+    # Rated from a stale table, but from the stored rating
+    second.rate([("a", "c")], logger)
+    stored = shared_db.rating.find_one({"name": "a"})
+    assert stored["battles"] == 3
+    assert second.get_rating("b")["battles"] == 2
+    assert second.get_rating("a")["rating"] == round(stored["rating"], 2)
+
+
+def test_detached_engine_stays_in_memory(shared_db):
+    engine = RatingEngine([{"name": "a", "rating": 1600.0, "battles": 4}])
+
+    class Discard:
+        def bulk_write(self, collection, operations):
+            pass
+
+    engine.rate([("b", "a")], Discard())
+    assert engine.get_rating("a")["battles"] == 5
+    assert engine.get_rating("a")["rating"] < 1600
+    assert engine.get_rating("b")["rank"] == 2
+    assert shared_db.counters.count_documents({}) == 0
@@ -0,0 +1,137 @@
+import pytest
+from pymongo import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def names(documents):
+    return [document["name"] for document in documents]
+
+
+def test_find_sort_limit_projection(local_db):
+    local_db.pokemon.insert_many(
+        [{"name": name, "hp": hp} for name, hp in (("b", 2), ("a", 3), ("c", 1))]
+    )
+    found = list(local_db.pokemon.find({}, {"_id": 0}).sort("hp", -1).limit(2))
+    assert found == [{"name": "a", "hp": 3}, {"name": "b", "hp": 2}]
+    assert names(local_db.pokemon.find({"hp": {"$gte": 2}}).sort("name", 1)) == [
+        "a",
+        "b",
+    ]
+    assert names(local_db.pokemon.find({"name": {"$in": ["c", "x"]}})) == ["c"]
+    assert local_db.pokemon.count_documents({"hp": {"$ne": 1}}) == 2
+
+
+def test_update_operators_and_upsert(local_db):
+    local_db.counters.update_one({"_id": "ids"}, {"$inc": {"value": 5}}, upsert=True)
+    local_db.counters.update_one({"_id": "ids"}, {"$inc": {"value": 1}}, upsert=True)
+    assert local_db.counters.find_one({"_id": "ids"})["value"] == 6
+
+    document = local_db.counters.find_one_and_update(
+        {"_id": "ids"}, {"$inc": {"value": 1}}, return_document=ReturnDocument.AFTER
+    )
+    assert document["value"] == 7
+
+    result = local_db.pokemon.update_one(
+        {"name": "a"}, {"$setOnInsert": {"wins": 0}, "$set": {"hp": 1}}, upsert=True
+    )
+    assert result.upserted_id is not None
+    local_db.pokemon.update_one(
+        {"name": "a"}, {"$setOnInsert": {"wins": 9}, "$set": {"hp": 2}}, upsert=True
+    )
+    assert local_db.pokemon.find_one({"name": "a"}, {"_id": 0}) == {
+        "name": "a",
+        "wins": 0,
+        "hp": 2,
+    }
+
+
+def test_update_pipeline(local_db):
+    local_db.rating.insert_one({"name": "a", "wins": 3, "losses": 0})
+    local_db.rating.update_one(
+        {"name": "a"},
+        [
+            {
+                "$set": {
+                    "losses": {"$add": [{"$ifNull": ["$losses", 0]}, 2]},
+                    "ratio": {
+                        "$cond": [
+                            {"$gt": ["$losses", 0]},
+                            {"$divide": ["$wins", "$losses"]},
+                            0,
+                        ]
+                    },
+                }
+            }
+        ],
+    )
+    document = local_db.rating.find_one({"name": "a"})
+    assert document["losses"] == 2
+    # Stages see the document as it was before the stage
+    assert document["ratio"] == 0
+
+
+def test_unique_index(local_db):
+    local_db.pokemon.create_index("name", unique=True)
+    local_db.pokemon.insert_one({"name": "a"})
+    with pytest.raises(DuplicateKeyError):
+        local_db.pokemon.insert_one({"name": "a"})
+    assert local_db.pokemon.count_documents({}) == 1
+
+
+def test_bulk_write_models(local_db):
+    local_db.battle.insert_many([{"id": i, "seen": False} for i in range(6)])
+    result = local_db.battle.bulk_write(
+        [
+            InsertOne({"id": 6, "seen": False}),
+            UpdateOne({"id": 0}, {"$set": {"seen": True}}),
+            UpdateOne({"id": 7}, {"$set": {"seen": True}}, upsert=True),
+            UpdateMany({"id": {"$lt": 3}}, {"$set": {"old": True}}),
+            ReplaceOne({"id": 3}, {"id": 3, "replaced": True}),
+            DeleteOne({"id": 4}),
+            DeleteMany({"id": {"$in": [5, 6]}}),
+        ]
+    )
+    assert result.inserted_count == 1
+    assert result.upserted_count == 1
+    assert result.matched_count == 1 + 3 + 1
+    assert result.deleted_count == 3
+    assert local_db.battle.count_documents({"old": True}) == 3
+    assert local_db.battle.find_one({"id": 3}, {"_id": 0}) == {
+        "id": 3,
+        "replaced": True,
+    }
+    assert sorted(d["id"] for d in local_db.battle.find()) == [0, 1, 2, 3, 7]
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_bulk_write_errors(local_db, ordered):
+    local_db.pokemon.create_index("name", unique=True)
+    local_db.pokemon.insert_one({"name": "a"})
+    with pytest.raises(BulkWriteError) as raised:
+        local_db.pokemon.bulk_write(
+            [
+                InsertOne({"name": "b"}),
+                InsertOne({"name": "a"}),
+                InsertOne({"name": "c"}),
+            ],
+            ordered=ordered,
+        )
+    errors = raised.value.details["writeErrors"]
+    assert [error["index"] for error in errors] == [1]
+    assert errors[0]["code"] == 11000
+    # Ordered writes stop at the first error, unordered ones carry on
+    expected = ["a", "b"] if ordered else ["a", "b", "c"]
+    assert sorted(names(local_db.pokemon.find())) == expected
+
+
+def test_bulk_write_rejects_unknown_requests(local_db):
+    with pytest.raises(TypeError):
+        local_db.pokemon.bulk_write([{"insertOne": {"name": "a"}}])
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import models.tournament
+from models.battlemanager import BattleManager
+from models.dbservice import DbService
+from models.stats import StatsTally
+from models.tournament import (
+    CheckpointHeld,
+    RoundNotSaved,
+    Tournament,
+    Tournament_Checkpoint,
+)
+
+SEED = 7
+
+
+# Plays a new seeded tournament up to its nth battle, as a run that crashes
+def crash_after(names: list, battles: int):
+    manager = BattleManager(SEED)
+    tournament = manager.create_tournament(DbService().get_pokemon_many(names))
+    progress = manager.stream_tournament(tournament)
+    played = 0
+    while played < battles:
+        kind, _ = next(progress)
+        played += kind == "battle"
+    return tournament.get_tournament_id(), progress
+
+
+class Crash(Exception):
+    pass
+
+
+# The nth call of owner.name raises instead, as if the process died there
+def crash_at(monkeypatch, owner, name: str, call: int) -> None:
+    original = getattr(owner, name)
+    calls = []
+
+    def crashing(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == call:
+            monkeypatch.setattr(owner, name, original)
+            raise Crash(name)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(owner, name, crashing)
+
+
+def totals(db) -> dict:
+    fields = ["battle wins", "battle losses", "tournament wins", "tournament losses"]
+    documents = list(db.pokemon.find())
+    return {field: sum(document[field] for document in documents) for field in fields}
+
+
+def expire_lease(db, tournament_id: int) -> None:
+    db.tournament_checkpoint.update_one(
+        {"tournament id": tournament_id},
+        {"$set": {"lease until": datetime.now(timezone.utc) - timedelta(seconds=1)}},
+    )
+
+
+def test_round_with_failed_writes_is_not_checkpointed(roster, shared_db, monkeypatch):
+    def failing_bulk_write(select, operations):
+        raise BulkWriteError(
+            {
+                "writeErrors": [{"index": 0, "errmsg": "disk full"}],
+                "nUpserted": 0,
+                "nModified": 0,
+            }
+        )
+
+    monkeypatch.setattr(models.tournament.logger, "bulk_write", failing_bulk_write)
+    tournament = Tournament(DbService().get_pokemon_many(roster[:4]), 1, 1, 7)
+    with pytest.raises(RoundNotSaved, match="disk full"):
+        tournament.run_tournament()
+
+    checkpoint = shared_db.tournament_checkpoint.find_one({"tournament id": 1})
+    assert checkpoint["round"] == 0
+    assert shared_db.pokemon.count_documents({"battle wins": {"$gt": 0}}) == 0
+
+
+def test_checkpoint_is_resumed_by_one_run_at_a_time(roster, shared_db):
+    manager = BattleManager(SEED)
+    expected = manager.start_tournament(
+        manager.create_tournament(DbService().get_pokemon_many(roster))
+    ).get_name()
+
+    # Held by the run still playing it
+    tournament_id, crashed = crash_after(roster, 5)
+    with pytest.raises(CheckpointHeld):
+        BattleManager(SEED).resume_tournament(tournament_id)
+
+    # Its process died; once the lease runs out exactly one resume gets it
+    expire_lease(shared_db, tournament_id)
+    resumed = BattleManager(SEED).resume_tournament(tournament_id)
+    with pytest.raises(CheckpointHeld):
+        BattleManager(SEED).resume_tournament(tournament_id)
+
+    assert BattleManager(SEED).start_tournament(resumed).get_name() == expected
+    assert shared_db.tournament_checkpoint.count_documents({}) == 0
+    crashed.close()
+
+
+def test_stopped_run_frees_its_checkpoint(roster, shared_db):
+    tournament_id, stopped = crash_after(roster, 2)
+    stopped.close()
+    assert BattleManager(SEED).resume_tournament(tournament_id) is not None
+
+
+# Round checkpoint, round stats, tournament stats, tournament document
+@pytest.mark.parametrize(
+    "owner, name, call",
+    [
+        (Tournament_Checkpoint, "save", 3),
+        (StatsTally, "flush", 2),
+        (StatsTally, "flush", 4),
+        (Tournament_Checkpoint, "discard", 1),
+    ],
+)
+def test_crash_and_resume_counts_and_rates_every_result_once(
+    roster, shared_db, monkeypatch, owner, name, call
+):
+    manager = BattleManager(SEED)
+    tournament = manager.create_tournament(DbService().get_pokemon_many(roster))
+    crash_at(monkeypatch, owner, name, call)
+    with pytest.raises(Crash):
+        manager.start_tournament(tournament)
+
+    resumed = BattleManager(SEED).resume_tournament(tournament.get_tournament_id())
+    BattleManager(SEED).start_tournament(resumed)
+    assert totals(shared_db) == {
+        "battle wins": 7,
+        "battle losses": 7,
+        "tournament wins": 1,
+        "tournament losses": 7,
+    }
+    # Two pokemon rated per battle
+    assert sum(document["battles"] for document in shared_db.rating.find()) == 14
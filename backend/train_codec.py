@@ -0,0 +1,15 @@
+import sys
+
+from models import codec
+
+# Trains a zstd dictionary on the most recent stored battles. Blobs written
+# with EVENT_COMPRESSION=zstd after it use it; older blobs keep the id of the
+# dictionary they were written with, so earlier dictionaries are never removed.
+# Run it with the app stopped: a running app keeps the dictionary it loaded.
+if __name__ == "__main__":
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else codec.DICTIONARY_SAMPLES
+    try:
+        dictionary_id = codec.train_dictionary(samples)
+    except codec.CodecError as e:
+        raise SystemExit(str(e))
+    print(f"Codec dictionary {dictionary_id} trained on up to {samples} battles.")